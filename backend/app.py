@@ -1,46 +1,126 @@
 # app.py — FastAPI backend (PDF-only) with:
-# - ADLS upload (PDF bytes -> Markdown in-memory)
-# - Atomic PDF→Markdown twin generation
+# - ADLS upload (streamed PDF -> Markdown) via async, pooled storage client
+# - Atomic PDF→Markdown twin generation (inline, or as a background job + GET /jobs/{id})
+# - Per-user manifest (listing + twin resolution in a single read)
 # - ONE validation route that:
 #     * finds the latest input PDF for the user
 #     * finds ALL reference PDFs for the user
 #     * validates the input's Markdown against each reference's Markdown
+#   (also available as Server-Sent Events at /validate/stream)
 # - User-space bootstrap: creates required folders on first login (idempotent)
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
+import asyncio
 import os
 import os.path as op
 import mimetypes
 import uuid
-from typing import List, Optional, Tuple
-from datetime import datetime
+import hashlib
+import json
+import re
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects import AIProjectClient
-from azure.storage.filedatalake import DataLakeServiceClient
-from azure.core.exceptions import AzureError
-
 from azure.monitor.opentelemetry import configure_azure_monitor
 from opentelemetry.instrumentation.openai_v2 import OpenAIInstrumentor
 
-import tiktoken
+# PDF -> Markdown layout analysis runs on a pool of warm worker processes
+from conversion import convert_pdf, warm_up as warm_conversion_pool, shutdown_conversion_pool
+
+# Reuse image-description helpers
+from pdf_to_markdown_with_image_descriptions import replace_images_with_text
+
+# Process-wide credential, HTTP pools and OpenAI client
+from clients import (
+    get_project_client,
+    get_openai_client,
+    get_shared_credential,
+    close_shared_clients,
+    counters as client_counters,
+)
+
+# Shared RPM/TPM admission for every LLM call
+from llm_scheduler import get_scheduler
+
+# Validation engine: chunking + concurrent LLM fan-out (batch or streamed)
+from validation import (
+    run_validations,
+    stream_validations,
+    get_result_cache,
+    ReferenceAids,
+    ReferenceResult,
+    RunStats,
+    prompt_cost_usd,
+)
+
+# Token accounting: one encoder, memoized counts (token_count goes into the manifest)
+from tokens import count_tokens, stats as token_stats
+
+# Local BM25 index per reference (sidecar next to the twin) to prune unrelated chunks
+from retrieval import build_index, serialize_index, load_index, index_path_for_twin
+
+# Heading-aware chunk blocks per reference (sidecar next to the twin), packed per validation
+from chunking import split_blocks, serialize_blocks, load_blocks, chunks_path_for_twin
+
+# Incremental re-validation: per-(input, instructions) run records in ADLS
+from runs import load_prior_results, save_run_record
+
+# Cheap relevance screen before the full analysis (per-deployment routes)
+from triage import triage_cost_usd
+
+# Optional input digest (sidecar next to the input twin), sent instead of the full input
+from digest import VALIDATION_DIGEST_ENABLED, Digest, DigestError, digest_path_for_twin, load_or_create_digest
 
-# In-memory PDF -> Markdown (no temp files)
-import fitz  # PyMuPDF
-import pymupdf4llm
+# Async ADLS helpers (one pooled client per process)
+from storage import (
+    ensure_user_folders_exist,
+    upload_file_to_adls,
+    upload_local_file_to_adls,
+    download_file_from_adls,
+    download_optional_file_from_adls,
+    safe_delete,
+    close_adls_client,
+    to_md_folder,
+)
 
-# Reuse image-description & client helpers
-from pdf_to_markdown_with_image_descriptions import (
-    replace_images_with_text,
-    get_openai_client,  # uses Azure AI Projects + DefaultAzureCredential
+# Per-user manifest: file listing + twin resolution in one read
+from manifest import (
+    get_manifest,
+    load_manifest,
+    rebuild_manifest,
+    manifest_files,
+    upsert_entry,
+    update_manifest,
+    remove_entry,
+    make_entry,
+    TWIN_READY,
+    TWIN_PENDING,
 )
 
-from prompts import VALIDATION_SYSTEM_PROMPT, get_validation_user_prompt
+# Background PDF→Markdown conversion (202 + GET /jobs/{id})
+from jobs import (
+    JOB_OWNER,
+    JobQueue,
+    ConversionJob,
+    owner_exited,
+    process_alive,
+    STAGE_CONVERTING,
+    STAGE_DESCRIBING_IMAGES,
+    STAGE_UPLOADING,
+    STAGE_INDEXING,
+    STAGE_DONE,
+    STAGE_FAILED,
+)
 
 # ------------------------------------------------------------------------------
 # Environment & global setup
@@ -48,7 +128,20 @@ from prompts import VALIDATION_SYSTEM_PROMPT, get_validation_user_prompt
 
 load_dotenv()
 
-app = FastAPI(title="Document Validator API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_shared_credential().start_background_refresh()
+    await warm_conversion_pool()
+    await _recover_interrupted_uploads()
+    job_queue.start()
+    yield
+    # Release the pooled ADLS client, OpenAI client and credential on shutdown
+    await job_queue.stop()
+    shutdown_conversion_pool()
+    await close_adls_client()
+    close_shared_clients()
+
+app = FastAPI(title="Document Validator API", lifespan=lifespan)
 
 # CORS (open for dev; restrict origins in prod)
 app.add_middleware(
@@ -65,8 +158,8 @@ MODEL_DEPLOYMENT_NAME = os.getenv("MODEL_DEPLOYMENT_NAME")
 if not PROJECT_ENDPOINT or not MODEL_DEPLOYMENT_NAME:
     raise ValueError("PROJECT_ENDPOINT and MODEL_DEPLOYMENT_NAME must be set in environment")
 
-project_client = AIProjectClient(credential=DefaultAzureCredential(), endpoint=PROJECT_ENDPOINT)
-openai_client = project_client.get_openai_client(api_version="2024-02-01")
+project_client = get_project_client()
+openai_client = get_openai_client()
 
 # Tracing (best-effort, non-fatal)
 try:
@@ -78,13 +171,10 @@ try:
 except Exception as e:
     print(f"⚠️ Tracing setup failed (continuing without tracing): {e}")
 
-# ADLS config
-STORAGE_ACCOUNT_NAME = os.getenv("STORAGE_ACCOUNT_NAME", "djg0storage0shared")
-CONTAINER_NAME = os.getenv("CONTAINER_NAME", "shared")
-
-# Tokenization constants
-MAX_TOKENS = 50000
-ENCODING_NAME = "cl100k_base"
+# Uploads are spooled to local disk and streamed to ADLS; never held in memory whole
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "256")) * 1024 * 1024
+UPLOAD_SPOOL_CHUNK_BYTES = 1024 * 1024
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None  # None = system temp dir
 
 # Simple user scoping (replace if/when you add auth)
 HARDCODED_USER_ID = "dangiannone"
@@ -97,6 +187,9 @@ class ValidationResult(BaseModel):
     success: bool
     message: str
     raw_output: Optional[str] = None
+    stats: Optional[Dict[str, int]] = None
+    reused: Optional[List[str]] = None  # references merged in from a previous run record
+    cost_usd: Optional[float] = None    # estimated prompt cost of this run (PROMPT_TOKEN_COST_PER_1K)
 
 class UploadResponse(BaseModel):
     success: bool
@@ -108,221 +201,343 @@ class UploadResponse(BaseModel):
     markdown_file_path: Optional[str] = None
 
 # --------------------------------------------------------------------------
-# ADLS helpers
-# --------------------------------------------------------------------------
-
-def get_adls_client() -> DataLakeServiceClient:
-    try:
-        account_url = f"https://{STORAGE_ACCOUNT_NAME}.dfs.core.windows.net/"
-        credential = DefaultAzureCredential()
-        return DataLakeServiceClient(account_url=account_url, credential=credential)
-    except Exception as e:
-        print(f"Failed to connect to ADLS: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to connect to storage: {str(e)}")
-
-def ensure_user_folders_exist(service_client: DataLakeServiceClient, user_id: str):
-    """
-    Ensure container and user folders exist, including Markdown mirrors:
-      <user_id>/
-      <user_id>/input_docs
-      <user_id>/reference_docs
-      <user_id>/input_docs_md
-      <user_id>/reference_docs_md
-    """
-    try:
-        fs = service_client.get_file_system_client(CONTAINER_NAME)
-        if not fs.exists():
-            fs.create_file_system()
-            print(f"✅ Created container: {CONTAINER_NAME}")
-
-        folders_to_create = [
-            f"{user_id}",
-            f"{user_id}/input_docs",
-            f"{user_id}/reference_docs",
-            f"{user_id}/input_docs_md",
-            f"{user_id}/reference_docs_md",
-        ]
-        for folder_path in folders_to_create:
-            try:
-                dc = fs.get_directory_client(folder_path)
-                if not dc.exists():
-                    dc.create_directory()
-                    print(f"✅ Created directory: {folder_path}")
-            except AzureError as e:
-                if "PathAlreadyExists" not in str(e):
-                    print(f"⚠️ Error creating directory {folder_path}: {e}")
-        return fs
-    except Exception as e:
-        print(f"❌ Error ensuring folders exist: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to create user folders: {str(e)}")
-
-def upload_file_to_adls(file_system_client, file_content: bytes, file_path: str) -> bool:
-    try:
-        fc = file_system_client.get_file_client(file_path)
-        fc.create_file()
-        fc.append_data(file_content, offset=0, length=len(file_content))
-        fc.flush_data(len(file_content))
-        print(f"✅ Uploaded file to: {file_path}")
-        return True
-    except Exception as e:
-        print(f"❌ Error uploading file to {file_path}: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
-
-def download_file_from_adls(file_system_client, file_path: str) -> bytes:
-    try:
-        fc = file_system_client.get_file_client(file_path)
-        download = fc.download_file()
-        return download.readall()
-    except Exception as e:
-        print(f"❌ Error downloading file from {file_path}: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to download file: {str(e)}")
-
-def list_files_in_directory_detailed(file_system_client, directory_path: str) -> List[dict]:
-    try:
-        paths = file_system_client.get_paths(path=directory_path, recursive=False)
-        files = []
-        for p in paths:
-            if not p.is_directory:
-                fc = file_system_client.get_file_client(p.name)
-                try:
-                    props = fc.get_file_properties()
-                    files.append({
-                        "file_path": p.name,
-                        "original_filename": os.path.basename(p.name),
-                        "file_size": props.size,
-                        "upload_date": props.last_modified.isoformat() if props.last_modified else None
-                    })
-                except Exception as e:
-                    print(f"Error getting properties for {p.name}: {e}")
-        return files
-    except Exception as e:
-        print(f"❌ Error listing files in {directory_path}: {e}")
-        return []
-
-def delete_file_from_adls(file_system_client, file_path: str) -> bool:
-    try:
-        fc = file_system_client.get_file_client(file_path)
-        fc.delete_file()
-        print(f"✅ Deleted file: {file_path}")
-        return True
-    except Exception as e:
-        print(f"❌ Error deleting file {file_path}: {e}")
-        return False
-
-def adls_path_exists(file_system_client, file_path: str) -> bool:
-    try:
-        fc = file_system_client.get_file_client(file_path)
-        _ = fc.get_file_properties()
-        return True
-    except Exception:
-        return False
-
-def safe_delete(file_system_client, path: str) -> bool:
-    try:
-        fc = file_system_client.get_file_client(path)
-        fc.delete_file()
-        print(f"✅ Deleted: {path}")
-        return True
-    except Exception as e:
-        print(f"ℹ️ Skipped delete (likely missing): {path} ({e})")
-        return False
-
-# --------------------------------------------------------------------------
-# Markdown twin helpers (PDF-only)
+# PDF -> Markdown twin (PDF-only)
 # --------------------------------------------------------------------------
 
-def to_md_folder(raw_path: str) -> str:
+async def _pdf_to_markdown(source, job: Optional[ConversionJob] = None) -> str:
     """
-    Map raw PDF path to its Markdown twin path:
-      <user>/input_docs/foo.pdf -> <user>/input_docs_md/foo.md
-      <user>/reference_docs/bar.pdf -> <user>/reference_docs_md/bar.md
-    """
-    parts = raw_path.split("/")
-    if len(parts) < 3:
-        raise ValueError(f"Unexpected path shape: {raw_path}")
-    folder = parts[-2]
-    if folder.endswith("_md"):
-        base, _ = op.splitext(parts[-1])
-        parts[-1] = base + ".md"
-        return "/".join(parts)
-    md_folder = folder + "_md"
-    base, _ = op.splitext(parts[-1])
-    parts[-2] = md_folder
-    parts[-1] = base + ".md"
-    return "/".join(parts)
-
-def generate_markdown_from_pdf_bytes(file_bytes: bytes) -> str:
-    """
-    PDF bytes -> Markdown (with base64 images) -> replace images with text using LLM.
-    No disk I/O; fully in-memory.
+    PDF (path or bytes) -> Markdown (image placeholders + bytes) -> replace images with text using LLM.
+    Layout analysis runs page-parallel in the conversion process pool and image
+    descriptions on threads, so the event loop stays free. A background job's progress is updated along the way.
     """
     print("=" * 60)
-    print("🚀 Starting PDF(bytes) → Markdown pipeline")
+    print("🚀 Starting PDF → Markdown pipeline")
     print("=" * 60)
 
-    # Convert PDF bytes to Markdown using PyMuPDF doc object
-    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
-        md = pymupdf4llm.to_markdown(doc, embed_images=True, write_images=False)
-
-    print(f"📏 Markdown size: {len(md):,} characters")
+    converted = await convert_pdf(source, on_progress=job.set_pages if job else None)
+    if job:
+        job.set_stage(STAGE_DESCRIBING_IMAGES)
 
-    # Try to init OpenAI client (for image descriptions). Fallback to placeholders on failure.
-    try:
-        client = get_openai_client()
-        print(f"✅ OpenAI client initialized (model: {MODEL_DEPLOYMENT_NAME})")
-    except Exception as e:
-        print(f"[warn] Could not initialize OpenAI client; images will use placeholders. ({e})")
-        client = None
+    print(f"📏 Markdown size: {len(converted.markdown):,} characters ({converted.page_count} page(s))")
 
-    result = replace_images_with_text(md, client)
+    # Image descriptions reuse the shared OpenAI client (no per-upload credential/client)
+    result = await asyncio.to_thread(
+        replace_images_with_text, converted.markdown, openai_client,
+        on_progress=job.set_images if job else None,
+        images=converted.images,
+        image_format=converted.image_format,
+    )
 
     print("=" * 60)
     print("✅ Pipeline complete")
     print("=" * 60)
     return result
 
+async def generate_markdown_from_pdf_bytes(file_bytes: bytes) -> str:
+    """PDF bytes -> Markdown twin."""
+    return await _pdf_to_markdown(file_bytes)
+
+async def generate_markdown_from_pdf_file(pdf_path: str, job: Optional[ConversionJob] = None) -> str:
+    """PDF on local disk -> Markdown twin. Workers open the file themselves; no bytes are copied over."""
+    return await _pdf_to_markdown(pdf_path, job)
+
 # --------------------------------------------------------------------------
 # Upload endpoints — transactional: raw PDF + Markdown twin OR fail
 # --------------------------------------------------------------------------
 
-def _handle_upload_common_bytes(file_bytes: bytes, original_name: str, target_subdir: str) -> UploadResponse:
+@dataclass
+class SpooledUpload:
+    path: str
+    size: int
+    sha256: str
+
+async def _spool_upload(file: UploadFile) -> SpooledUpload:
     """
-    Core upload handler (pure sync): given the PDF bytes + original filename
-    - Generate Markdown twin FIRST (in-memory); if it fails, abort
-    - Upload BOTH raw PDF and MD twin to ADLS
+    Stream the request body to a local temp file in UPLOAD_SPOOL_CHUNK_BYTES pieces,
+    hashing as we go and enforcing MAX_UPLOAD_BYTES. Memory stays flat for any size.
     """
-    # Generate Markdown FIRST to make the operation atomic
+    digest = hashlib.sha256()
+    size = 0
+    tmp = tempfile.NamedTemporaryFile(prefix=f"upload-{os.getpid()}-", suffix=".pdf", dir=UPLOAD_SPOOL_DIR, delete=False)
     try:
-        md_text = generate_markdown_from_pdf_bytes(file_bytes)
+        with tmp:
+            while chunk := await file.read(UPLOAD_SPOOL_CHUNK_BYTES):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit",
+                    )
+                digest.update(chunk)
+                tmp.write(chunk)
+        return SpooledUpload(path=tmp.name, size=size, sha256=digest.hexdigest())
+    except BaseException:
+        os.remove(tmp.name)
+        raise
+
+def _sidecar_paths(md_path: str) -> List[str]:
+    return [chunks_path_for_twin(md_path), index_path_for_twin(md_path), digest_path_for_twin(md_path)]
+
+async def _store_reference_sidecars(fs, md_text: str, md_path: str):
+    """
+    Precompute the reference's chunk blocks and BM25 index next to its twin.
+    Optional: validation rebuilds either in memory if missing or stale.
+    """
+    try:
+        blocks, index = await asyncio.gather(
+            asyncio.to_thread(split_blocks, md_text),
+            asyncio.to_thread(build_index, md_text),
+        )
+        await asyncio.gather(
+            upload_file_to_adls(fs, serialize_blocks(md_text, blocks), chunks_path_for_twin(md_path)),
+            upload_file_to_adls(fs, serialize_index(index), index_path_for_twin(md_path)),
+        )
     except Exception as e:
-        print(f"❌ PDF→Markdown failed for {original_name}: {e}")
-        raise HTTPException(status_code=502, detail="Failed to convert PDF to Markdown; upload aborted.")
+        print(f"⚠️ Could not store sidecars for {md_path}: {e}")
 
+async def _handle_upload_common(upload: SpooledUpload, original_name: str, target_subdir: str) -> UploadResponse:
+    """
+    Core upload handler: given the spooled PDF + original filename
+    - Generate Markdown twin FIRST; if it fails, abort
+    - Stream the raw PDF to ADLS in blocks, then upload the MD twin
+    - Record both in the user's manifest
+    """
     # ADLS setup & ensured folders
-    service_client = get_adls_client()
-    fs = ensure_user_folders_exist(service_client, HARDCODED_USER_ID)
+    fs = await ensure_user_folders_exist(HARDCODED_USER_ID)
 
     # Compute paths
     raw_path = f"{HARDCODED_USER_ID}/{target_subdir}/{original_name}"
     md_path = to_md_folder(raw_path)
+    await _reject_if_converting(fs, raw_path)
+
+    # Generate Markdown FIRST to make the operation atomic
+    try:
+        md_text = await generate_markdown_from_pdf_file(upload.path)
+    except Exception as e:
+        print(f"❌ PDF→Markdown failed for {original_name}: {e}")
+        raise HTTPException(status_code=502, detail="Failed to convert PDF to Markdown; upload aborted.")
+
+    # Upload raw (streamed from the spool file) + twin
+    await upload_local_file_to_adls(fs, upload.path, raw_path)
+    await upload_file_to_adls(fs, md_text.encode("utf-8"), md_path)
+    if target_subdir == "reference_docs":
+        await _store_reference_sidecars(fs, md_text, md_path)
 
-    # Upload raw + twin
-    upload_file_to_adls(fs, file_bytes, raw_path)
-    upload_file_to_adls(fs, md_text.encode("utf-8"), md_path)
+    # Index the pair so listing/validation never have to scan the folders
+    await upsert_entry(fs, HARDCODED_USER_ID, make_entry(
+        file_path=raw_path,
+        file_size=upload.size,
+        upload_date=datetime.now(timezone.utc).isoformat(),
+        content_hash=upload.sha256,
+        twin_path=md_path,
+        twin_status=TWIN_READY,
+        token_count=await asyncio.to_thread(count_tokens, md_text),
+    ))
 
     return UploadResponse(
         success=True,
         message=f"Successfully uploaded {original_name} (+ Markdown twin)",
         file_id=str(uuid.uuid4()),
         file_path=raw_path,
-        file_size=len(file_bytes),
+        file_size=upload.size,
         original_filename=original_name,
         markdown_file_path=md_path
     )
 
+# --------------------------------------------------------------------------
+# Background uploads — raw PDF stored now, twin produced by a conversion job
+# --------------------------------------------------------------------------
+
+async def _reject_if_converting(fs, raw_path: str):
+    """A path with a conversion job still running can't be replaced until the job finishes."""
+    manifest, _ = await load_manifest(fs, HARDCODED_USER_ID)
+    entry = (manifest or {"files": {}})["files"].get(raw_path)
+    if entry is not None and entry["twin_status"] == TWIN_PENDING:
+        raise HTTPException(
+            status_code=409,
+            detail=f"{entry['original_filename']} is still being converted; upload it again once its job finishes.",
+        )
+
+async def _enqueue_conversion(upload: SpooledUpload, original_name: str, target_subdir: str) -> JSONResponse:
+    """
+    Store the raw PDF, index it as twin_status "pending" (validation refuses pending
+    twins) and queue its conversion. The job takes ownership of the spool file.
+    """
+    try:
+        fs = await ensure_user_folders_exist(HARDCODED_USER_ID)
+        raw_path = f"{HARDCODED_USER_ID}/{target_subdir}/{original_name}"
+        md_path = to_md_folder(raw_path)
+        await _reject_if_converting(fs, raw_path)
+        job = ConversionJob(
+            user_id=HARDCODED_USER_ID,
+            original_name=original_name,
+            target_subdir=target_subdir,
+            raw_path=raw_path,
+            twin_path=md_path,
+            spool_path=upload.path,
+            file_size=upload.size,
+            content_hash=upload.sha256,
+        )
+
+        await upload_local_file_to_adls(fs, upload.path, raw_path)
+        await upsert_entry(fs, HARDCODED_USER_ID, make_entry(
+            file_path=raw_path,
+            file_size=upload.size,
+            upload_date=datetime.now(timezone.utc).isoformat(),
+            content_hash=upload.sha256,
+            twin_path=md_path,
+            twin_status=TWIN_PENDING,
+            token_count=None,
+            job_id=job.job_id,
+            job_owner=JOB_OWNER,
+        ))
+    except BaseException:
+        os.remove(upload.path)
+        raise
+
+    job_queue.submit(job)
+    print(f"📥 Queued conversion job {job.job_id} for {raw_path}")
+    return JSONResponse(status_code=202, content={
+        "success": True,
+        "message": f"Uploaded {original_name}; Markdown twin is being generated",
+        "job_id": job.job_id,
+        "status_url": f"/jobs/{job.job_id}",
+        "file_path": raw_path,
+        "file_size": upload.size,
+        "original_filename": original_name,
+        "markdown_file_path": md_path,
+    })
+
+async def _remove_upload(fs, user_id: str, raw_path: str, twin_path: str, job_id: Optional[str] = None) -> bool:
+    """
+    Delete an upload's raw PDF, twin, sidecars and manifest entry. With `job_id`, only
+    while the entry still belongs to that job: a newer upload of the same path is left alone.
+    """
+    if job_id is not None:
+        manifest, _ = await load_manifest(fs, user_id)
+        entry = (manifest or {"files": {}})["files"].get(raw_path)
+        if entry is not None and entry.get("job_id") != job_id:
+            return False
+    await safe_delete(fs, twin_path)
+    for sidecar in _sidecar_paths(twin_path):
+        await safe_delete(fs, sidecar)
+    await safe_delete(fs, raw_path)
+
+    def _drop(manifest: dict):
+        entry = manifest["files"].get(raw_path)
+        if entry is not None and (job_id is None or entry.get("job_id") == job_id):
+            del manifest["files"][raw_path]
+    await update_manifest(fs, user_id, _drop)
+    return True
+
+async def _rollback_upload(job: ConversionJob):
+    """Atomic twin rule: a failed conversion leaves neither the raw PDF nor a twin behind."""
+    try:
+        fs = await ensure_user_folders_exist(job.user_id)
+        if not await _remove_upload(fs, job.user_id, job.raw_path, job.twin_path, job.job_id):
+            print(f"ℹ️ {job.raw_path} was replaced while job {job.job_id} ran; leaving the newer upload in place")
+    except Exception as e:
+        print(f"⚠️ Rollback after failed job {job.job_id} incomplete: {e}")
+
+async def _abandon_conversion_job(job: ConversionJob):
+    """Shutdown: a job that never ran (or was cancelled mid-run) is rolled back like a failed one."""
+    await _rollback_upload(job)
+    if op.exists(job.spool_path):
+        os.remove(job.spool_path)
+
+async def _recover_interrupted_uploads():
+    """
+    Startup: undo what a previous process left behind when it died mid-conversion.
+    Pending entries whose owning process has exited are rolled back; otherwise
+    /validate refuses the file (409) and re-uploads of it are rejected, forever.
+    Entries owned by another live worker are left to it. Spool files whose owning
+    process is gone are deleted. Runs before requests are served.
+    """
+    spool_dir = UPLOAD_SPOOL_DIR or tempfile.gettempdir()
+    removed = 0
+    for name in os.listdir(spool_dir):
+        match = re.fullmatch(r"upload-(\d+)-\w+\.pdf", name)
+        # Our own PID included: a restarted container can reuse it, and nothing is spooled before startup
+        if match and (int(match.group(1)) == os.getpid() or not process_alive(int(match.group(1)))):
+            try:
+                os.remove(op.join(spool_dir, name))
+                removed += 1
+            except OSError:
+                pass
+    if removed:
+        print(f"🧹 Removed {removed} orphaned upload spool file(s)")
+
+    try:
+        fs = await ensure_user_folders_exist(HARDCODED_USER_ID)
+        manifest, _ = await load_manifest(fs, HARDCODED_USER_ID)
+        stale = [
+            e for e in (manifest or {"files": {}})["files"].values()
+            if e["twin_status"] == TWIN_PENDING and owner_exited(e.get("job_owner"))
+        ]
+        for entry in stale:
+            await _remove_upload(fs, HARDCODED_USER_ID, entry["file_path"], entry["twin_path"], entry.get("job_id"))
+        if stale:
+            print(f"🧹 Rolled back {len(stale)} upload(s) left pending by an interrupted conversion")
+    except Exception as e:
+        print(f"⚠️ Recovery of interrupted uploads failed (continuing): {e}")
+
+async def _run_conversion_job(job: ConversionJob):
+    """Worker body: PDF→Markdown off the event loop, then store the twin and mark it ready."""
+    print(f"⚙️ Conversion job {job.job_id} started: {job.raw_path}")
+    try:
+        job.set_stage(STAGE_CONVERTING)
+        try:
+            md_text = await generate_markdown_from_pdf_file(job.spool_path, job)
+        except Exception as e:
+            print(f"❌ PDF→Markdown failed for {job.original_name}: {e}")
+            raise HTTPException(status_code=502, detail="Failed to convert PDF to Markdown; upload aborted.")
+
+        job.set_stage(STAGE_UPLOADING)
+        fs = await ensure_user_folders_exist(job.user_id)
+        await upload_file_to_adls(fs, md_text.encode("utf-8"), job.twin_path)
+
+        job.set_stage(STAGE_INDEXING)
+        token_count = await asyncio.to_thread(count_tokens, md_text)
+        if job.target_subdir == "reference_docs":
+            await _store_reference_sidecars(fs, md_text, job.twin_path)
+
+        def _mark_ready(manifest: dict):
+            entry = manifest["files"].get(job.raw_path)
+            if entry is not None and entry.get("job_id") == job.job_id:
+                entry["twin_status"] = TWIN_READY
+                entry["token_count"] = token_count
+                entry.pop("job_id", None)
+                entry.pop("job_owner", None)
+        await update_manifest(fs, job.user_id, _mark_ready)
+
+        job.set_stage(STAGE_DONE)
+        print(f"✅ Conversion job {job.job_id} done")
+    except Exception as e:
+        job.error = e.detail if isinstance(e, HTTPException) else str(e)
+        await _rollback_upload(job)
+        job.set_stage(STAGE_FAILED)
+    finally:
+        os.remove(job.spool_path)
+
+job_queue = JobQueue(_run_conversion_job, on_abandon=_abandon_conversion_job)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Progress of a background conversion job (stage, pages, images)."""
+    job = job_queue.get(job_id)
+    if job is None or job.user_id != HARDCODED_USER_ID:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.as_dict()
+
 @app.post("/upload/input", response_model=UploadResponse)
-async def upload_input_file(file: UploadFile = File(...)):
-    """Upload an input PDF; create its Markdown twin; store both atomically."""
+async def upload_input_file(
+    file: UploadFile = File(...),
+    background: bool = Query(False, description="Return 202 + job ID and convert in the background"),
+):
+    """
+    Upload an input PDF; create its Markdown twin; store both atomically.
+    With ?background=true the twin is generated by a job (poll GET /jobs/{job_id}).
+    """
     try:
         # Strict PDF-only guard
         content_type = (file.content_type or mimetypes.guess_type(file.filename)[0] or "").lower()
@@ -330,13 +545,13 @@ async def upload_input_file(file: UploadFile = File(...)):
         if content_type != "application/pdf" and ext != ".pdf":
             raise HTTPException(status_code=400, detail=f"Only PDF files are supported (got: {content_type or ext})")
 
-        file_bytes = await file.read()
-
-        # Ensure user dirs exist before any write (first login resilience)
-        service_client = get_adls_client()
-        ensure_user_folders_exist(service_client, HARDCODED_USER_ID)
-
-        return _handle_upload_common_bytes(file_bytes, file.filename, "input_docs")
+        upload = await _spool_upload(file)
+        if background:
+            return await _enqueue_conversion(upload, file.filename, "input_docs")
+        try:
+            return await _handle_upload_common(upload, file.filename, "input_docs")
+        finally:
+            os.remove(upload.path)
     except HTTPException:
         raise
     except Exception as e:
@@ -344,21 +559,27 @@ async def upload_input_file(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 @app.post("/upload/reference", response_model=UploadResponse)
-async def upload_reference_file(file: UploadFile = File(...)):
-    """Upload a reference PDF; create its Markdown twin; store both atomically."""
+async def upload_reference_file(
+    file: UploadFile = File(...),
+    background: bool = Query(False, description="Return 202 + job ID and convert in the background"),
+):
+    """
+    Upload a reference PDF; create its Markdown twin; store both atomically.
+    With ?background=true the twin is generated by a job (poll GET /jobs/{job_id}).
+    """
     try:
         content_type = (file.content_type or mimetypes.guess_type(file.filename)[0] or "").lower()
         _, ext = op.splitext(file.filename.lower())
         if content_type != "application/pdf" and ext != ".pdf":
             raise HTTPException(status_code=400, detail=f"Only PDF files are supported (got: {content_type or ext})")
 
-        file_bytes = await file.read()
-
-        # Ensure user dirs exist before any write (first login resilience)
-        service_client = get_adls_client()
-        ensure_user_folders_exist(service_client, HARDCODED_USER_ID)
-
-        return _handle_upload_common_bytes(file_bytes, file.filename, "reference_docs")
+        upload = await _spool_upload(file)
+        if background:
+            return await _enqueue_conversion(upload, file.filename, "reference_docs")
+        try:
+            return await _handle_upload_common(upload, file.filename, "reference_docs")
+        finally:
+            os.remove(upload.path)
     except HTTPException:
         raise
     except Exception as e:
@@ -373,10 +594,9 @@ async def upload_reference_file(file: UploadFile = File(...)):
 async def list_input_files():
     """List input PDFs for the current user (raw folder only, filtered to .pdf)."""
     try:
-        service_client = get_adls_client()
-        fs = ensure_user_folders_exist(service_client, HARDCODED_USER_ID)
-        input_dir = f"{HARDCODED_USER_ID}/input_docs"
-        files = [f for f in list_files_in_directory_detailed(fs, input_dir) if f["original_filename"].lower().endswith(".pdf")]
+        fs = await ensure_user_folders_exist(HARDCODED_USER_ID)
+        manifest = await get_manifest(fs, HARDCODED_USER_ID)
+        files = [f for f in manifest_files(manifest, "input_docs") if f["original_filename"].lower().endswith(".pdf")]
         return {"files": files}
     except Exception as e:
         print(f"❌ Error listing input files: {e}")
@@ -386,10 +606,9 @@ async def list_input_files():
 async def list_reference_files():
     """List reference PDFs for the current user (raw folder only, filtered to .pdf)."""
     try:
-        service_client = get_adls_client()
-        fs = ensure_user_folders_exist(service_client, HARDCODED_USER_ID)
-        reference_dir = f"{HARDCODED_USER_ID}/reference_docs"
-        files = [f for f in list_files_in_directory_detailed(fs, reference_dir) if f["original_filename"].lower().endswith(".pdf")]
+        fs = await ensure_user_folders_exist(HARDCODED_USER_ID)
+        manifest = await get_manifest(fs, HARDCODED_USER_ID)
+        files = [f for f in manifest_files(manifest, "reference_docs") if f["original_filename"].lower().endswith(".pdf")]
         return {"files": files}
     except Exception as e:
         print(f"❌ Error listing reference files: {e}")
@@ -399,12 +618,10 @@ async def list_reference_files():
 async def list_all_files():
     """List all raw PDFs (input + reference) for the current user."""
     try:
-        service_client = get_adls_client()
-        fs = ensure_user_folders_exist(service_client, HARDCODED_USER_ID)
-        input_dir = f"{HARDCODED_USER_ID}/input_docs"
-        reference_dir = f"{HARDCODED_USER_ID}/reference_docs"
-        input_files = [f for f in list_files_in_directory_detailed(fs, input_dir) if f["original_filename"].lower().endswith(".pdf")]
-        reference_files = [f for f in list_files_in_directory_detailed(fs, reference_dir) if f["original_filename"].lower().endswith(".pdf")]
+        fs = await ensure_user_folders_exist(HARDCODED_USER_ID)
+        manifest = await get_manifest(fs, HARDCODED_USER_ID)
+        input_files = [f for f in manifest_files(manifest, "input_docs") if f["original_filename"].lower().endswith(".pdf")]
+        reference_files = [f for f in manifest_files(manifest, "reference_docs") if f["original_filename"].lower().endswith(".pdf")]
         return {"input_files": input_files, "reference_files": reference_files}
     except Exception as e:
         print(f"❌ Error listing all files: {e}")
@@ -417,30 +634,35 @@ async def list_all_files():
 @app.delete("/files/delete")
 async def delete_file(file_path: str):
     """
-    Delete a raw PDF and its Markdown twin.
-    Accepts either the raw path (preferred) or the MD path; both companions are removed.
+    Delete a raw PDF, its Markdown twin and the twin's sidecars (chunks, index, digest).
+    Accepts either the raw path (preferred) or the MD path; all companions are removed.
     """
     try:
         if not file_path.startswith(f"{HARDCODED_USER_ID}/"):
             raise HTTPException(status_code=403, detail="Access denied: Can only delete your own files")
 
-        service_client = get_adls_client()
-        fs = ensure_user_folders_exist(service_client, HARDCODED_USER_ID)
+        fs = await ensure_user_folders_exist(HARDCODED_USER_ID)
 
         deleted_any = False
         if "/input_docs_md/" in file_path or "/reference_docs_md/" in file_path:
-            deleted_any = safe_delete(fs, file_path) or deleted_any
+            deleted_any = await safe_delete(fs, file_path) or deleted_any
+            for sidecar in _sidecar_paths(file_path):
+                await safe_delete(fs, sidecar)
             parts = file_path.split("/")
             parts[-2] = parts[-2].replace("_md", "")
             stem, _ = op.splitext(parts[-1])
             raw_path = "/".join(parts[:-1] + [stem + ".pdf"])
-            deleted_any = safe_delete(fs, raw_path) or deleted_any
+            deleted_any = await safe_delete(fs, raw_path) or deleted_any
         else:
-            deleted_any = safe_delete(fs, file_path) or deleted_any
+            raw_path = file_path
+            deleted_any = await safe_delete(fs, file_path) or deleted_any
             md_path = to_md_folder(file_path)
-            deleted_any = safe_delete(fs, md_path) or deleted_any
+            deleted_any = await safe_delete(fs, md_path) or deleted_any
+            for sidecar in _sidecar_paths(md_path):
+                await safe_delete(fs, sidecar)
 
         if deleted_any:
+            await remove_entry(fs, HARDCODED_USER_ID, raw_path)
             return {"success": True, "message": f"Deleted {os.path.basename(file_path)} and any companions"}
         else:
             raise HTTPException(status_code=404, detail="Nothing deleted (file not found)")
@@ -452,87 +674,9 @@ async def delete_file(file_path: str):
 
 # --------------------------------------------------------------------------
 # Validation — always runs on Markdown twins found in ADLS (no frontend paths)
+# Engine (chunking + concurrent LLM fan-out) lives in validation.py
 # --------------------------------------------------------------------------
 
-def count_tokens(text: str, encoding_name: str = ENCODING_NAME) -> int:
-    encoding = tiktoken.get_encoding(encoding_name)
-    return len(encoding.encode(text))
-
-def chunk_document(document: str, max_chunk_size: int, encoding_name: str = ENCODING_NAME) -> List[str]:
-    encoding = tiktoken.get_encoding(encoding_name)
-    tokens = encoding.encode(document)
-    chunks = []
-    for i in range(0, len(tokens), max_chunk_size):
-        chunk_tokens = tokens[i:i+max_chunk_size]
-        chunks.append(encoding.decode(chunk_tokens))
-    return chunks
-
-def validate_document_chunk(instructions: str, input_document: str, reference_chunk: str) -> str:
-    user_prompt = get_validation_user_prompt(instructions, input_document, reference_chunk)
-    messages = [
-        {"role": "system", "content": VALIDATION_SYSTEM_PROMPT},
-        {"role": "user", "content": user_prompt}
-    ]
-    try:
-        response = openai_client.chat.completions.create(
-            model=MODEL_DEPLOYMENT_NAME,
-            messages=messages,
-            temperature=0,
-            max_tokens=1000
-        )
-        if response.choices:
-            return response.choices[0].message.content
-        else:
-            return "No response from model"
-    except Exception as e:
-        print(f"Error during LLM call: {e}")
-        return f"Error: {str(e)}"
-
-def run_validation(input_markdown: str, reference_markdown: str, instructions: str) -> ValidationResult:
-    """
-    Validate the input document against ONE reference (chunked internally).
-    Returns a ValidationResult with Markdown in raw_output.
-    """
-    try:
-        system_tokens = count_tokens(VALIDATION_SYSTEM_PROMPT)
-        instructions_tokens = count_tokens(f"Instructions: {instructions}")
-        input_tokens = count_tokens(f"Input Document:\n{input_markdown}")
-
-        user_prompt_template = get_validation_user_prompt("", "", "")
-        template_overhead = count_tokens(user_prompt_template)
-
-        total_overhead = system_tokens + instructions_tokens + input_tokens + template_overhead + 50  # buffer
-        available_tokens = MAX_TOKENS - total_overhead
-
-        if available_tokens <= 1000:
-            return ValidationResult(
-                success=False,
-                message=f"Input document + overhead ({total_overhead} tokens) is too large. "
-                        f"Available tokens for reference: {available_tokens}"
-            )
-
-        reference_chunks = chunk_document(reference_markdown, available_tokens)
-        sections = []
-        for i, chunk in enumerate(reference_chunks):
-            result = validate_document_chunk(instructions, input_markdown, chunk)
-            if result and result.strip():
-                sections.append(f"### Analysis of Reference Section {i+1}\n\n{result}")
-
-        if sections:
-            return ValidationResult(
-                success=True,
-                message=f"Validation complete. Analyzed {len(reference_chunks)} reference document sections.",
-                raw_output="\n\n---\n\n".join(sections)
-            )
-        else:
-            return ValidationResult(
-                success=True,
-                message=f"Validation complete. Analyzed {len(reference_chunks)} reference document sections with no significant findings.",
-                raw_output="No significant findings or issues identified in the validation."
-            )
-    except Exception as e:
-        return ValidationResult(success=False, message=f"Error during validation: {str(e)}")
-
 def _iso_to_dt(s: Optional[str]) -> Optional[datetime]:
     if not s:
         return None
@@ -549,99 +693,312 @@ def _pick_latest_input(files: List[dict]) -> Optional[dict]:
 def _list_all_references(files: List[dict]) -> List[dict]:
     return [f for f in files if f["original_filename"].lower().endswith(".pdf")]
 
+@dataclass
+class ValidationInputs:
+    input_name: str
+    input_md: str
+    input_tokens: Optional[int]     # manifest token_count of the input twin
+    ref_mds: List[Tuple[str, str]]  # (ref_name, markdown)
+    ref_aids: List[ReferenceAids]    # aligned with ref_mds
+    input_md_path: str = ""
+    digest: Optional[Digest] = None      # set by _apply_digest when the digest stage is on
+    digest_error: Optional[str] = None   # digest requested but not available; the full input was used
+
+    @property
+    def validation_md(self) -> str:
+        """What the chunk calls get as the input document."""
+        return self.digest.text if self.digest else self.input_md
+
+    @property
+    def validation_tokens(self) -> Optional[int]:
+        return self.digest.tokens if self.digest else self.input_tokens
+
+async def _load_validation_inputs(fs) -> ValidationInputs:
+    """
+    Resolve the latest input and all references from the manifest, check their
+    twins are ready (404/409 otherwise) and download the twins concurrently.
+    """
+    # Discover current corpus (one manifest read; no folder scans)
+    manifest = await get_manifest(fs, HARDCODED_USER_ID)
+    input_files = manifest_files(manifest, "input_docs")
+    ref_files = manifest_files(manifest, "reference_docs")
+
+    latest_input = _pick_latest_input(input_files)
+    if not latest_input:
+        raise HTTPException(status_code=404, detail="No input PDFs found. Upload an input document.")
+
+    references = _list_all_references(ref_files)
+    if not references:
+        raise HTTPException(status_code=404, detail="No reference PDFs found. Upload at least one reference document.")
+
+    # Resolve twins & ensure presence (twin status is tracked in the manifest)
+    input_md_path = latest_input["twin_path"]
+    if latest_input["twin_status"] == TWIN_PENDING:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Input Markdown twin is still being generated. Retry when its upload job is done.", "pending": [input_md_path]}
+        )
+    if latest_input["twin_status"] != TWIN_READY:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Input Markdown twin missing. Re-upload the input PDF to regenerate twin.", "missing": [input_md_path]}
+        )
+
+    missing_refs = []
+    pending_refs = []
+    ref_md_paths: List[Tuple[str, str]] = []  # (ref_name, md_path)
+    for rf in references:
+        if rf["twin_status"] == TWIN_PENDING:
+            pending_refs.append(rf["twin_path"])
+        elif rf["twin_status"] != TWIN_READY:
+            missing_refs.append(rf["twin_path"])
+        else:
+            ref_md_paths.append((rf["original_filename"], rf["twin_path"]))
+
+    if pending_refs:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "One or more reference Markdown twins are still being generated. Retry when their upload jobs are done.", "pending": pending_refs}
+        )
+
+    if missing_refs:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "One or more reference Markdown twins are missing. Re-upload to regenerate.", "missing": missing_refs}
+        )
+
+    # Download twins and reference sidecars (concurrently)
+    downloads, chunk_blobs, index_blobs = await asyncio.gather(
+        asyncio.gather(
+            download_file_from_adls(fs, input_md_path),
+            *(download_file_from_adls(fs, ref_md_path) for _, ref_md_path in ref_md_paths),
+        ),
+        asyncio.gather(
+            *(download_optional_file_from_adls(fs, chunks_path_for_twin(ref_md_path)) for _, ref_md_path in ref_md_paths),
+            return_exceptions=True,
+        ),
+        asyncio.gather(
+            *(download_optional_file_from_adls(fs, index_path_for_twin(ref_md_path)) for _, ref_md_path in ref_md_paths),
+            return_exceptions=True,
+        ),
+    )
+    ref_mds = [(ref_name, data.decode("utf-8", errors="replace")) for (ref_name, _), data in zip(ref_md_paths, downloads[1:])]
+
+    def _aids() -> List[ReferenceAids]:
+        # Missing/stale sidecars (e.g. references uploaded before they existed) are rebuilt in memory
+        return [
+            ReferenceAids(
+                blocks=load_blocks(chunks, md) if isinstance(chunks, bytes) else None,
+                index=(load_index(index) if isinstance(index, bytes) else None) or build_index(md),
+            )
+            for chunks, index, (_, md) in zip(chunk_blobs, index_blobs, ref_mds)
+        ]
+
+    return ValidationInputs(
+        input_name=latest_input["original_filename"],
+        input_md=downloads[0].decode("utf-8", errors="replace"),
+        input_tokens=latest_input.get("token_count"),
+        ref_mds=ref_mds,
+        ref_aids=await asyncio.to_thread(_aids),
+        input_md_path=input_md_path,
+    )
+
+async def _apply_digest(fs, inputs: ValidationInputs, use_digest: Optional[bool]):
+    """Swap in the input's digest (stored, or created once now) when requested; fall back to the full input."""
+    if not (VALIDATION_DIGEST_ENABLED if use_digest is None else use_digest):
+        return
+    try:
+        inputs.digest = await load_or_create_digest(fs, inputs.input_md_path, inputs.input_md)
+    except DigestError as e:
+        print(f"⚠️ Digest unavailable for {inputs.input_name}, validating the full input: {e}")
+        inputs.digest_error = str(e)
+
+def _count_digest_tokens(inputs: ValidationInputs, run_stats: RunStats):
+    if inputs.digest and inputs.digest.created:
+        run_stats.digest_prompt_tokens = inputs.digest.prompt_tokens
+
+def _combine_results(inputs: ValidationInputs, results: List[ReferenceResult], run_stats: RunStats) -> ValidationResult:
+    """One top-level section per reference file, in reference order."""
+    per_reference_sections = []
+    total_sections = 0
+
+    for result in results:
+        ref_name = result.name
+        if not result.success:
+            # Bubble up a failure for visibility but keep partial results
+            per_reference_sections.append(
+                f"## Analysis of input document against **{ref_name}**\n\n"
+                f"> Validation error: {result.message}"
+            )
+            continue
+
+        total_sections += result.sections
+        reused_note = "> Reused from a previous run: input, reference and instructions unchanged.\n\n" if result.reused else ""
+        per_reference_sections.append(
+            f"## Analysis of input document against **{ref_name}**\n\n{reused_note}{result.raw_output or ''}"
+        )
+
+    if not per_reference_sections:
+        return ValidationResult(
+            success=True,
+            message="Validation completed with no results to display.",
+            raw_output="No findings produced.",
+            stats=run_stats.as_dict(),
+        )
+
+    combined_md = "\n\n---\n\n".join(per_reference_sections)
+    summary_msg = (
+        f"Validation complete. Input: {inputs.input_name} | "
+        f"References analyzed: {len(inputs.ref_mds)} | Sections: {total_sections} | "
+        f"Reused: {run_stats.references_reused} reference(s) | "
+        f"Pruned: {run_stats.chunks_pruned} unrelated chunk(s) | "
+        f"Cache: {run_stats.cache_hits} hit(s), {run_stats.cache_misses} miss(es) | "
+        f"LLM calls: {run_stats.llm_calls}"
+    )
+    if run_stats.packed_calls:
+        unpacked = run_stats.llm_calls + run_stats.calls_saved
+        summary_msg += (f" instead of {unpacked} ({run_stats.calls_saved} saved by packing small sections "
+                        f"into {run_stats.packed_calls} call(s))")
+    if run_stats.input_parts:
+        summary_msg += (f" | Input split into {run_stats.input_parts} part(s), "
+                        f"{run_stats.pairs_pruned} unrelated (part, section) pair(s) pruned")
+    if run_stats.triage_calls or run_stats.triage_skipped:
+        summary_msg += (f" | Triage: {run_stats.triage_skipped} chunk(s) screened out as not relevant "
+                        f"({run_stats.triage_calls} screen(s) on the triage deployment)")
+    total_prompt_tokens = run_stats.prompt_tokens + run_stats.digest_prompt_tokens
+    cost_usd = prompt_cost_usd(total_prompt_tokens) + triage_cost_usd(run_stats.triage_prompt_tokens)
+    summary_msg += f" | Prompt tokens: {total_prompt_tokens} (~${cost_usd:.4f})"
+    if run_stats.triage_prompt_tokens:
+        summary_msg += f", plus {run_stats.triage_prompt_tokens} on triage"
+    if inputs.digest:
+        created = f", created this run for {run_stats.digest_prompt_tokens} tokens" if inputs.digest.created else ""
+        summary_msg += (f" | Input digest: {inputs.digest.tokens} tokens sent instead of "
+                        f"{inputs.digest.source_tokens}{created}")
+    elif inputs.digest_error:
+        summary_msg += f" | Input digest unavailable ({inputs.digest_error}); full input used"
+    return ValidationResult(
+        success=True,
+        message=summary_msg,
+        raw_output=combined_md,
+        stats=run_stats.as_dict(),
+        reused=[r.name for r in results if r.reused],
+        cost_usd=round(cost_usd, 6),
+    )
+
 @app.post("/validate", response_model=ValidationResult)
-async def validate(instructions: str = Form("")):
+async def validate(
+    instructions: str = Form(""),
+    reuse: bool = Form(True, description="Merge in unchanged references from the previous run instead of re-validating them"),
+    digest: Optional[bool] = Form(None, description="Send a stored digest of the input instead of its full text (default: VALIDATION_DIGEST_ENABLED)"),
+):
     """
     Single validation endpoint (no frontend file paths):
       - Finds the latest INPUT PDF for the user
       - Finds ALL REFERENCE PDFs for the user
       - Uses their Markdown twins (created at upload time)
+      - Only validates references not already in this input's run record
       - Aggregates results: one top-level section per reference file
     """
     try:
-        service_client = get_adls_client()
-        fs = ensure_user_folders_exist(service_client, HARDCODED_USER_ID)
-
-        # Discover current corpus
-        input_dir = f"{HARDCODED_USER_ID}/input_docs"
-        reference_dir = f"{HARDCODED_USER_ID}/reference_docs"
-
-        input_files = list_files_in_directory_detailed(fs, input_dir)
-        ref_files = list_files_in_directory_detailed(fs, reference_dir)
-
-        latest_input = _pick_latest_input(input_files)
-        if not latest_input:
-            raise HTTPException(status_code=404, detail="No input PDFs found. Upload an input document.")
-
-        references = _list_all_references(ref_files)
-        if not references:
-            raise HTTPException(status_code=404, detail="No reference PDFs found. Upload at least one reference document.")
-
-        # Resolve twins & ensure presence
-        input_md_path = to_md_folder(latest_input["file_path"])
-        if not adls_path_exists(fs, input_md_path):
-            raise HTTPException(
-                status_code=409,
-                detail={"message": "Input Markdown twin missing. Re-upload the input PDF to regenerate twin.", "missing": [input_md_path]}
-            )
+        fs = await ensure_user_folders_exist(HARDCODED_USER_ID)
+        inputs = await _load_validation_inputs(fs)
+        await _apply_digest(fs, inputs, digest)
+        prior = await load_prior_results(fs, HARDCODED_USER_ID, inputs.validation_md, instructions) if reuse else None
+
+        # Validate against every reference at once; results come back in reference order
+        results, run_stats = await run_validations(
+            inputs.validation_md, inputs.ref_mds, instructions, prior=prior, aids=inputs.ref_aids,
+            input_tokens=inputs.validation_tokens,
+        )
+        await save_run_record(fs, HARDCODED_USER_ID, inputs.validation_md, instructions, results, prior)
+        _count_digest_tokens(inputs, run_stats)
+        return _combine_results(inputs, results, run_stats)
 
-        missing_refs = []
-        ref_md_paths: List[Tuple[str, str]] = []  # (ref_name, md_path)
-        for rf in references:
-            mdp = to_md_folder(rf["file_path"])
-            if not adls_path_exists(fs, mdp):
-                missing_refs.append(mdp)
-            else:
-                ref_md_paths.append((rf["original_filename"], mdp))
-
-        if missing_refs:
-            raise HTTPException(
-                status_code=409,
-                detail={"message": "One or more reference Markdown twins are missing. Re-upload to regenerate.", "missing": missing_refs}
-            )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error in /validate: {e}")
+        return ValidationResult(success=False, message=f"Error during validation: {str(e)}")
 
-        # Download twins
-        input_md = download_file_from_adls(fs, input_md_path).decode("utf-8", errors="replace")
-
-        # Validate against each reference, aggregate results
-        per_reference_sections = []
-        total_sections = 0
-
-        for ref_name, ref_md_path in ref_md_paths:
-            ref_md = download_file_from_adls(fs, ref_md_path).decode("utf-8", errors="replace")
-            result = run_validation(input_md, ref_md, instructions)
-            if not result.success:
-                # Bubble up a failure for visibility but keep partial results
-                per_reference_sections.append(
-                    f"## Analysis of input document against **{ref_name}**\n\n"
-                    f"> Validation error: {result.message}"
-                )
-                continue
-
-            total_sections += result.raw_output.count("### Analysis of Reference Section")
-            per_reference_sections.append(
-                f"## Analysis of input document against **{ref_name}**\n\n{result.raw_output or ''}"
-            )
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-        if not per_reference_sections:
-            return ValidationResult(
-                success=True,
-                message="Validation completed with no results to display.",
-                raw_output="No findings produced."
-            )
+@app.post("/validate/stream")
+async def validate_stream(
+    instructions: str = Form(""),
+    stream_deltas: bool = Form(False, description="Also emit 'delta' events with LLM text as it is generated"),
+    reuse: bool = Form(True, description="Merge in unchanged references from the previous run instead of re-validating them"),
+    digest: Optional[bool] = Form(None, description="Send a stored digest of the input instead of its full text (default: VALIDATION_DIGEST_ENABLED)"),
+):
+    """
+    Same validation as /validate, delivered as Server-Sent Events so findings
+    show up as soon as each chunk finishes:
 
-        combined_md = "\n\n---\n\n".join(per_reference_sections)
-        summary_msg = (
-            f"Validation complete. Input: {latest_input['original_filename']} | "
-            f"References analyzed: {len(ref_md_paths)} | Sections: {total_sections}"
-        )
-        return ValidationResult(success=True, message=summary_msg, raw_output=combined_md)
+      event: plan     references + chunk counts, cached / LLM call split
+      event: delta    (stream_deltas only) text fragments of a chunk in progress
+      event: chunk    one finished section (reference, chunk index, analysis)
+      event: summary  the same body /validate returns, plus "timing"
+      event: error    {"message"} if the run fails after the stream started
 
+    Missing/pending inputs are reported as normal 404/409 responses before the stream opens.
+    """
+    fs = await ensure_user_folders_exist(HARDCODED_USER_ID)
+    inputs = await _load_validation_inputs(fs)
+    await _apply_digest(fs, inputs, digest)
+    prior = await load_prior_results(fs, HARDCODED_USER_ID, inputs.validation_md, instructions) if reuse else None
+
+    async def _events():
+        started = time.perf_counter()
+        first_finding = None
+        try:
+            async for event, payload in stream_validations(
+                inputs.validation_md, inputs.ref_mds, instructions, stream_deltas=stream_deltas, prior=prior,
+                aids=inputs.ref_aids, input_tokens=inputs.validation_tokens,
+            ):
+                if event == "plan":
+                    yield _sse(event, {"input": inputs.input_name, "digest": inputs.digest is not None, **payload})
+                elif event in ("delta", "chunk"):
+                    if first_finding is None:
+                        first_finding = time.perf_counter() - started
+                    yield _sse(event, payload)
+                elif event == "complete":
+                    await save_run_record(fs, HARDCODED_USER_ID, inputs.validation_md, instructions, payload["results"], prior)
+                    _count_digest_tokens(inputs, payload["stats"])
+                    result = _combine_results(inputs, payload["results"], payload["stats"])
+                    yield _sse("summary", {
+                        **result.model_dump(),
+                        "timing": {
+                            "time_to_first_finding_s": round(first_finding, 3) if first_finding is not None else None,
+                            "elapsed_s": round(time.perf_counter() - started, 3),
+                        },
+                    })
+        except Exception as e:
+            print(f"❌ Error in /validate/stream: {e}")
+            yield _sse("error", {"message": f"Error during validation: {str(e)}"})
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        # Keep proxies (nginx, App Service) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --------------------------------------------------------------------------
+# Manifest maintenance
+# --------------------------------------------------------------------------
+
+@app.post("/manifest/rebuild")
+async def rebuild_user_manifest():
+    """Regenerate the current user's manifest from a directory scan."""
+    try:
+        fs = await ensure_user_folders_exist(HARDCODED_USER_ID)
+        manifest = await rebuild_manifest(fs, HARDCODED_USER_ID)
+        return {"success": True, "message": f"Manifest rebuilt with {len(manifest['files'])} file(s)."}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in /validate: {e}")
-        return ValidationResult(success=False, message=f"Error during validation: {str(e)}")
+        print(f"❌ Error rebuilding manifest: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild manifest: {str(e)}")
 
 # --------------------------------------------------------------------------
 # Login bootstrap — call once when user signs in
@@ -651,8 +1008,7 @@ async def validate(instructions: str = Form("")):
 async def init_user():
     """Bootstrap the current user's ADLS namespace. Idempotent."""
     try:
-        service_client = get_adls_client()
-        ensure_user_folders_exist(service_client, HARDCODED_USER_ID)
+        await ensure_user_folders_exist(HARDCODED_USER_ID)
         return {"success": True, "message": "User folders ensured."}
     except HTTPException:
         raise
@@ -669,6 +1025,18 @@ async def health_check():
     """Simple health check (does not hit ADLS)."""
     return {"status": "healthy", "adls_connected": True}
 
+@app.get("/metrics")
+async def metrics():
+    """Process counters: credential/connection reuse and LLM scheduler admission."""
+    cache = get_result_cache()
+    return {
+        "clients": client_counters.snapshot(),
+        "llm_scheduler": get_scheduler().snapshot(),
+        "validation_cache": cache.stats() if cache else None,
+        "token_counts": token_stats(),
+        "conversion_jobs": job_queue.snapshot(),
+    }
+
 # --------------------------------------------------------------------------
 # Entrypoint
 # --------------------------------------------------------------------------
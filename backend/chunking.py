@@ -0,0 +1,274 @@
+# chunking.py — heading-aware chunking with token counts precomputed at upload
+"""
+Reference documents used to be cut into fixed token windows on every
+validation: encode the whole reference, slice, decode. Windows split
+mid-sentence and mid-table, and the tokenizing cost was paid again per run.
+
+Here a twin is split ONCE, when it is created, into blocks:
+
+1) Sections: boundaries before every Markdown heading and after page breaks
+   (horizontal rules / page-separator lines, form feeds). Headings inside fenced
+   code blocks are ignored.
+2) Sections over CHUNK_BLOCK_TOKENS are split on paragraphs, then lines, then
+   sentences, then halved, and adjacent pieces are merged back up to the limit,
+   so tables and paragraphs stay whole whenever they fit.
+
+Blocks are contiguous character spans with their token counts. They are saved
+next to the twin as a JSON sidecar:
+
+  <user>/reference_docs_md/foo.md           (twin)
+  <user>/reference_docs_md/foo.chunks.json  (blocks)
+
+At validation time pack_chunks() packs blocks greedily into the token budget
+left next to the input document (no tokenizer call), starting a new chunk at a
+section boundary rather than splitting a section that would not fit, with
+optional trailing-block overlap (CHUNK_OVERLAP_TOKENS).
+
+CLI (tokenization time per validation, fixed windows vs. sidecar packing):
+  python chunking.py bench ../sample_data/compliance_guidelines.txt --budget 2000 --references 30
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from tokens import ENCODING_NAME, count_tokens_batch, encode, get_encoding
+
+CHUNKS_VERSION = 1
+CHUNKS_SUFFIX = ".chunks.json"
+
+# Blocks must stay below the smallest budget plan_reference accepts (1000 tokens)
+CHUNK_BLOCK_TOKENS = int(os.getenv("CHUNK_BLOCK_TOKENS", "800"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "0"))
+
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_HEADING_RE = re.compile(r"^#{1,6}\s")
+_PAGE_BREAK_RE = re.compile(r"^\s*(?:-{3,}|\*{3,}|_{3,})\s*$|^\s*-{3,}\s*end of page\b|^\f", re.I)
+
+# Successively finer split points for oversized text: paragraphs, lines, sentences
+_SPLITTERS = [
+    re.compile(r"\n[ \t]*\n\s*"),
+    re.compile(r"\n"),
+    re.compile(r"(?<=[.!?;:])\s+"),
+]
+
+@dataclass
+class Block:
+    start: int
+    end: int
+    tokens: int
+    section_start: bool = False
+
+@dataclass
+class Chunk:
+    start: int
+    end: int
+    tokens: int
+
+def _count(texts: List[str]) -> List[int]:
+    return count_tokens_batch(texts)
+
+def chunks_path_for_twin(twin_path: str) -> str:
+    """<...>_md/foo.md -> <...>_md/foo.chunks.json"""
+    base, _ = os.path.splitext(twin_path)
+    return base + CHUNKS_SUFFIX
+
+def markdown_hash(markdown: str) -> str:
+    return hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+
+# --------------------------------------------------------------------------
+# Splitting (upload time)
+# --------------------------------------------------------------------------
+
+def section_spans(markdown: str) -> List[Tuple[int, int]]:
+    """Contiguous spans: a new section starts at each heading and after each page break."""
+    starts = [0]
+    offset = 0
+    in_fence = False
+    for line in markdown.splitlines(keepends=True):
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        elif not in_fence:
+            if _HEADING_RE.match(line) and offset > starts[-1]:
+                starts.append(offset)
+            elif _PAGE_BREAK_RE.match(line) and offset + len(line) < len(markdown):
+                starts.append(offset + len(line))
+        offset += len(line)
+    starts = sorted(set(starts))
+    return [(s, e) for s, e in zip(starts, starts[1:] + [len(markdown)]) if e > s]
+
+def _pieces(markdown: str, start: int, end: int, pattern: "re.Pattern") -> List[Tuple[int, int]]:
+    """Contiguous sub-spans of [start, end), each ending right after a separator match."""
+    spans, cursor = [], start
+    for m in pattern.finditer(markdown, start, end):
+        if m.end() > cursor and m.end() < end:
+            spans.append((cursor, m.end()))
+            cursor = m.end()
+    spans.append((cursor, end))
+    return spans
+
+def _merge(blocks: List[Block], max_tokens: int) -> List[Block]:
+    merged: List[Block] = []
+    for b in blocks:
+        if merged and merged[-1].tokens + b.tokens <= max_tokens:
+            merged[-1] = Block(merged[-1].start, b.end, merged[-1].tokens + b.tokens)
+        else:
+            merged.append(b)
+    return merged
+
+def _split_oversized(markdown: str, start: int, end: int, tokens: int, max_tokens: int, level: int = 0) -> List[Block]:
+    if tokens <= max_tokens or end - start <= 1:
+        return [Block(start, end, tokens)]
+    if level >= len(_SPLITTERS):
+        # No natural boundary left: halve (rare — e.g. one enormous table row)
+        mid = start + (end - start) // 2
+        left, right = _count([markdown[start:mid], markdown[mid:end]])
+        return (_split_oversized(markdown, start, mid, left, max_tokens, level)
+                + _split_oversized(markdown, mid, end, right, max_tokens, level))
+    spans = _pieces(markdown, start, end, _SPLITTERS[level])
+    if len(spans) == 1:
+        return _split_oversized(markdown, start, end, tokens, max_tokens, level + 1)
+    blocks: List[Block] = []
+    for (s, e), n in zip(spans, _count([markdown[s:e] for s, e in spans])):
+        blocks.extend(_split_oversized(markdown, s, e, n, max_tokens, level + 1))
+    return _merge(blocks, max_tokens)
+
+def split_blocks(markdown: str, max_tokens: int = CHUNK_BLOCK_TOKENS) -> List[Block]:
+    """Heading/page-aware blocks of at most max_tokens (token-counted once, in one batch)."""
+    sections = section_spans(markdown)
+    blocks: List[Block] = []
+    for (s, e), n in zip(sections, _count([markdown[s:e] for s, e in sections])):
+        pieces = _split_oversized(markdown, s, e, n, max_tokens)
+        pieces[0].section_start = True
+        blocks.extend(pieces)
+    return blocks
+
+def serialize_blocks(markdown: str, blocks: List[Block]) -> bytes:
+    return json.dumps({
+        "version": CHUNKS_VERSION,
+        "encoding": ENCODING_NAME,
+        "block_tokens": CHUNK_BLOCK_TOKENS,
+        "markdown_sha256": markdown_hash(markdown),
+        "total_tokens": sum(b.tokens for b in blocks),
+        "blocks": [[b.start, b.end, b.tokens, int(b.section_start)] for b in blocks],
+    }, separators=(",", ":")).encode("utf-8")
+
+def load_blocks(data: bytes, markdown: str) -> Optional[List[Block]]:
+    """Blocks from a sidecar, or None if it is stale (twin changed) or from another chunker version."""
+    try:
+        doc = json.loads(data)
+        if doc.get("version") != CHUNKS_VERSION or doc.get("encoding") != ENCODING_NAME:
+            return None
+        if doc.get("markdown_sha256") != markdown_hash(markdown):
+            return None
+        return [Block(s, e, n, bool(first)) for s, e, n, first in doc["blocks"]]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+# --------------------------------------------------------------------------
+# Packing (validation time; no tokenizer)
+# --------------------------------------------------------------------------
+
+def pack_chunks(blocks: Sequence[Block], budget: int, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[Chunk]:
+    """
+    Greedily pack consecutive blocks into chunks of at most `budget` tokens.
+    A section that would not fit in the current chunk starts a new one if the
+    current chunk is already at least half full. Each new chunk may repeat the
+    previous chunk's trailing blocks, up to overlap_tokens.
+    """
+    section_tokens = [0] * len(blocks)
+    for i in range(len(blocks) - 1, -1, -1):
+        following = section_tokens[i + 1] if i + 1 < len(blocks) and not blocks[i + 1].section_start else 0
+        section_tokens[i] = blocks[i].tokens + following
+
+    chunks: List[Chunk] = []
+    current: List[int] = []
+    current_tokens = 0
+
+    def _emit():
+        chunks.append(Chunk(blocks[current[0]].start, blocks[current[-1]].end, current_tokens))
+
+    for i, block in enumerate(blocks):
+        overflow = current_tokens + block.tokens > budget
+        section_break = (block.section_start and current_tokens + section_tokens[i] > budget
+                         and current_tokens >= budget // 2)
+        if current and (overflow or section_break):
+            _emit()
+            carried: List[int] = []
+            carried_tokens = 0
+            for j in reversed(current[1:]):
+                if carried_tokens + blocks[j].tokens > overlap_tokens:
+                    break
+                carried.insert(0, j)
+                carried_tokens += blocks[j].tokens
+            if carried_tokens + block.tokens > budget:
+                carried, carried_tokens = [], 0
+            current, current_tokens = carried, carried_tokens
+        current.append(i)
+        current_tokens += block.tokens
+    if current:
+        _emit()
+    return chunks
+
+def chunk_markdown(markdown: str, budget: int, blocks: Optional[Sequence[Block]] = None) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """(chunk texts, character spans). Splits the Markdown first when no precomputed blocks are given."""
+    if blocks is None:
+        blocks = split_blocks(markdown)
+    chunks = pack_chunks(blocks, budget)
+    return [markdown[c.start:c.end] for c in chunks], [(c.start, c.end) for c in chunks]
+
+# --------------------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------------------
+
+def _fixed_windows(markdown: str, budget: int) -> List[str]:
+    tokens = encode(markdown)
+    return [get_encoding().decode(tokens[i:i + budget]) for i in range(0, len(tokens), budget)]
+
+def _bench(args):
+    with open(args.reference, encoding="utf-8") as f:
+        markdown = f.read()
+
+    t0 = time.perf_counter()
+    blocks = split_blocks(markdown)
+    sidecar = serialize_blocks(markdown, blocks)
+    upload_ms = (time.perf_counter() - t0) * 1000
+
+    def _per_validation(fn) -> float:
+        t = time.perf_counter()
+        for _ in range(args.runs):
+            for _ in range(args.references):
+                fn()
+        return (time.perf_counter() - t) * 1000 / args.runs
+
+    windows_ms = _per_validation(lambda: _fixed_windows(markdown, args.budget))
+    packed_ms = _per_validation(lambda: chunk_markdown(markdown, args.budget, load_blocks(sidecar, markdown)))
+
+    texts, _ = chunk_markdown(markdown, args.budget, blocks)
+    windows = _fixed_windows(markdown, args.budget)
+    print(f"Reference: {args.reference} ({sum(b.tokens for b in blocks)} tokens, {len(blocks)} blocks, "
+          f"sidecar {len(sidecar)} bytes, built in {upload_ms:.1f} ms at upload)")
+    print(f"Budget {args.budget} tokens, {args.references} reference(s) per validation, {args.runs} run(s)")
+    print(f"  fixed windows (encode+decode every run): {windows_ms:8.2f} ms/validation, {len(windows)} chunk(s)")
+    print(f"  sidecar blocks (load + pack, no tokenizer): {packed_ms:8.2f} ms/validation, {len(texts)} chunk(s)")
+    print(f"  largest packed chunk: {max(pack_chunks(blocks, args.budget), key=lambda c: c.tokens).tokens} tokens")
+
+def main():
+    parser = argparse.ArgumentParser(description="Heading-aware chunker")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Tokenization time per validation: fixed windows vs. sidecar packing")
+    bench.add_argument("reference")
+    bench.add_argument("--budget", type=int, default=2000)
+    bench.add_argument("--references", type=int, default=10, help="References per validation")
+    bench.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    if args.command == "bench":
+        _bench(args)
+
+if __name__ == "__main__":
+    main()
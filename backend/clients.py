@@ -0,0 +1,254 @@
+# clients.py — process-wide Azure credential, HTTP pools and shared SDK clients
+"""
+One long-lived credential and one tuned HTTP pool per process, shared by the
+ADLS helpers (storage.py) and the OpenAI client used for validation and image
+descriptions.
+
+- SharedCredential caches access tokens per scope set and refreshes them on a
+  background thread before they expire, so requests never wait on the
+  DefaultAzureCredential chain.
+- HTTP pool limits are tunable via env (HTTP_POOL_*).
+- ClientCounters tracks token fetches and newly opened connections so the
+  savings are visible under load (see GET /metrics).
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+import httpx
+from dotenv import load_dotenv
+
+from azure.identity import DefaultAzureCredential
+from azure.core.credentials import AccessToken
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.ai.projects import AIProjectClient
+
+load_dotenv()
+
+PROJECT_ENDPOINT = os.getenv("PROJECT_ENDPOINT")
+AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01")
+
+# HTTP pool tuning (applies to both the ADLS and the OpenAI connection pools)
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+HTTP_POOL_KEEPALIVE_SECONDS = float(os.getenv("HTTP_POOL_KEEPALIVE_SECONDS", "30"))
+
+# Tokens are refreshed once they are within this many seconds of expiry
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+TOKEN_REFRESH_INTERVAL_SECONDS = int(os.getenv("TOKEN_REFRESH_INTERVAL_SECONDS", "60"))
+
+# --------------------------------------------------------------------------
+# Counters
+# --------------------------------------------------------------------------
+
+class ClientCounters:
+    """Thread-safe named counters exposed through /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, int] = {}
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._values)
+
+counters = ClientCounters()
+
+# --------------------------------------------------------------------------
+# Credential
+# --------------------------------------------------------------------------
+
+class SharedCredential:
+    """
+    Sync TokenCredential wrapping DefaultAzureCredential with a per-scope token
+    cache. A daemon thread refreshes cached tokens before they expire.
+    """
+
+    def __init__(self):
+        self._inner = DefaultAzureCredential()
+        self._tokens: Dict[Tuple[str, ...], AccessToken] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+    def _fresh(self, token: Optional[AccessToken], margin: float = TOKEN_REFRESH_MARGIN_SECONDS) -> bool:
+        return token is not None and token.expires_on - time.time() > margin
+
+    def _fetch(self, key: Tuple[str, ...], **kwargs) -> AccessToken:
+        token = self._inner.get_token(*key, **kwargs)
+        counters.incr("token_fetches")
+        self._tokens[key] = token
+        return token
+
+    def get_cached_token(self, *scopes: str) -> Optional[AccessToken]:
+        """Return a cached token for `scopes` if it is still fresh, else None."""
+        token = self._tokens.get(tuple(sorted(scopes)))
+        if self._fresh(token):
+            counters.incr("token_cache_hits")
+            return token
+        return None
+
+    def get_token(self, *scopes: str, claims: Optional[str] = None, tenant_id: Optional[str] = None, **kwargs) -> AccessToken:
+        # Claims challenges and cross-tenant requests bypass the cache
+        if claims or tenant_id:
+            counters.incr("token_fetches")
+            return self._inner.get_token(*scopes, claims=claims, tenant_id=tenant_id, **kwargs)
+
+        cached = self.get_cached_token(*scopes)
+        if cached:
+            return cached
+        key = tuple(sorted(scopes))
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            token = self._tokens.get(key)
+            if self._fresh(token):
+                return token
+            return self._fetch(key, **kwargs)
+
+    def _refresh_loop(self):
+        while not self._stop.wait(TOKEN_REFRESH_INTERVAL_SECONDS):
+            margin = TOKEN_REFRESH_MARGIN_SECONDS + TOKEN_REFRESH_INTERVAL_SECONDS
+            for key, token in list(self._tokens.items()):
+                if self._fresh(token, margin):
+                    continue
+                try:
+                    with self._lock:
+                        self._fetch(key)
+                except Exception as e:
+                    print(f"⚠️ Background token refresh failed for {key}: {e}")
+
+    def start_background_refresh(self):
+        if self._refresher is None or not self._refresher.is_alive():
+            self._stop.clear()
+            self._refresher = threading.Thread(target=self._refresh_loop, name="token-refresh", daemon=True)
+            self._refresher.start()
+
+    def stop_background_refresh(self):
+        self._stop.set()
+
+    def close(self):
+        self.stop_background_refresh()
+        self._inner.close()
+
+class AsyncSharedCredential:
+    """Async TokenCredential view over SharedCredential (for the aio ADLS client)."""
+
+    def __init__(self, shared: SharedCredential):
+        self._shared = shared
+
+    async def get_token(self, *scopes: str, **kwargs) -> AccessToken:
+        if not kwargs.get("claims") and not kwargs.get("tenant_id"):
+            cached = self._shared.get_cached_token(*scopes)
+            if cached:
+                return cached
+        # Cache miss: run the (blocking) credential chain off the event loop
+        return await asyncio.to_thread(self._shared.get_token, *scopes, **kwargs)
+
+    async def close(self):
+        # The shared credential outlives any one client; closed via close_shared_clients()
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+_shared_credential: Optional[SharedCredential] = None
+_credential_lock = threading.Lock()
+
+def get_shared_credential() -> SharedCredential:
+    global _shared_credential
+    with _credential_lock:
+        if _shared_credential is None:
+            _shared_credential = SharedCredential()
+        return _shared_credential
+
+# --------------------------------------------------------------------------
+# HTTP pools
+# --------------------------------------------------------------------------
+
+def build_adls_transport() -> AioHttpTransport:
+    """aiohttp transport for the aio ADLS client, sized by HTTP_POOL_* and instrumented."""
+    async def _on_connection_created(session, ctx, params):
+        counters.incr("adls_connections_opened")
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(_on_connection_created)
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_MAX_CONNECTIONS,
+        keepalive_timeout=HTTP_POOL_KEEPALIVE_SECONDS,
+    )
+    session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+    return AioHttpTransport(session=session)
+
+def _trace_openai_connections(request: httpx.Request):
+    def _trace(event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            counters.incr("openai_connections_opened")
+    request.extensions["trace"] = _trace
+
+def build_openai_http_client() -> httpx.Client:
+    """httpx client for the OpenAI SDK, sized by HTTP_POOL_* and instrumented."""
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_POOL_KEEPALIVE_SECONDS,
+        ),
+        event_hooks={"request": [_trace_openai_connections]},
+    )
+
+# --------------------------------------------------------------------------
+# Shared SDK clients
+# --------------------------------------------------------------------------
+
+_project_client: Optional[AIProjectClient] = None
+_openai_client = None
+_clients_lock = threading.Lock()
+
+def get_project_client() -> AIProjectClient:
+    global _project_client
+    with _clients_lock:
+        if _project_client is None:
+            if not PROJECT_ENDPOINT:
+                raise RuntimeError("PROJECT_ENDPOINT env var is required but missing.")
+            _project_client = AIProjectClient(credential=get_shared_credential(), endpoint=PROJECT_ENDPOINT)
+        return _project_client
+
+def get_openai_client():
+    """Process-wide OpenAI client (Azure AI Projects) on the shared credential and HTTP pool."""
+    global _openai_client
+    project_client = get_project_client()
+    with _clients_lock:
+        if _openai_client is None:
+            _openai_client = project_client.get_openai_client(
+                api_version=AZURE_OPENAI_API_VERSION,
+                http_client=build_openai_http_client(),
+                # 429 and transient-error retries are owned by llm_scheduler (Retry-After per deployment, backoff)
+                max_retries=0,
+            )
+        return _openai_client
+
+def close_shared_clients():
+    """Close the OpenAI client and the shared credential (call once on app shutdown)."""
+    global _openai_client, _project_client, _shared_credential
+    with _clients_lock:
+        if _openai_client is not None:
+            _openai_client.close()
+            _openai_client = None
+        if _project_client is not None:
+            _project_client.close()
+            _project_client = None
+    with _credential_lock:
+        if _shared_credential is not None:
+            _shared_credential.close()
+            _shared_credential = None
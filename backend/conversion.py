@@ -0,0 +1,519 @@
+# conversion.py — PDF→Markdown layout analysis on a pool of warm worker processes
+"""
+`pymupdf4llm.to_markdown` is pure CPU work (layout analysis, text extraction,
+image encoding). Running it in the API process pins the event loop for as long
+as a large PDF takes, so it runs in a ProcessPoolExecutor instead:
+
+- Workers are started with the "spawn" method and import fitz/pymupdf4llm in
+  their initializer; warm_up() starts them all before the first upload arrives.
+- CONVERSION_PROCESSES sets the pool size; once the pool has run
+  CONVERSION_MAX_TASKS_PER_CHILD tasks per worker it is replaced between
+  documents (bounds leaks in native code). Documents already converting keep
+  the pool they started on; it is shut down when the last of them finishes.
+  ProcessPoolExecutor's own max_tasks_per_child is not used: on
+  Python 3.11 it deadlocks when a worker retires with tasks still queued.
+- A worker that dies (segfault, OOM kill) breaks only the conversion it was
+  running: the pool is replaced and the caller gets ConversionCrashed.
+
+Image descriptions (network-bound) stay in the API process; only the
+Markdown conversion crosses the process boundary.
+
+Page-parallel conversion
+------------------------
+A document is split into ranges of CONVERSION_PAGES_PER_TASK pages, the ranges
+convert concurrently on the pool and their Markdown is joined in page order.
+pymupdf4llm renders each page independently, and the single-pass output is the
+concatenation of its pages, so the only document-wide state is heading levels,
+which are ranked by font size over the pages being converted:
+
+- Classic renderer: IdentifyHeaders is computed ONCE over the whole document
+  and the same `hdr_info` is passed to every range.
+- Layout-model renderer (pymupdf-layout installed): ranges are parsed in
+  parallel, header font sizes are collected from all of them, and each range
+  is rendered with levels ranked over that document-wide set.
+
+Known boundary differences against the single-pass baseline:
+- None in the Markdown itself. Paragraphs, lists and tables that continue on
+  the next page are already split at the page break by pymupdf4llm.
+- Without the reconciliation above, a range with no top-level heading promotes
+  its section headings ("## Section" becomes "# Section").
+- A crash in any range fails the whole document (same as before). PDF bytes
+  sources are re-sent to every range task; pass a file path for large documents.
+
+Verify against the installed pymupdf4llm version:
+  python conversion.py compare big.pdf --pages-per-task 8
+tests/test_conversion_parity.py runs the same check on a generated PDF in both
+image modes (python -m pytest tests/test_conversion_parity.py).
+
+Images
+------
+By default (CONVERSION_IMAGE_MODE=bytes) images never become base64 text.
+Each one is left in the Markdown as a short placeholder `![](ccimg:N)`, and
+`ConvertedPdf.images[N]` holds its PNG bytes (the same render pymupdf4llm would
+have embedded). The description stage reads the bytes directly.
+- Classic renderer: pymupdf4llm writes the images to a private temp dir, which
+  is read back and removed inside the worker.
+- Layout renderer: the picture boxes' bytes are swapped for placeholders before
+  rendering.
+CONVERSION_IMAGE_MODE=embed restores the inline data-URI output.
+
+Peak memory / image-scan benchmark of both modes:
+  python conversion.py images image-heavy.pdf
+
+Responsiveness benchmark (against a running API):
+  python conversion.py bench big.pdf --uploads 4 --url http://localhost:8000
+"""
+
+import argparse
+import asyncio
+import difflib
+import multiprocessing
+import os
+import re
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+CONVERSION_PROCESSES = int(os.getenv("CONVERSION_PROCESSES", str(min(4, os.cpu_count() or 1))))
+CONVERSION_MAX_TASKS_PER_CHILD = int(os.getenv("CONVERSION_MAX_TASKS_PER_CHILD", "20"))
+CONVERSION_PAGES_PER_TASK = int(os.getenv("CONVERSION_PAGES_PER_TASK", "16"))
+
+IMAGE_MODE_BYTES = "bytes"  # ![](ccimg:N) placeholders + raw image bytes
+IMAGE_MODE_EMBED = "embed"  # base64 data URIs inline (pymupdf4llm embed_images=True)
+CONVERSION_IMAGE_MODE = os.getenv("CONVERSION_IMAGE_MODE", IMAGE_MODE_BYTES)
+IMAGE_FORMAT = "png"
+
+IMAGE_PLACEHOLDER_SCHEME = "ccimg"
+_PLACEHOLDER_TARGET = re.compile(r"\]\(" + IMAGE_PLACEHOLDER_SCHEME + r":(\d+)\)")
+
+# (Markdown, images or None) for one range; images[N] backs ![](ccimg:N)
+RangeOutput = Tuple[str, Optional[List[bytes]]]
+
+@dataclass
+class ConvertedPdf:
+    markdown: str
+    page_count: int
+    images: Optional[List[bytes]] = None  # None in embed mode
+    image_format: str = IMAGE_FORMAT
+
+def image_placeholder(index: int) -> str:
+    return f"{IMAGE_PLACEHOLDER_SCHEME}:{index}"
+
+class ConversionCrashed(RuntimeError):
+    """A conversion worker process died while converting a document."""
+
+# --------------------------------------------------------------------------
+# Worker side
+# --------------------------------------------------------------------------
+
+def _init_worker():
+    # Pay the import cost once per worker, not per document
+    import fitz  # noqa: F401
+    import pymupdf4llm  # noqa: F401
+
+def _ping() -> int:
+    return os.getpid()
+
+def _open_pdf(source: Union[str, bytes]):
+    import fitz
+
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source, filetype="pdf")
+
+def _uses_layout_renderer() -> bool:
+    import pymupdf4llm
+
+    # pymupdf4llm drops IdentifyHeaders when its layout-model renderer is active
+    return not hasattr(pymupdf4llm, "IdentifyHeaders")
+
+def identify_headers_in_worker(source: Union[str, bytes]) -> Tuple[Any, int, bool]:
+    """
+    Whole-document header detection -> (picklable IdentifyHeaders, page count, layout renderer?).
+    With the layout renderer hdr_info is None; levels are reconciled after parsing instead.
+    """
+    import pymupdf4llm
+
+    layout = _uses_layout_renderer()
+    with _open_pdf(source) as doc:
+        return (None if layout else pymupdf4llm.IdentifyHeaders(doc)), doc.page_count, layout
+
+def _written_images_to_placeholders(md: str, image_dir: str) -> RangeOutput:
+    """Swap `![](<image_dir>/file.png)` references for placeholders, reading the files in order."""
+    images: List[bytes] = []
+    written = re.compile(r"!\[([^\]]*)\]\((" + re.escape(image_dir.replace("\\", "/")) + r"/[^)]+)\)")
+
+    def _swap(match: re.Match) -> str:
+        with open(match.group(2), "rb") as f:
+            images.append(f.read())
+        return f"![{match.group(1)}]({image_placeholder(len(images) - 1)})"
+
+    return written.sub(_swap, md), images
+
+def pdf_to_markdown_in_worker(
+    source: Union[str, bytes],
+    pages: Optional[List[int]] = None,
+    hdr_info: Any = None,
+    image_mode: str = CONVERSION_IMAGE_MODE,
+) -> RangeOutput:
+    """PDF path or bytes -> (Markdown, images) for all pages, or only `pages`."""
+    import pymupdf4llm
+
+    if image_mode == IMAGE_MODE_BYTES and _uses_layout_renderer():
+        return render_parsed_in_worker(parse_pages_in_worker(source, pages), None, image_mode)
+
+    with _open_pdf(source) as doc:
+        kwargs = {"hdr_info": hdr_info} if hdr_info is not None else {}
+        if image_mode == IMAGE_MODE_EMBED:
+            return pymupdf4llm.to_markdown(doc, pages=pages, embed_images=True, write_images=False, **kwargs), None
+
+        image_dir = tempfile.mkdtemp(prefix="pdf-images-")
+        try:
+            md = pymupdf4llm.to_markdown(
+                doc, pages=pages, write_images=True, image_path=image_dir, image_format=IMAGE_FORMAT, **kwargs
+            )
+            return _written_images_to_placeholders(md, image_dir)
+        finally:
+            shutil.rmtree(image_dir, ignore_errors=True)
+
+# Layout renderer: parse ranges, then render with document-wide header levels
+
+_HEADER_BOXES = ("title", "section-header")
+
+def parse_pages_in_worker(source: Union[str, bytes], pages: List[int]) -> Any:
+    """Layout analysis for `pages` -> ParsedDocument (same options as pymupdf4llm.to_markdown)."""
+    from pymupdf4llm.helpers.document_layout import parse_document
+
+    with _open_pdf(source) as doc:
+        return parse_document(doc, pages=pages, embed_images=True, write_images=False, force_text=True, use_ocr=True)
+
+def header_fontsizes(parsed: Any) -> set:
+    return {box.max_fontsize for page in parsed.pages for box in page.boxes if box.boxclass in _HEADER_BOXES}
+
+def render_parsed_in_worker(parsed: Any, document_header_fontsizes: Optional[set], image_mode: str = CONVERSION_IMAGE_MODE) -> RangeOutput:
+    """
+    ParsedDocument -> (Markdown, images), with header levels ranked over the WHOLE
+    document's header sizes (None = keep the levels parse_document assigned).
+    """
+    from pymupdf4llm.helpers.document_layout import update_header_tags
+
+    if document_header_fontsizes:
+        update_header_tags(parsed.pages, document_header_fontsizes)
+    if image_mode == IMAGE_MODE_EMBED:
+        return parsed.to_markdown(embed_images=True, write_images=False), None
+
+    # A string image is rendered as a plain ![](...) reference: hand over the bytes, keep a placeholder
+    images: List[bytes] = []
+    for page in parsed.pages:
+        for box in page.boxes:
+            if isinstance(box.image, bytes):
+                images.append(box.image)
+                box.image = image_placeholder(len(images) - 1)
+    return parsed.to_markdown(embed_images=True, write_images=False), images
+
+# --------------------------------------------------------------------------
+# API side
+# --------------------------------------------------------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_tasks = 0  # tasks run on the current pool (for recycling)
+_pool_users: Dict[ProcessPoolExecutor, int] = {}  # documents converting on each pool
+_pool_lock = threading.Lock()
+
+def _new_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=CONVERSION_PROCESSES,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    )
+
+def get_conversion_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _new_pool()
+        return _pool
+
+def _replace_broken_pool(broken: ProcessPoolExecutor):
+    global _pool, _pool_tasks
+    with _pool_lock:
+        if _pool is broken:
+            _pool = _new_pool()
+            _pool_tasks = 0
+    broken.shutdown(wait=False, cancel_futures=True)
+
+def _acquire_pool() -> ProcessPoolExecutor:
+    """The current pool, held by one more document until _release_pool()."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _new_pool()
+        _pool_users[_pool] = _pool_users.get(_pool, 0) + 1
+        return _pool
+
+def _release_pool(pool: ProcessPoolExecutor, tasks: int):
+    """
+    A document is done with `pool` after running `tasks` tasks on it. The current
+    pool is replaced once it has run CONVERSION_MAX_TASKS_PER_CHILD tasks per worker;
+    a replaced pool is shut down only when no document is using it any more.
+    """
+    global _pool, _pool_tasks
+    with _pool_lock:
+        users = _pool_users.get(pool, 1) - 1
+        if _pool is pool:
+            _pool_tasks += tasks
+            if _pool_tasks >= CONVERSION_MAX_TASKS_PER_CHILD * CONVERSION_PROCESSES:
+                _pool = _new_pool()
+                _pool_tasks = 0
+        if users > 0:
+            _pool_users[pool] = users
+            return
+        _pool_users.pop(pool, None)
+        if _pool is pool:
+            return
+    pool.shutdown(wait=False)
+
+async def warm_up():
+    """Start every worker (and run its imports) ahead of the first conversion."""
+    loop = asyncio.get_running_loop()
+    pool = get_conversion_pool()
+    started = time.perf_counter()
+    pids = await asyncio.gather(*(loop.run_in_executor(pool, _ping) for _ in range(CONVERSION_PROCESSES)))
+    print(f"🔥 Conversion pool warm: {len(set(pids))} process(es) in {time.perf_counter() - started:.1f}s "
+          f"(max {CONVERSION_MAX_TASKS_PER_CHILD} task(s) per child)")
+
+def page_ranges(page_count: int, pages_per_task: int) -> List[List[int]]:
+    return [list(range(start, min(start + pages_per_task, page_count))) for start in range(0, page_count, pages_per_task)]
+
+def stitch_ranges(parts: List[RangeOutput]) -> Tuple[str, Optional[List[bytes]]]:
+    """Join range outputs in page order, renumbering each range's placeholders to document indexes."""
+    if any(images is None for _, images in parts):
+        return "".join(md for md, _ in parts), None
+    markdown: List[str] = []
+    images: List[bytes] = []
+    for md, range_images in parts:
+        offset = len(images)
+        if offset and range_images:
+            md = _PLACEHOLDER_TARGET.sub(lambda m: f"]({image_placeholder(int(m.group(1)) + offset)})", md)
+        markdown.append(md)
+        images.extend(range_images)
+    return "".join(markdown), images
+
+async def convert_pdf(
+    source: Union[str, bytes],
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    pages_per_task: int = CONVERSION_PAGES_PER_TASK,
+    image_mode: str = CONVERSION_IMAGE_MODE,
+) -> ConvertedPdf:
+    """
+    PDF -> ConvertedPdf on the pool without blocking the event loop.
+    Page ranges convert in parallel and are stitched in page order;
+    `on_progress(pages_done, page_count)` is called as ranges finish.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _acquire_pool()
+    tasks = 0
+    try:
+        hdr_info, page_count, layout = await loop.run_in_executor(pool, identify_headers_in_worker, source)
+        ranges = page_ranges(page_count, pages_per_task)
+        done = 0
+        if on_progress:
+            on_progress(done, page_count)
+
+        def _advance(pages: List[int]):
+            nonlocal done
+            done += len(pages)
+            if on_progress:
+                on_progress(done, page_count)
+
+        async def _convert(pages: List[int]) -> RangeOutput:
+            output = await loop.run_in_executor(pool, pdf_to_markdown_in_worker, source, pages, hdr_info, image_mode)
+            _advance(pages)
+            return output
+
+        async def _parse(pages: List[int]) -> Any:
+            parsed = await loop.run_in_executor(pool, parse_pages_in_worker, source, pages)
+            _advance(pages)
+            return parsed
+
+        started = time.perf_counter()
+        if layout:
+            parsed_ranges = await asyncio.gather(*(_parse(pages) for pages in ranges))
+            sizes = set().union(*(header_fontsizes(parsed) for parsed in parsed_ranges))
+            parts = await asyncio.gather(*(
+                loop.run_in_executor(pool, render_parsed_in_worker, parsed, sizes, image_mode) for parsed in parsed_ranges
+            ))
+        else:
+            parts = await asyncio.gather(*(_convert(pages) for pages in ranges))
+        markdown, images = stitch_ranges(parts)
+        tasks = 1 + len(ranges) * (2 if layout else 1)
+        print(f"📑 Converted {page_count} page(s) in {len(ranges)} range(s) in {time.perf_counter() - started:.2f}s"
+              + (f", {len(images)} image(s) extracted" if images is not None else ""))
+        return ConvertedPdf(markdown=markdown, page_count=page_count, images=images)
+    except BrokenProcessPool as e:
+        # A worker died mid-task; every in-flight task on this pool fails with it.
+        # Start a fresh pool so later conversions are unaffected.
+        _replace_broken_pool(pool)
+        raise ConversionCrashed("PDF conversion worker crashed") from e
+    finally:
+        _release_pool(pool, tasks)
+
+def convert_pdf_sync(
+    source: Union[str, bytes],
+    pages_per_task: int = CONVERSION_PAGES_PER_TASK,
+    image_mode: str = CONVERSION_IMAGE_MODE,
+) -> ConvertedPdf:
+    """convert_pdf for scripts/CLIs without an event loop (shuts the pool down afterwards)."""
+    try:
+        return asyncio.run(convert_pdf(source, pages_per_task=pages_per_task, image_mode=image_mode))
+    finally:
+        shutdown_conversion_pool()
+
+def shutdown_conversion_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        _pool_users.clear()
+
+# --------------------------------------------------------------------------
+# Compare page-parallel output with the single-pass baseline
+# --------------------------------------------------------------------------
+
+def compare(pdf_path: str, pages_per_task: int, image_mode: str) -> bool:
+    started = time.perf_counter()
+    baseline, baseline_images = pdf_to_markdown_in_worker(pdf_path, image_mode=image_mode)
+    single_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    converted = convert_pdf_sync(pdf_path, pages_per_task=pages_per_task, image_mode=image_mode)
+    parallel = converted.markdown
+    parallel_s = time.perf_counter() - started
+
+    print(f"📄 {os.path.basename(pdf_path)}: {converted.page_count} page(s), {CONVERSION_PROCESSES} process(es), "
+          f"{pages_per_task} page(s) per task, image mode {image_mode}")
+    print(f"⏱️  Single pass {single_s:.2f}s | page-parallel {parallel_s:.2f}s (incl. pool start)")
+    if parallel == baseline and converted.images == baseline_images:
+        print(f"✅ Identical output ({len(baseline):,} characters"
+              + (f", {len(baseline_images)} image(s)" if baseline_images is not None else "") + ")")
+        return True
+    if parallel == baseline:
+        print("❌ Markdown identical but extracted images differ")
+        return False
+    print(f"❌ Output differs ({len(baseline):,} vs {len(parallel):,} characters):")
+    diff = difflib.unified_diff(baseline.splitlines(), parallel.splitlines(), "single-pass", "page-parallel", lineterm="", n=2)
+    for line in list(diff)[:200]:
+        print(line[:200])
+    return False
+
+# --------------------------------------------------------------------------
+# Benchmark: embedded base64 images vs placeholders + bytes
+# --------------------------------------------------------------------------
+
+def bench_image_modes(pdf_path: str):
+    """Single-pass conversion + the description stage's image scan, per mode (Python heap peak via tracemalloc)."""
+    import tracemalloc
+    from pdf_to_markdown_with_image_descriptions import (
+        IMAGE_DATAURI_PATTERN,
+        IMAGE_PLACEHOLDER_PATTERN,
+        build_surrounding_context,
+    )
+
+    print(f"📄 {os.path.basename(pdf_path)}")
+    for mode, pattern in ((IMAGE_MODE_EMBED, IMAGE_DATAURI_PATTERN), (IMAGE_MODE_BYTES, IMAGE_PLACEHOLDER_PATTERN)):
+        tracemalloc.start()
+        started = time.perf_counter()
+        md, images = pdf_to_markdown_in_worker(pdf_path, image_mode=mode)
+        convert_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        matches = list(pattern.finditer(md))
+        contexts = [build_surrounding_context(md, m.start(), m.end()) for m in matches]
+        scan_s = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        image_bytes = sum(len(b) for b in images) if images is not None else 0
+        print(f"  {mode:>5}: markdown {len(md):>12,} chars | image bytes {image_bytes:>12,} | "
+              f"{len(matches)} image(s), {len(contexts)} context(s) | convert {convert_s:.2f}s | "
+              f"scan {scan_s * 1000:.1f}ms | peak heap {peak / 1e6:.1f} MB")
+
+# --------------------------------------------------------------------------
+# Benchmark: API responsiveness under concurrent uploads
+# --------------------------------------------------------------------------
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+async def _bench(url: str, pdf_path: str, uploads: int, probe_interval: float):
+    import httpx
+
+    with open(pdf_path, "rb") as f:
+        pdf_bytes = f.read()
+    name = os.path.basename(pdf_path)
+
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        async def _probe() -> float:
+            started = time.perf_counter()
+            await client.get("/health")
+            return time.perf_counter() - started
+
+        idle = [await _probe() for _ in range(20)]
+
+        async def _upload(i: int) -> Tuple[float, str]:
+            started = time.perf_counter()
+            files = {"file": (f"bench-{i}-{name}", pdf_bytes, "application/pdf")}
+            resp = await client.post("/upload/reference", files=files)
+            resp.raise_for_status()
+            return time.perf_counter() - started, resp.json()["file_path"]
+
+        upload_tasks = [asyncio.create_task(_upload(i)) for i in range(uploads)]
+        busy: List[float] = []
+        while not all(t.done() for t in upload_tasks):
+            busy.append(await _probe())
+            await asyncio.sleep(probe_interval)
+        results = await asyncio.gather(*upload_tasks)
+        durations = [d for d, _ in results]
+
+        for _, file_path in results:
+            await client.delete("/files/delete", params={"file_path": file_path})
+
+    print(f"📄 {name}: {len(pdf_bytes):,} bytes x {uploads} concurrent upload(s)")
+    print(f"⏱️  Uploads: mean {statistics.mean(durations):.2f}s, max {max(durations):.2f}s")
+    for label, samples in (("idle", idle), ("during uploads", busy)):
+        print(f"💓 /health {label}: n={len(samples)} p50={_percentile(samples, 0.5) * 1000:.1f}ms "
+              f"p95={_percentile(samples, 0.95) * 1000:.1f}ms max={max(samples) * 1000:.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF conversion pool utilities.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Measure /health latency while PDFs upload concurrently")
+    bench.add_argument("pdf", help="PDF to upload (a large one makes the point)")
+    bench.add_argument("--uploads", type=int, default=4, help="Concurrent uploads")
+    bench.add_argument("--url", default="http://localhost:8000", help="Running API base URL")
+    bench.add_argument("--probe-interval", type=float, default=0.1, help="Seconds between /health probes")
+    cmp_ = sub.add_parser("compare", help="Diff page-parallel conversion against a single pymupdf4llm pass")
+    cmp_.add_argument("pdf", help="PDF to convert")
+    cmp_.add_argument("--pages-per-task", type=int, default=CONVERSION_PAGES_PER_TASK, help="Pages per range task")
+    cmp_.add_argument("--image-mode", choices=(IMAGE_MODE_BYTES, IMAGE_MODE_EMBED), default=CONVERSION_IMAGE_MODE)
+    images = sub.add_parser("images", help="Peak memory and image-scan time: embedded base64 vs placeholders + bytes")
+    images.add_argument("pdf", help="PDF to convert (an image-heavy one makes the point)")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        asyncio.run(_bench(args.url, args.pdf, args.uploads, args.probe_interval))
+    elif args.command == "compare":
+        raise SystemExit(0 if compare(args.pdf, args.pages_per_task, args.image_mode) else 1)
+    elif args.command == "images":
+        bench_image_modes(args.pdf)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# digest.py — one-time input digest, sent instead of the full input with every chunk
+"""
+Every chunk call carries the whole input document: a 20k-token input checked
+against 40 reference chunks is 800k prompt tokens. With the digest stage the
+input is condensed ONCE per content hash into a compact Markdown list of its
+claims and requirements, each ending with a section anchor ([§ 4.2 Payment
+Terms]), and that list is what the chunk calls see.
+
+The digest is stored next to the input twin as a JSON sidecar:
+
+  <user>/input_docs_md/foo.md           (twin)
+  <user>/input_docs_md/foo.digest.json  (digest)
+
+It is reused while the twin's SHA-256 and the digest engine (prompt,
+deployment, part size) are unchanged. Inputs over DIGEST_PART_TOKENS are
+condensed in parts (heading-aware, chunking.py) and the parts joined.
+
+The stage is optional: VALIDATION_DIGEST_ENABLED sets the default, and
+/validate and /validate/stream take a per-request `digest` flag. The result
+message reports prompt tokens and estimated cost either way.
+
+CLI (quality check: full input vs. digest on the same references, real model):
+  python digest.py compare ../sample_data/sow.txt ../sample_data/compliance_guidelines.txt \\
+      --instructions ../sample_data/instructions.txt
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from azure.storage.filedatalake.aio import FileSystemClient
+from dotenv import load_dotenv
+
+from cache import hash_key
+from chunking import markdown_hash, pack_chunks, split_blocks
+from clients import get_openai_client
+from llm_scheduler import get_scheduler
+from prompts import DIGEST_HEADER, DIGEST_SYSTEM_PROMPT, get_digest_user_prompt
+from retrieval import tokenize
+from storage import download_optional_file_from_adls, upload_file_to_adls
+from tokens import count_tokens
+
+load_dotenv()
+
+DIGEST_VERSION = 1
+DIGEST_SUFFIX = ".digest.json"
+
+VALIDATION_DIGEST_ENABLED = os.getenv("VALIDATION_DIGEST_ENABLED", "false").lower() == "true"
+DIGEST_DEPLOYMENT_NAME = os.getenv("DIGEST_DEPLOYMENT_NAME") or os.getenv("MODEL_DEPLOYMENT_NAME")
+DIGEST_PART_TOKENS = int(os.getenv("DIGEST_PART_TOKENS", "12000"))
+DIGEST_MAX_COMPLETION_TOKENS = int(os.getenv("DIGEST_MAX_COMPLETION_TOKENS", "3000"))
+
+# user prompt -> digest Markdown for that part (injectable, like validation's llm_call)
+DigestCall = Callable[[str], str]
+
+class DigestError(Exception):
+    pass
+
+@dataclass
+class Digest:
+    text: str                # DIGEST_HEADER + condensed Markdown; what the chunk calls get as the input
+    tokens: int
+    source_tokens: int
+    prompt_tokens: int = 0   # spent creating it; 0 when loaded from the sidecar
+    created: bool = False
+
+def digest_path_for_twin(twin_path: str) -> str:
+    """<...>_md/foo.md -> <...>_md/foo.digest.json"""
+    base, _ = os.path.splitext(twin_path)
+    return base + DIGEST_SUFFIX
+
+def digest_engine_hash() -> str:
+    return hash_key(
+        DIGEST_SYSTEM_PROMPT, DIGEST_HEADER, get_digest_user_prompt("", 1, 1),
+        DIGEST_DEPLOYMENT_NAME or "", str(DIGEST_PART_TOKENS),
+    )
+
+# --------------------------------------------------------------------------
+# Condensing
+# --------------------------------------------------------------------------
+
+def complete_digest_part(user_prompt: str) -> str:
+    messages = [
+        {"role": "system", "content": DIGEST_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+    response = get_scheduler().call(
+        DIGEST_DEPLOYMENT_NAME, messages, DIGEST_MAX_COMPLETION_TOKENS,
+        lambda: get_openai_client().chat.completions.create(
+            model=DIGEST_DEPLOYMENT_NAME,
+            messages=messages,
+            temperature=0,
+            max_tokens=DIGEST_MAX_COMPLETION_TOKENS,
+        ),
+    )
+    if not response.choices or not response.choices[0].message.content:
+        raise DigestError("No response from model")
+    return response.choices[0].message.content
+
+def condense(markdown: str, digest_call: DigestCall = complete_digest_part) -> Digest:
+    """Digest of a whole input document (blocking; one LLM call per part)."""
+    blocks = split_blocks(markdown)
+    chunks = pack_chunks(blocks, DIGEST_PART_TOKENS)
+    parts = [markdown[c.start:c.end] for c in chunks] or [markdown]
+    prompts = [get_digest_user_prompt(part, i + 1, len(parts)) for i, part in enumerate(parts)]
+    outputs = [digest_call(prompt).strip() for prompt in prompts]
+
+    text = DIGEST_HEADER + "\n\n".join(outputs)
+    prompt_tokens = sum(count_tokens(DIGEST_SYSTEM_PROMPT) + count_tokens(p) for p in prompts)
+    return Digest(
+        text=text,
+        tokens=count_tokens(text),
+        source_tokens=sum(b.tokens for b in blocks),
+        prompt_tokens=prompt_tokens,
+        created=True,
+    )
+
+# --------------------------------------------------------------------------
+# Sidecar
+# --------------------------------------------------------------------------
+
+def serialize_digest(markdown: str, digest: Digest) -> bytes:
+    return json.dumps({
+        "version": DIGEST_VERSION,
+        "engine": digest_engine_hash(),
+        "markdown_sha256": markdown_hash(markdown),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "source_tokens": digest.source_tokens,
+        "tokens": digest.tokens,
+        "prompt_tokens": digest.prompt_tokens,
+        "digest": digest.text,
+    }).encode("utf-8")
+
+def load_digest(data: bytes, markdown: str) -> Optional[Digest]:
+    """Digest from a sidecar, or None if the twin changed or the digest engine did."""
+    try:
+        doc = json.loads(data)
+        if doc.get("version") != DIGEST_VERSION or doc.get("engine") != digest_engine_hash():
+            return None
+        if doc.get("markdown_sha256") != markdown_hash(markdown):
+            return None
+        return Digest(text=doc["digest"], tokens=doc["tokens"], source_tokens=doc["source_tokens"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+async def load_or_create_digest(fs: FileSystemClient, twin_path: str, markdown: str, digest_call: DigestCall = complete_digest_part) -> Digest:
+    """The stored digest for this twin, or a new one (stored for next time). Raises DigestError if the model fails."""
+    path = digest_path_for_twin(twin_path)
+    data = await download_optional_file_from_adls(fs, path)
+    digest = load_digest(data, markdown) if data else None
+    if digest is not None:
+        return digest
+
+    try:
+        digest = await asyncio.to_thread(condense, markdown, digest_call)
+    except Exception as e:
+        raise DigestError(str(e)) from e
+    try:
+        await upload_file_to_adls(fs, serialize_digest(markdown, digest), path)
+    except Exception as e:
+        # Only costs a re-digest next run
+        print(f"⚠️ Could not store digest for {twin_path}: {e}")
+    return digest
+
+# --------------------------------------------------------------------------
+# Quality check
+# --------------------------------------------------------------------------
+
+_HEADING_RE = re.compile(r"^#{1,6}\s+(.+?)\s*#*\s*$", re.M)
+_ANCHOR_RE = re.compile(r"\[§\s*([^\]]+)\]")
+
+def _normalize(text: str) -> str:
+    return " ".join(tokenize(re.sub(r"[*_`]", "", text)))
+
+def anchor_coverage(markdown: str, digest_text: str) -> float:
+    """Share of the input's headings cited by at least one [§ ...] anchor in the digest."""
+    headings = [_normalize(h) for h in _HEADING_RE.findall(markdown)]
+    headings = [h for h in headings if h]
+    if not headings:
+        return 1.0
+    anchors = [_normalize(a) for a in _ANCHOR_RE.findall(digest_text)]
+    covered = sum(1 for h in headings if any(h in a or (a and a in h) for a in anchors))
+    return covered / len(headings)
+
+def findings_agreement(full: str, digest: str) -> float:
+    """Jaccard similarity of the content terms of two analyses (1.0 = same vocabulary)."""
+    a, b = set(tokenize(full)), set(tokenize(digest))
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+def _compare_cli(args):
+    from validation import prompt_cost_usd, run_validations
+
+    with open(args.input, encoding="utf-8") as f:
+        input_md = f.read()
+    references = []
+    for path in args.references:
+        with open(path, encoding="utf-8") as f:
+            references.append((os.path.basename(path), f.read()))
+    instructions = ""
+    if args.instructions:
+        with open(args.instructions, encoding="utf-8") as f:
+            instructions = f.read()
+
+    digest = condense(input_md)
+    coverage = anchor_coverage(input_md, digest.text)
+    print(f"Digest: {digest.source_tokens} -> {digest.tokens} tokens "
+          f"({digest.tokens / max(digest.source_tokens, 1):.0%}), {digest.prompt_tokens} prompt tokens to create, "
+          f"anchor coverage {coverage:.0%} of headings")
+
+    async def _both():
+        full = await run_validations(input_md, references, instructions)
+        condensed = await run_validations(digest.text, references, instructions)
+        return full, condensed
+
+    (full_results, full_stats), (digest_results, digest_stats) = asyncio.run(_both())
+    digest_total = digest_stats.prompt_tokens + digest.prompt_tokens
+    print(f"\n{'mode':<8} {'calls':>6} {'prompt tokens':>14} {'est. cost':>10}")
+    print(f"{'full':<8} {full_stats.llm_calls:>6} {full_stats.prompt_tokens:>14} ${prompt_cost_usd(full_stats.prompt_tokens):>9.4f}")
+    print(f"{'digest':<8} {digest_stats.llm_calls:>6} {digest_total:>14} ${prompt_cost_usd(digest_total):>9.4f}"
+          f"  (incl. {digest.prompt_tokens} to create the digest, paid once)")
+    if full_stats.cache_hits or digest_stats.cache_hits:
+        print("ℹ️ Some chunks came from the result cache; set VALIDATION_CACHE_ENABLED=false for a full comparison")
+
+    print("\nFindings agreement per reference (term overlap, full vs. digest):")
+    scores = []
+    for full, condensed in zip(full_results, digest_results):
+        score = findings_agreement(full.raw_output or "", condensed.raw_output or "")
+        scores.append(score)
+        print(f"  {full.name:<40} {score:.2f}  ({full.sections} vs {condensed.sections} section(s) with findings)")
+    mean = sum(scores) / len(scores) if scores else 1.0
+    print(f"  mean {mean:.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(f"# Digest\n\n{digest.text}\n\n")
+            for full, condensed in zip(full_results, digest_results):
+                f.write(f"# {full.name}\n\n## Full input\n\n{full.raw_output}\n\n## Digest\n\n{condensed.raw_output}\n\n")
+        print(f"\nBoth reports written to {args.output}")
+
+    if coverage < args.min_coverage or mean < args.min_agreement:
+        print(f"❌ Quality check failed (coverage >= {args.min_coverage}, agreement >= {args.min_agreement} required)")
+        sys.exit(1)
+    print("✅ Quality check passed")
+
+def main():
+    parser = argparse.ArgumentParser(description="Input document digest")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compare = sub.add_parser("compare", help="Validate with the full input and with its digest, and compare")
+    compare.add_argument("input")
+    compare.add_argument("references", nargs="+")
+    compare.add_argument("--instructions", default="")
+    compare.add_argument("--output", default="", help="Write both reports (and the digest) to this Markdown file")
+    compare.add_argument("--min-coverage", type=float, default=0.8)
+    compare.add_argument("--min-agreement", type=float, default=0.3)
+    args = parser.parse_args()
+    if args.command == "compare":
+        _compare_cli(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# image_filter.py — local pre-filter for decorative / trivial images before vision calls
+"""
+pymupdf4llm embeds every raster on the page: bullet glyphs, horizontal rules,
+1-pixel spacers, solid-colour boxes, tiny icons. Each one used to cost a
+multi-thousand-token vision call that came back with "a small black dot".
+
+classify_image() looks at an image locally and returns the reason it is
+trivial, or None if it should be described. Checks, cheapest first:
+
+  tiny       either side below IMAGE_FILTER_MIN_SIDE_PX, or area below IMAGE_FILTER_MIN_AREA_PX
+  rule       aspect ratio above IMAGE_FILTER_MAX_ASPECT (lines, separators)
+  bytes      encoded size below IMAGE_FILTER_MIN_BYTES
+  flat       decoded pixels (NumPy, downsampled, colours quantized) with at most
+             IMAGE_FILTER_MIN_COLORS distinct colours or colour entropy below
+             IMAGE_FILTER_MIN_ENTROPY bits (solid boxes, two-tone glyphs). Only images
+             up to IMAGE_FILTER_FLAT_MAX_AREA_PX: a scanned page with a few lines of
+             text has a thumbnail just as flat, so larger images must also have no
+             edge at all at full resolution
+  repeated   occurs IMAGE_FILTER_REPEAT_MIN+ times in the document and is smaller
+             than IMAGE_FILTER_REPEAT_MAX_AREA_PX (bullets, icons, page ornaments)
+
+Trivial images get a short placeholder (IMAGE_FILTER_ACTION=placeholder) or are
+removed from the Markdown (drop). Anything that cannot be decoded is kept, so
+the filter can only save calls, never lose a real figure.
+
+CLI (what the filter would skip in a PDF, and why):
+  python image_filter.py scan ../sample_data/brochure.pdf
+"""
+
+import argparse
+import io
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+IMAGE_FILTER_ENABLED = os.getenv("IMAGE_FILTER_ENABLED", "true").lower() == "true"
+IMAGE_FILTER_ACTION = os.getenv("IMAGE_FILTER_ACTION", "placeholder").lower()  # placeholder | drop
+IMAGE_FILTER_MIN_SIDE_PX = int(os.getenv("IMAGE_FILTER_MIN_SIDE_PX", "12"))
+IMAGE_FILTER_MIN_AREA_PX = int(os.getenv("IMAGE_FILTER_MIN_AREA_PX", str(32 * 32)))
+IMAGE_FILTER_MAX_ASPECT = float(os.getenv("IMAGE_FILTER_MAX_ASPECT", "15"))
+IMAGE_FILTER_MIN_BYTES = int(os.getenv("IMAGE_FILTER_MIN_BYTES", "150"))
+IMAGE_FILTER_MIN_COLORS = int(os.getenv("IMAGE_FILTER_MIN_COLORS", "2"))
+IMAGE_FILTER_MIN_ENTROPY = float(os.getenv("IMAGE_FILTER_MIN_ENTROPY", "0.5"))
+IMAGE_FILTER_FLAT_MAX_AREA_PX = int(os.getenv("IMAGE_FILTER_FLAT_MAX_AREA_PX", str(128 * 128)))
+IMAGE_FILTER_REPEAT_MIN = int(os.getenv("IMAGE_FILTER_REPEAT_MIN", "4"))
+IMAGE_FILTER_REPEAT_MAX_AREA_PX = int(os.getenv("IMAGE_FILTER_REPEAT_MAX_AREA_PX", str(96 * 96)))
+
+# Pixel statistics run on a thumbnail; 4 bits per channel is enough to tell flat from detailed
+_SAMPLE_SIDE = 64
+_QUANT_SHIFT = 4
+# Grey-level jump between neighbouring pixels that counts as an edge (text strokes, lines, borders)
+_EDGE_STEP = 32
+
+SKIP_PLACEHOLDER = "> Image: [decorative image omitted]\n\n"
+
+@dataclass
+class FilterStats:
+    checked: int = 0
+    skipped: int = 0
+    reasons: Dict[str, int] = field(default_factory=dict)
+
+    def add(self, reason: Optional[str]):
+        self.checked += 1
+        if reason:
+            self.skipped += 1
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def summary(self) -> str:
+        reasons = ", ".join(f"{n} {r}" for r, n in sorted(self.reasons.items(), key=lambda kv: -kv[1]))
+        return f"{self.skipped}/{self.checked} unique image(s) skipped as decorative" + (f" ({reasons})" if reasons else "")
+
+def _on_white(img: "Image.Image") -> "Image.Image":
+    """RGB render; transparent glyphs are judged as they appear on a white page."""
+    if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        img = Image.alpha_composite(Image.new("RGBA", rgba.size, (255, 255, 255, 255)), rgba)
+    return img.convert("RGB")
+
+def color_stats(img: "Image.Image") -> tuple:
+    """(distinct quantized colours, colour entropy in bits) of a downsampled RGB render."""
+    img = _on_white(img)
+    img.thumbnail((_SAMPLE_SIDE, _SAMPLE_SIDE))
+    pixels = np.asarray(img, dtype=np.uint8).reshape(-1, 3) >> _QUANT_SHIFT
+    codes = (pixels[:, 0].astype(np.uint16) << 8) | (pixels[:, 1].astype(np.uint16) << 4) | pixels[:, 2]
+    _, counts = np.unique(codes, return_counts=True)
+    p = counts / counts.sum()
+    return len(counts), float(-(p * np.log2(p)).sum())
+
+def has_edges(img: "Image.Image") -> bool:
+    """Any sharp grey-level step between neighbouring pixels, at full resolution."""
+    gray = np.asarray(_on_white(img).convert("L"), dtype=np.int16)
+    return bool((np.abs(np.diff(gray, axis=0)) > _EDGE_STEP).any() or (np.abs(np.diff(gray, axis=1)) > _EDGE_STEP).any())
+
+def classify_image(image_bytes: bytes, occurrences: int = 1) -> Optional[str]:
+    """Reason the image is decorative/trivial (see module docstring), or None to describe it."""
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        width, height = img.size  # header only; pixels are decoded below, if at all
+    except Exception:
+        return None
+    if min(width, height) < IMAGE_FILTER_MIN_SIDE_PX or width * height < IMAGE_FILTER_MIN_AREA_PX:
+        return "tiny"
+    if max(width, height) / max(min(width, height), 1) > IMAGE_FILTER_MAX_ASPECT:
+        return "rule"
+    if len(image_bytes) < IMAGE_FILTER_MIN_BYTES:
+        return "bytes"
+    if occurrences >= IMAGE_FILTER_REPEAT_MIN and width * height < IMAGE_FILTER_REPEAT_MAX_AREA_PX:
+        return "repeated"
+    try:
+        colors, entropy = color_stats(img)
+        flat = colors <= IMAGE_FILTER_MIN_COLORS or entropy < IMAGE_FILTER_MIN_ENTROPY
+        if flat and width * height > IMAGE_FILTER_FLAT_MAX_AREA_PX:
+            flat = not has_edges(img)
+    except Exception:
+        return None
+    return "flat" if flat else None
+
+def skip_replacement() -> str:
+    """What a skipped image becomes in the Markdown."""
+    return "" if IMAGE_FILTER_ACTION == "drop" else SKIP_PLACEHOLDER
+
+# --------------------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------------------
+
+def _scan(args):
+    import hashlib
+    import re
+    import time
+    from conversion import IMAGE_PLACEHOLDER_SCHEME, convert_pdf_sync
+
+    converted = convert_pdf_sync(args.pdf)
+    placeholder = re.compile(rf"!\[[^\]]*\]\({IMAGE_PLACEHOLDER_SCHEME}:(\d+)\)")
+    indexes = [int(m.group(1)) for m in placeholder.finditer(converted.markdown)]
+    hashes = [hashlib.sha256(converted.images[i]).hexdigest() for i in indexes]
+    occurrences = Counter(hashes)
+
+    stats = FilterStats()
+    started = time.perf_counter()
+    seen = set()
+    for i, h in zip(indexes, hashes):
+        if h in seen:
+            continue
+        seen.add(h)
+        data = converted.images[i]
+        reason = classify_image(data, occurrences[h])
+        stats.add(reason)
+        if args.verbose:
+            try:
+                size = "x".join(map(str, Image.open(io.BytesIO(data)).size))
+            except Exception:
+                size = "?"
+            print(f"  ccimg:{i:<5} {size:>11} {len(data):>9} B  x{occurrences[h]:<3} {reason or 'describe'}")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    print(f"{args.pdf}: {len(indexes)} image occurrence(s), {len(seen)} unique, classified in {elapsed_ms:.1f} ms")
+    print(f"  {stats.summary()}")
+    print(f"  unique images sent to the model: {len(seen)} -> {len(seen) - stats.skipped}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Decorative image pre-filter")
+    sub = parser.add_subparsers(dest="command", required=True)
+    scan = sub.add_parser("scan", help="Classify the images of a PDF without calling the model")
+    scan.add_argument("pdf")
+    scan.add_argument("-v", "--verbose", action="store_true", help="One line per unique image")
+    args = parser.parse_args()
+    if args.command == "scan":
+        _scan(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# jobs.py — in-process background jobs for PDF→Markdown conversion
+"""
+Uploads in background mode store the raw PDF, enqueue a ConversionJob and
+return 202 right away; a small pool of asyncio workers drains the queue.
+
+Each job carries its own progress (stage, pages, images) which the handler
+updates as it goes and GET /jobs/{id} reports. Stages, in order:
+
+  queued -> converting -> describing_images -> uploading -> indexing -> done
+                                      (any stage) -> failed
+
+Jobs live in this process only. Finished jobs are kept for
+JOB_RETENTION_SECONDS so clients can read the final status, then pruned.
+On stop() every unfinished job (queued, or interrupted mid-handler) is marked
+failed and handed to the on_abandon callback so its side effects can be undone.
+"""
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+CONVERSION_WORKERS = int(os.getenv("CONVERSION_WORKERS", "2"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+STAGE_QUEUED = "queued"
+STAGE_CONVERTING = "converting"
+STAGE_DESCRIBING_IMAGES = "describing_images"
+STAGE_UPLOADING = "uploading"
+STAGE_INDEXING = "indexing"
+STAGE_DONE = "done"
+STAGE_FAILED = "failed"
+
+FINAL_STAGES = (STAGE_DONE, STAGE_FAILED)
+
+# Recorded on the manifest entries of this process's pending jobs (see owner_exited)
+JOB_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+_PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+_ERROR_ACCESS_DENIED = 5
+_STILL_ACTIVE = 259
+
+def process_alive(pid: int) -> bool:
+    """Whether a local process exists. Not os.kill(pid, 0) on Windows: signal 0 is CTRL_C_EVENT there."""
+    if os.name == "nt":
+        import ctypes
+
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(_PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return ctypes.get_last_error() == _ERROR_ACCESS_DENIED  # exists, but not ours to query
+        try:
+            code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == _STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def owner_exited(owner: Optional[str]) -> bool:
+    """
+    Whether the process recorded as a job's owner (JOB_OWNER format) has certainly exited.
+    Only meaningful before this process submits any job: our own PID counts as exited,
+    since a restarted container often reuses it. Owners on other hosts cannot be probed.
+    """
+    if not owner:
+        return True  # recorded before owners were
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    return int(pid) == os.getpid() or not process_alive(int(pid))
+
+@dataclass
+class ConversionJob:
+    user_id: str
+    original_name: str
+    target_subdir: str
+    raw_path: str
+    twin_path: str
+    spool_path: str
+    file_size: int
+    content_hash: str
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    stage: str = STAGE_QUEUED
+    pages_done: int = 0
+    pages_total: int = 0
+    images_done: int = 0
+    images_total: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def set_stage(self, stage: str):
+        self.stage = stage
+        self.updated_at = time.time()
+
+    def set_pages(self, done: int, total: int):
+        self.pages_done, self.pages_total = done, total
+        self.updated_at = time.time()
+
+    def set_images(self, done: int, total: int):
+        self.images_done, self.images_total = done, total
+        self.updated_at = time.time()
+
+    @property
+    def finished(self) -> bool:
+        return self.stage in FINAL_STAGES
+
+    def as_dict(self) -> dict:
+        # Local spool paths are an implementation detail; keep them out of the API
+        data = asdict(self)
+        data.pop("spool_path")
+        return data
+
+JobHandler = Callable[[ConversionJob], Awaitable[None]]
+
+class JobQueue:
+    """FIFO of ConversionJobs processed by `workers` asyncio tasks calling `handler`."""
+
+    def __init__(self, handler: JobHandler, workers: int = CONVERSION_WORKERS, on_abandon: Optional[JobHandler] = None):
+        self._handler = handler
+        self._on_abandon = on_abandon
+        self._workers = workers
+        self._queue: "asyncio.Queue[ConversionJob]" = asyncio.Queue()
+        self._jobs: Dict[str, ConversionJob] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker(i), name=f"conversion-worker-{i}")
+                for i in range(self._workers)
+            ]
+            print(f"🧵 Conversion workers started: {self._workers}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._queue.task_done()
+
+        # Cancellation bypasses the handler's own failure path; without this, queued and
+        # interrupted jobs would leave their side effects (stored files, index entries) behind
+        for job in [j for j in self._jobs.values() if not j.finished]:
+            job.error = job.error or "Interrupted by server shutdown"
+            if self._on_abandon is not None:
+                try:
+                    await self._on_abandon(job)
+                except Exception as e:
+                    print(f"⚠️ Cleanup of abandoned job {job.job_id} failed: {e}")
+            job.set_stage(STAGE_FAILED)
+
+    def submit(self, job: ConversionJob) -> ConversionJob:
+        self._prune()
+        self._jobs[job.job_id] = job
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[ConversionJob]:
+        return self._jobs.get(job_id)
+
+    def snapshot(self) -> Dict[str, int]:
+        by_stage: Dict[str, int] = {}
+        for job in self._jobs.values():
+            by_stage[job.stage] = by_stage.get(job.stage, 0) + 1
+        return {"workers": self._workers, "queued": self._queue.qsize(), **by_stage}
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j.job_id for j in self._jobs.values() if j.finished and j.updated_at < cutoff]:
+            del self._jobs[job_id]
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._handler(job)
+            except Exception as e:
+                # The handler owns cleanup; this only guarantees the job never stays "in progress"
+                print(f"❌ Conversion job {job.job_id} failed: {e}")
+                job.error = job.error or str(e)
+                job.set_stage(STAGE_FAILED)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,354 @@
+# llm_scheduler.py — rate-limit-aware admission for every LLM call in the project
+"""
+One process-wide scheduler in front of all chat-completion calls (validation,
+image descriptions, full-page OCR, policy analysis).
+
+Each deployment gets two token buckets: requests-per-minute and
+tokens-per-minute. Before a call is sent, its cost is estimated with tiktoken
+(prompt text + images + max_tokens) and the caller blocks until both buckets
+can admit it. When the response arrives, its real usage corrects the TPM
+bucket, so over-estimates are refunded and under-estimates are charged.
+A 429 pauses the deployment for Retry-After and the call is retried, instead of
+failing the finding with an "Error: ..." string. Transient failures (408, 409,
+5xx, timeouts, dropped connections) are retried with exponential backoff; the
+OpenAI client's own retries are off (clients.py), so this is the only retry loop.
+
+Config (env):
+  LLM_DEFAULT_RPM / LLM_DEFAULT_TPM    limits for deployments not listed below (default 0 = unlimited)
+  LLM_RATE_LIMITS                      per deployment, e.g. "gpt-4.1=300:50000,gpt-4.1-mini=1000:200000"
+  LLM_MAX_RETRIES                      retries after a 429 or transient error (default 5)
+  LLM_BURST_FRACTION                   share of a quota usable as an instant burst (default 0.1)
+  LLM_MIN_BURST_TOKENS                 TPM burst floor, so one max-size request is admitted at once
+                                       (default 64000, at most half the TPM quota)
+
+Simulated quota harness (fake deployment that enforces a quota and returns 429s):
+  python llm_scheduler.py simulate --rpm 60 --tpm 20000 --requests 200
+"""
+
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from tokens import count_tokens
+
+# 0 = no limit: deployments without configured limits are not throttled (429s are still retried)
+LLM_DEFAULT_RPM = int(os.getenv("LLM_DEFAULT_RPM", "0"))
+LLM_DEFAULT_TPM = int(os.getenv("LLM_DEFAULT_TPM", "0"))
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "")
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+# Share of each quota that may be spent as an instant burst; the rest refills evenly.
+# burst + refill over any window never exceeds the quota, so sliding-window limits hold.
+LLM_BURST_FRACTION = float(os.getenv("LLM_BURST_FRACTION", "0.1"))
+# The TPM burst is never smaller than this (capped at the quota): a full validation call
+# (~50k prompt tokens) must not be held until a small burst refills past its size
+LLM_MIN_BURST_TOKENS = int(os.getenv("LLM_MIN_BURST_TOKENS", "64000"))
+
+# Retried with backoff besides 429: request timeout, conflict, server errors
+TRANSIENT_STATUS_CODES = {408, 409}
+# Exception types (by class name, so any SDK's errors match) that mean "try again"
+TRANSIENT_ERROR_NAMES = {
+    "APITimeoutError", "APIConnectionError",        # openai
+    "ServiceRequestError", "ServiceResponseError",  # azure.core
+    "TimeoutError", "ConnectionError",
+}
+
+# Completion budget assumed when a call site does not pass max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+# Rough prompt cost of one high-detail image part
+IMAGE_TOKEN_ESTIMATE = int(os.getenv("LLM_IMAGE_TOKEN_ESTIMATE", "1100"))
+# Per-message framing tokens added by the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def parse_rate_limits(spec: str) -> Dict[str, tuple]:
+    """'dep=rpm:tpm,dep2=rpm:tpm' -> {dep: (rpm, tpm)}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, values = item.partition("=")
+        rpm, _, tpm = values.partition(":")
+        limits[name.strip()] = (int(rpm), int(tpm))
+    return limits
+
+# --------------------------------------------------------------------------
+# Buckets
+# --------------------------------------------------------------------------
+
+class TokenBucket:
+    """
+    Continuous-refill bucket admitting at most `quota` units in any `window` seconds:
+    a burst of quota * burst_fraction plus an even refill of the remainder.
+    """
+
+    def __init__(self, quota: float, window: float = 60.0, burst_fraction: float = LLM_BURST_FRACTION, min_burst: float = 1.0):
+        # The burst floor is capped at half the quota so the other half still refills
+        self.capacity = max(1.0, quota * burst_fraction, min(min_burst, quota / 2))
+        self.rate = max(quota - self.capacity, 1.0) / window
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # Requests larger than the whole bucket are admitted once it is full (then run a debt)
+        need = min(amount, self.capacity)
+        if self.level >= need:
+            return 0.0
+        return (need - self.level) / self.rate
+
+    def adjust(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+class DeploymentLimiter:
+    """RPM + TPM admission for one deployment (a quota <= 0 is not enforced)."""
+
+    def __init__(self, rpm: int, tpm: int, window: float = 60.0):
+        self.requests = TokenBucket(rpm, window) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm, window, min_burst=LLM_MIN_BURST_TOKENS) if tpm > 0 else None
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, estimated_tokens: int) -> float:
+        """Block until the call is admitted; returns seconds spent waiting."""
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                for bucket, amount in ((self.requests, 1), (self.tokens, estimated_tokens)):
+                    if bucket is not None:
+                        bucket.refill(now)
+                        wait = max(wait, bucket.wait_time(amount))
+                if wait <= 0:
+                    if self.requests is not None:
+                        self.requests.adjust(-1)
+                    if self.tokens is not None:
+                        self.tokens.adjust(-estimated_tokens)
+                    return now - started if waited else 0.0
+                waited = True
+                self._cond.wait(wait)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Correct the TPM bucket once the real usage is known."""
+        with self._cond:
+            if self.tokens is not None:
+                self.tokens.adjust(estimated_tokens - actual_tokens)
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+# --------------------------------------------------------------------------
+# Scheduler
+# --------------------------------------------------------------------------
+
+def _message_parts(message: Any) -> List[Any]:
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", "")
+    if isinstance(content, list):
+        return content
+    return [content or ""]
+
+def estimate_prompt_tokens(messages: List[Any]) -> int:
+    """tiktoken estimate of the prompt: text parts are encoded, image parts use a flat cost."""
+    total = 0
+    for message in messages:
+        total += MESSAGE_OVERHEAD_TOKENS
+        for part in _message_parts(message):
+            if isinstance(part, str):
+                total += count_tokens(part)
+            elif isinstance(part, dict) and part.get("type") == "text":
+                total += count_tokens(part.get("text", ""))
+            else:
+                total += IMAGE_TOKEN_ESTIMATE
+    return total
+
+def _status_code(error: Exception) -> Optional[int]:
+    code = getattr(error, "status_code", None)
+    if code is None:
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    return code
+
+def _is_transient(error: Exception) -> bool:
+    code = _status_code(error)
+    if code is not None:
+        return code in TRANSIENT_STATUS_CODES or code >= 500
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+def _retry_after_seconds(error: Exception, attempt: int) -> float:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return min(60.0, 2.0 ** attempt)
+
+def _usage_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+class LLMScheduler:
+    def __init__(self, limits: Optional[Dict[str, tuple]] = None, window: float = 60.0, max_retries: int = LLM_MAX_RETRIES):
+        self._limits = parse_rate_limits(LLM_RATE_LIMITS) if limits is None else limits
+        self._window = window
+        self._max_retries = max_retries
+        self._limiters: Dict[str, DeploymentLimiter] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {}
+
+    def _incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] = self._stats.get(name, 0) + amount
+
+    def limiter(self, deployment: str) -> DeploymentLimiter:
+        with self._lock:
+            if deployment not in self._limiters:
+                rpm, tpm = self._limits.get(deployment, (LLM_DEFAULT_RPM, LLM_DEFAULT_TPM))
+                self._limiters[deployment] = DeploymentLimiter(rpm, tpm, self._window)
+            return self._limiters[deployment]
+
+    def call(self, deployment: str, messages: List[Any], max_tokens: Optional[int], send: Callable[[], Any]) -> Any:
+        """
+        Admit and run `send()` (one chat-completion request for `messages`) against
+        `deployment`'s budgets. Retries 429s and transient errors; others propagate to the caller.
+        """
+        limiter = self.limiter(deployment)
+        estimated = estimate_prompt_tokens(messages) + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+        for attempt in range(self._max_retries + 1):
+            waited = limiter.acquire(estimated)
+            if waited > 0:
+                self._incr("throttled_waits")
+                self._incr("throttled_ms", int(waited * 1000))
+            try:
+                response = send()
+            except Exception as e:
+                # A failed call consumed no tokens; refund the estimate
+                limiter.settle(estimated, 0)
+                if _status_code(e) == 429 and attempt < self._max_retries:
+                    delay = _retry_after_seconds(e, attempt)
+                    self._incr("rate_limited")
+                    print(f"⏳ {deployment} rate limited; retrying in {delay:.1f}s ({attempt + 1}/{self._max_retries})")
+                    limiter.pause(delay)
+                    continue
+                if _is_transient(e) and attempt < self._max_retries:
+                    # Not a quota problem: back off this call only, the deployment stays open
+                    delay = _retry_after_seconds(e, attempt) * random.uniform(0.5, 1.0)
+                    self._incr("transient_retries")
+                    print(f"⏳ {deployment} transient error ({e}); retrying in {delay:.1f}s ({attempt + 1}/{self._max_retries})")
+                    time.sleep(delay)
+                    continue
+                self._incr("errors")
+                raise
+
+            actual = _usage_tokens(response)
+            limiter.settle(estimated, actual if actual is not None else estimated)
+            self._incr("requests")
+            self._incr("estimated_tokens", estimated)
+            self._incr("actual_tokens", actual if actual is not None else estimated)
+            return response
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> LLMScheduler:
+    """The process-wide scheduler shared by all call sites."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
+
+# --------------------------------------------------------------------------
+# Simulated quota harness
+# --------------------------------------------------------------------------
+
+class SimulatedRateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__("429 Too Many Requests (simulated)")
+        self.response = type("Response", (), {"headers": {"retry-after": f"{retry_after:.3f}"}, "status_code": 429})()
+
+class SimulatedDeployment:
+    """Fake endpoint enforcing RPM/TPM over a sliding window; returns usage like the real API."""
+
+    def __init__(self, rpm: int, tpm: int, window: float, latency: float):
+        self.rpm, self.tpm, self.window, self.latency = rpm, tpm, window, latency
+        self._log: List[tuple] = []  # (timestamp, tokens)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def complete(self, prompt_tokens: int, completion_tokens: int):
+        total = prompt_tokens + completion_tokens
+        with self._lock:
+            now = time.monotonic()
+            self._log = [(t, n) for t, n in self._log if now - t < self.window]
+            if len(self._log) + 1 > self.rpm or sum(n for _, n in self._log) + total > self.tpm:
+                self.rejected += 1
+                oldest = self._log[0][0] if self._log else now
+                raise SimulatedRateLimitError(max(0.01, self.window - (now - oldest)))
+            self._log.append((now, total))
+        time.sleep(self.latency)
+        usage = type("Usage", (), {"total_tokens": total})()
+        return type("Response", (), {"usage": usage})()
+
+def simulate(rpm: int, tpm: int, requests: int, workers: int, window: float, latency: float):
+    deployment = SimulatedDeployment(rpm, tpm, window, latency)
+    scheduler = LLMScheduler(limits={"sim": (rpm, tpm)}, window=window)
+    rng = random.Random(0)
+    jobs = []
+    for _ in range(requests):
+        prompt = "lorem ipsum " * rng.randint(20, 400)
+        max_tokens = 500
+        # Real completions are usually shorter than max_tokens; usage corrects the estimate
+        jobs.append((prompt, max_tokens, rng.randint(50, max_tokens)))
+
+    def _one(job):
+        prompt, max_tokens, completion = job
+        messages = [{"role": "user", "content": prompt}]
+        prompt_tokens = estimate_prompt_tokens(messages)
+        return scheduler.call("sim", messages, max_tokens, lambda: deployment.complete(prompt_tokens, completion))
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        responses = list(pool.map(_one, jobs))
+    elapsed = time.monotonic() - started
+
+    used = sum(r.usage.total_tokens for r in responses)
+    windows = elapsed / window
+    print(f"Completed {len(responses)} request(s) in {elapsed:.2f}s ({windows:.1f} windows)")
+    print(f"Throughput: {len(responses) / windows:.1f} req/window (quota {rpm}), {used / windows:,.0f} tokens/window (quota {tpm:,})")
+    print(f"429s returned by endpoint: {deployment.rejected}")
+    print(f"Scheduler stats: {scheduler.snapshot()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM scheduler utilities.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sim = sub.add_parser("simulate", help="Drive a simulated quota-limited deployment through the scheduler")
+    sim.add_argument("--rpm", type=int, default=60)
+    sim.add_argument("--tpm", type=int, default=20000)
+    sim.add_argument("--requests", type=int, default=200)
+    sim.add_argument("--workers", type=int, default=16)
+    sim.add_argument("--window", type=float, default=1.0, help="Seconds per simulated 'minute'")
+    sim.add_argument("--latency", type=float, default=0.02, help="Simulated response latency (seconds)")
+    args = parser.parse_args()
+
+    if args.command == "simulate":
+        simulate(args.rpm, args.tpm, args.requests, args.workers, args.window, args.latency)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# manifest.py — per-user file manifest stored in ADLS
+"""
+One JSON document per user (<user_id>/manifest.json) describing every raw PDF:
+
+  {
+    "version": 1,
+    "files": {
+      "<user>/input_docs/foo.pdf": {
+        "file_path", "original_filename", "folder", "file_size", "upload_date",
+        "content_hash", "twin_path", "twin_status", "token_count"
+      }
+    }
+  }
+
+Listing files and resolving Markdown twins is a single read of this document
+instead of a directory scan plus one properties/HEAD request per file.
+
+Writes are read-modify-write: the new manifest is uploaded to a temp path and
+renamed over the old one only if its ETag is unchanged (or, for the first
+write, only if no manifest exists). Conflicts are retried.
+
+A "pending" entry (background conversion still running) also carries "job_id"
+and "job_owner" (host:pid of the API process running the job), so a job only
+ever rolls back its own upload and startup recovery can tell abandoned entries
+from ones another live process is still converting.
+
+A rebuild hashes each raw PDF as it streams (it is never downloaded whole).
+A file that cannot be read is still listed, with "scan_error" set and the
+fields that could not be determined left empty; the rest of the rebuild goes on.
+
+CLI (regenerate a manifest from a directory scan):
+  python manifest.py rebuild <user_id>
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import uuid
+from typing import Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.storage.filedatalake.aio import FileSystemClient
+
+from storage import (
+    get_file_system_client,
+    close_adls_client,
+    list_files_in_directory_detailed,
+    download_file_from_adls,
+    sha256_of_adls_file,
+    adls_path_exists,
+    safe_delete,
+    to_md_folder,
+)
+from tokens import count_tokens
+
+MANIFEST_VERSION = 1
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_MAX_RETRIES = int(os.getenv("MANIFEST_MAX_RETRIES", "8"))
+MANIFEST_REBUILD_CONCURRENCY = int(os.getenv("MANIFEST_REBUILD_CONCURRENCY", "8"))
+
+RAW_FOLDERS = ("input_docs", "reference_docs")
+
+TWIN_READY = "ready"
+TWIN_PENDING = "pending"  # raw PDF stored, conversion job still running
+TWIN_MISSING = "missing"
+
+class ManifestConflict(Exception):
+    """Raised when the manifest changed between our read and our conditional write."""
+
+def manifest_path(user_id: str) -> str:
+    return f"{user_id}/{MANIFEST_FILENAME}"
+
+def empty_manifest() -> dict:
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+def make_entry(
+    file_path: str,
+    file_size: int,
+    upload_date: Optional[str],
+    content_hash: Optional[str],
+    twin_path: str,
+    twin_status: str,
+    token_count: Optional[int],
+    job_id: Optional[str] = None,
+    job_owner: Optional[str] = None,
+) -> dict:
+    entry = {
+        "file_path": file_path,
+        "original_filename": os.path.basename(file_path),
+        "folder": file_path.split("/")[-2],
+        "file_size": file_size,
+        "upload_date": upload_date,
+        "content_hash": content_hash,
+        "twin_path": twin_path,
+        "twin_status": twin_status,
+        "token_count": token_count,
+    }
+    if job_id is not None:
+        entry["job_id"] = job_id
+        entry["job_owner"] = job_owner
+    return entry
+
+def manifest_files(manifest: dict, folder: str) -> List[dict]:
+    """Entries for one raw folder ("input_docs" / "reference_docs"), in path order."""
+    return [e for _, e in sorted(manifest["files"].items()) if e["folder"] == folder]
+
+# --------------------------------------------------------------------------
+# Read / conditional write
+# --------------------------------------------------------------------------
+
+async def load_manifest(fs: FileSystemClient, user_id: str) -> Tuple[Optional[dict], Optional[str]]:
+    """Return (manifest, etag), or (None, None) if the user has no manifest yet."""
+    fc = fs.get_file_client(manifest_path(user_id))
+    try:
+        download = await fc.download_file()
+        data = await download.readall()
+    except ResourceNotFoundError:
+        return None, None
+    return json.loads(data), download.properties.etag
+
+async def _write_manifest(fs: FileSystemClient, user_id: str, manifest: dict, etag: Optional[str]):
+    """Atomically replace the manifest if it still has `etag` (or create it if `etag` is None)."""
+    tmp_path = f"{user_id}/.manifest-{uuid.uuid4().hex}.tmp"
+    tmp_client = fs.get_file_client(tmp_path)
+    await tmp_client.upload_data(json.dumps(manifest, indent=1).encode("utf-8"), overwrite=True)
+    if etag is None:
+        conditions = {"match_condition": MatchConditions.IfMissing}
+    else:
+        conditions = {"etag": etag, "match_condition": MatchConditions.IfNotModified}
+    try:
+        await tmp_client.rename_file(f"{fs.file_system_name}/{manifest_path(user_id)}", **conditions)
+    except (ResourceModifiedError, ResourceExistsError) as e:
+        await safe_delete(fs, tmp_path)
+        raise ManifestConflict(str(e))
+
+async def update_manifest(fs: FileSystemClient, user_id: str, mutate: Callable[[dict], None]) -> dict:
+    """
+    Apply `mutate` to the current manifest and write it back with an ETag check,
+    retrying on concurrent modification. A missing manifest is seeded from a scan.
+    """
+    for attempt in range(MANIFEST_MAX_RETRIES):
+        manifest, etag = await load_manifest(fs, user_id)
+        if manifest is None:
+            manifest = await scan_manifest(fs, user_id)
+        mutate(manifest)
+        try:
+            await _write_manifest(fs, user_id, manifest, etag)
+            return manifest
+        except ManifestConflict:
+            print(f"ℹ️ Manifest for {user_id} changed concurrently; retrying ({attempt + 1}/{MANIFEST_MAX_RETRIES})")
+            await asyncio.sleep(0.05 * (attempt + 1))
+    raise HTTPException(status_code=503, detail="File index is busy; please retry.")
+
+async def upsert_entry(fs: FileSystemClient, user_id: str, entry: dict) -> dict:
+    def _mutate(manifest: dict):
+        manifest["files"][entry["file_path"]] = entry
+    return await update_manifest(fs, user_id, _mutate)
+
+async def remove_entry(fs: FileSystemClient, user_id: str, raw_path: str) -> dict:
+    def _mutate(manifest: dict):
+        manifest["files"].pop(raw_path, None)
+    return await update_manifest(fs, user_id, _mutate)
+
+async def get_manifest(fs: FileSystemClient, user_id: str) -> dict:
+    """Read the user's manifest; users without one get it rebuilt from a scan first."""
+    manifest, _ = await load_manifest(fs, user_id)
+    if manifest is None:
+        manifest = await rebuild_manifest(fs, user_id)
+    return manifest
+
+# --------------------------------------------------------------------------
+# Rebuild from a directory scan
+# --------------------------------------------------------------------------
+
+async def _scan_entry(fs: FileSystemClient, f: dict, sem: asyncio.Semaphore) -> dict:
+    async with sem:
+        raw_path = f["file_path"]
+        twin_path = to_md_folder(raw_path)
+        errors = []
+        raw_hash = None
+        try:
+            raw_hash = await sha256_of_adls_file(fs, raw_path)
+        except Exception as e:
+            errors.append(f"hash: {e}")
+        token_count = None
+        twin_status = TWIN_MISSING
+        try:
+            if await adls_path_exists(fs, twin_path):
+                twin_text = (await download_file_from_adls(fs, twin_path)).decode("utf-8", errors="replace")
+                token_count = await asyncio.to_thread(count_tokens, twin_text)
+                twin_status = TWIN_READY
+        except Exception as e:
+            errors.append(f"twin: {e}")
+        entry = make_entry(
+            file_path=raw_path,
+            file_size=f["file_size"],
+            upload_date=f["upload_date"],
+            content_hash=raw_hash,
+            twin_path=twin_path,
+            twin_status=twin_status,
+            token_count=token_count,
+        )
+        if errors:
+            print(f"⚠️ Could not fully index {raw_path}; listed with scan_error ({'; '.join(errors)})")
+            entry["scan_error"] = "; ".join(errors)
+        return entry
+
+async def scan_manifest(fs: FileSystemClient, user_id: str) -> dict:
+    """Build (but do not write) a manifest from the user's raw folders and their twins."""
+    sem = asyncio.Semaphore(MANIFEST_REBUILD_CONCURRENCY)
+    listings = await asyncio.gather(*(
+        list_files_in_directory_detailed(fs, f"{user_id}/{folder}") for folder in RAW_FOLDERS
+    ))
+    pdfs = [f for listing in listings for f in listing if f["original_filename"].lower().endswith(".pdf")]
+    entries = await asyncio.gather(*(_scan_entry(fs, f, sem) for f in pdfs))
+
+    manifest = empty_manifest()
+    manifest["files"] = {e["file_path"]: e for e in entries}
+    return manifest
+
+async def rebuild_manifest(fs: FileSystemClient, user_id: str) -> dict:
+    """Regenerate the manifest from a directory scan and replace the stored one."""
+    print(f"🔄 Rebuilding manifest for {user_id}")
+    for attempt in range(MANIFEST_MAX_RETRIES):
+        _, etag = await load_manifest(fs, user_id)
+        manifest = await scan_manifest(fs, user_id)
+        try:
+            await _write_manifest(fs, user_id, manifest, etag)
+            failed = sum(1 for e in manifest["files"].values() if e.get("scan_error"))
+            print(f"✅ Manifest rebuilt: {len(manifest['files'])} file(s)" + (f", {failed} with scan errors" if failed else ""))
+            return manifest
+        except ManifestConflict:
+            await asyncio.sleep(0.05 * (attempt + 1))
+    raise HTTPException(status_code=503, detail="File index is busy; please retry.")
+
+# --------------------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------------------
+
+async def _rebuild_cli(user_id: str):
+    try:
+        await rebuild_manifest(get_file_system_client(), user_id)
+    finally:
+        await close_adls_client()
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain per-user file manifests in ADLS.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild", help="Regenerate a user's manifest from a directory scan")
+    rebuild.add_argument("user_id", help="User namespace (top-level folder) to rebuild")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        asyncio.run(_rebuild_cli(args.user_id))
+
+if __name__ == "__main__":
+    main()
@@ -31,6 +31,8 @@ from dotenv import load_dotenv
 from azure.identity import DefaultAzureCredential
 from azure.ai.projects import AIProjectClient
 
+from llm_scheduler import get_scheduler
+
 # ============== Hardcoded settings (keep simple) ==============
 RENDER_DPI: int = 280                 # 260–320 is a good balance for dense text
 MAX_IMAGE_BYTES: int = 20 * 1024**2   # hard cap per page payload (~20MB)
@@ -172,11 +174,14 @@ def extract_page_markdown(client, data_url: str, page_num: int) -> str:
             ],
         },
     ]
-    resp = client.chat.completions.create(
-        model=MODEL_DEPLOYMENT_NAME,
-        messages=messages,
-        max_tokens=MAX_TOKENS_PER_PAGE,
-        temperature=TEMPERATURE,
+    resp = get_scheduler().call(
+        MODEL_DEPLOYMENT_NAME, messages, MAX_TOKENS_PER_PAGE,
+        lambda: client.chat.completions.create(
+            model=MODEL_DEPLOYMENT_NAME,
+            messages=messages,
+            max_tokens=MAX_TOKENS_PER_PAGE,
+            temperature=TEMPERATURE,
+        ),
     )
     content = (resp.choices[0].message.content or "").strip()
     return normalize_image_prefixes(content)
@@ -1,25 +1,64 @@
 """
 pdf_to_markdown_with_image_descriptions.py
 ------------
-1) Convert a PDF to Markdown with base64-embedded images (using pymupdf4llm).
-2) For each embedded image, call LLM with the image *and* nearby text for additional context. LLM will return all the key info from the image.
-3) Replace the image in the Markdown with the LLM's text
-4) Return the final Markdown with images replaced by text descriptions.
+1) Convert a PDF to Markdown on the conversion pool (conversion.py). By default
+   each image is left as a short `![](ccimg:N)` placeholder and its PNG bytes
+   come back alongside (ConvertedPdf.images[N]), so the Markdown stays small and
+   an image is base64-encoded only when it is sent to the model.
+   CONVERSION_IMAGE_MODE=embed keeps pymupdf4llm's inline base64 data URIs;
+   both forms are handled below.
+2) Drop decorative images locally (image_filter.py) and reuse cached descriptions.
+3) Send the remaining images with their surrounding text to the vision model:
+   images of one section go together in a batch request, the rest alone, with
+   up to VISION_CONCURRENCY requests in flight.
+4) Replace each placeholder (or data URI) with its description and return the Markdown.
+
+Descriptions are stitched back into the original match positions, so the output
+matches the sequential, one-image-at-a-time path.
+
+Descriptions are cached by SHA-256 of the decoded image bytes + model name:
+identical images (logos, letterheads, signature blocks) are described once per
+document and never again across documents while they stay in the cache.
+
+Images in the same section (between headings / page breaks) are described
+together: one request carries up to VISION_BATCH_MAX_IMAGES images (and at most
+VISION_BATCH_MAX_BYTES of data URIs, and no more images than leave each its full
+DESCRIPTION_MAX_TOKENS within VISION_BATCH_MAX_TOKENS) and asks for a JSON list of per-image
+descriptions, which are mapped back to their placeholders by index. An image
+whose description is missing from the answer (or the whole batch, if the
+answer does not parse) is described again with a single-image call.
+
+Before any of that, image_filter.py classifies each unique image locally
+(size, bytes, colour entropy, repeats) and decorative ones (bullets, rules,
+spacers, solid boxes, small icons) get a short placeholder without an LLM call.
 
 Requirements:
-  pip install pymupdf4llm azure-identity azure-ai-projects openai python-dotenv
+  pip install pymupdf4llm azure-identity azure-ai-projects openai python-dotenv numpy pillow
 """
 
 import os
 import re
 import sys
+import json
+import base64
+import bisect
+import hashlib
+import time
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
 
-import pymupdf4llm
 from azure.identity import DefaultAzureCredential
 from azure.ai.projects import AIProjectClient
 from dotenv import load_dotenv
 
+from cache import SQLiteLRUCache, hash_key
+from chunking import section_spans
+from conversion import ConvertedPdf, convert_pdf_sync
+from image_filter import IMAGE_FILTER_ENABLED, FilterStats, classify_image, skip_replacement
+from llm_scheduler import get_scheduler
+
 load_dotenv()
 
 # ---- Config from environment ----
@@ -32,12 +71,34 @@ CONTEXT_BEFORE_CHARS = int(os.getenv("VISION_CONTEXT_BEFORE_CHARS", "400"))
 CONTEXT_AFTER_CHARS  = int(os.getenv("VISION_CONTEXT_AFTER_CHARS",  "400"))
 MAX_CONTEXT_CHARS    = int(os.getenv("VISION_MAX_CONTEXT_CHARS",    "1000"))
 
+# Max in-flight describe_image calls per document (1 = sequential)
+VISION_CONCURRENCY = int(os.getenv("VISION_CONCURRENCY", "4"))
+
+# Multi-image requests: images of one section per call, capped by count and data-URI bytes
+VISION_BATCH_ENABLED          = os.getenv("VISION_BATCH_ENABLED", "true").lower() == "true"
+VISION_BATCH_MAX_IMAGES       = int(os.getenv("VISION_BATCH_MAX_IMAGES", "6"))
+VISION_BATCH_MAX_BYTES        = int(os.getenv("VISION_BATCH_MAX_BYTES", str(8 * 1024 * 1024)))
+VISION_BATCH_MAX_TOKENS       = int(os.getenv("VISION_BATCH_MAX_TOKENS", "8000"))
+DESCRIPTION_MAX_TOKENS = 2000
+
+def batch_image_limit() -> int:
+    """Images per request: a batch never gets less than DESCRIPTION_MAX_TOKENS of output per image."""
+    return max(1, min(VISION_BATCH_MAX_IMAGES, VISION_BATCH_MAX_TOKENS // DESCRIPTION_MAX_TOKENS))
+
+# Persistent description cache (keyed by image bytes hash + model)
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_PATH    = os.getenv("IMAGE_CACHE_PATH", ".cache/image_descriptions.sqlite")
+IMAGE_CACHE_MAX_MB  = int(os.getenv("IMAGE_CACHE_MAX_MB", "64"))
+
 # Matches: ![alt](data:image/<type>;base64,<B64...>)
 IMAGE_DATAURI_PATTERN = re.compile(
     r"!\[[^\]]*\]\((data:image\/[a-zA-Z0-9.+-]+;base64,[A-Za-z0-9+/=\r\n]+)\)",
     re.DOTALL,
 )
 
+# Matches: ![alt](ccimg:<N>) — placeholder for images[N] (conversion.py, bytes mode)
+IMAGE_PLACEHOLDER_PATTERN = re.compile(r"!\[[^\]]*\]\(ccimg:(\d+)\)")
+
 def get_openai_client():
     """Create the Azure AI Foundry OpenAI client using your pattern."""
     if not PROJECT_ENDPOINT:
@@ -49,12 +110,36 @@ def get_openai_client():
     )
     return project_client.get_openai_client(api_version=AZURE_OPENAI_API_VERSION)
 
+_description_cache: Optional[SQLiteLRUCache] = None
+
+def get_description_cache() -> Optional[SQLiteLRUCache]:
+    global _description_cache
+    if IMAGE_CACHE_ENABLED and _description_cache is None:
+        _description_cache = SQLiteLRUCache(IMAGE_CACHE_PATH, IMAGE_CACHE_MAX_MB * 1024 * 1024)
+    return _description_cache
+
+def image_bytes_cache_key(image_bytes: bytes) -> str:
+    """SHA-256 of the image bytes, scoped to the description model."""
+    return hash_key(hashlib.sha256(image_bytes).hexdigest(), MODEL_DEPLOYMENT_NAME)
+
+def image_cache_key(data_url: str) -> str:
+    """Same key as image_bytes_cache_key, for a base64 data URI."""
+    return image_bytes_cache_key(base64.b64decode(data_url.split(",", 1)[1]))
+
+def image_data_url(image_bytes: bytes, image_format: str = "png") -> str:
+    return f"data:image/{image_format};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+
+def image_data_url_size(image_bytes: bytes, image_format: str = "png") -> int:
+    """len(image_data_url(...)) without encoding."""
+    return len(f"data:image/{image_format};base64,") + 4 * ((len(image_bytes) + 2) // 3)
+
 # ---------- Helpers for context ----------
 
 def strip_images_from_text(text: str) -> str:
     """Remove any base64 image markdown from the context to keep it small."""
-    # Replace data-URI images with a short placeholder
+    # Replace data-URI images (and ccimg placeholders) with a short placeholder
     text = IMAGE_DATAURI_PATTERN.sub("[Image]", text)
+    text = IMAGE_PLACEHOLDER_PATTERN.sub("[Image]", text)
     # (Optional) collapse any non-data image markdown too (kept simple)
     text = re.sub(r"!\[[^\]]*\]\([^)]+\)", "[ImageRef]", text)
     return text
@@ -85,19 +170,31 @@ def build_surrounding_context(markdown: str, start_idx: int, end_idx: int) -> st
 
 # ---------- PDF -> Markdown ----------
 
-def convert_pdf_to_markdown(pdf_path: str) -> str:
-    """Convert PDF to Markdown, embedding images as base64 data URLs (no disk writes)."""
+def convert_pdf_to_markdown(pdf_path: str) -> ConvertedPdf:
+    """
+    Convert PDF to Markdown with image placeholders + image bytes (CONVERSION_IMAGE_MODE).
+    Page ranges convert in parallel worker processes and are stitched in page order.
+    """
     print(f"📄 Converting PDF to Markdown: {pdf_path}")
-    result = pymupdf4llm.to_markdown(
-        pdf_path,
-        embed_images=True,
-        write_images=False,
-    )
+    result = convert_pdf_sync(pdf_path)
     print("✅ PDF converted successfully")
     return result
 
 # ---------- Image description ----------
 
+DESCRIBE_SYSTEM_PROMPT = (
+    "You are a helpful assistant that looks at images and writes clear, detailed descriptions of the content. "
+    "You will be provided with some surrounding context as well to better understand the image."
+    "Just say what you see without saying 'the image contains' or similar phrases."
+    "It is important that you capture all of the information that could be extracted from the image."
+)
+
+DESCRIBE_BATCH_INSTRUCTIONS = (
+    " You will be given several numbered images, each with its own surrounding context. "
+    "Describe every image separately and answer with JSON only, in this shape: "
+    '{"images": [{"index": 1, "description": "..."}, {"index": 2, "description": "..."}]}'
+)
+
 def describe_image(client, data_url: str, surrounding_context: str):
     """Send one data-URL image to the model and get a short description back."""
     # Extract image type for logging
@@ -110,12 +207,7 @@ def describe_image(client, data_url: str, surrounding_context: str):
     messages = [
         {
             "role": "system",
-            "content": (
-                "You are a helpful assistant that looks at images and writes clear, detailed descriptions of the content. "
-                "You will be provided with some surrounding context as well to better understand the image."
-                "Just say what you see without saying 'the image contains' or similar phrases."
-                "It is important that you capture all of the information that could be extracted from the image."
-            ),
+            "content": DESCRIBE_SYSTEM_PROMPT,
         },
         {
             "role": "user",
@@ -127,30 +219,139 @@ def describe_image(client, data_url: str, surrounding_context: str):
         },
     ]
 
-    resp = client.chat.completions.create(
-        model=MODEL_DEPLOYMENT_NAME,
-        messages=messages,
-        max_tokens=2000,
-        temperature=0,
+    resp = get_scheduler().call(
+        MODEL_DEPLOYMENT_NAME, messages, DESCRIPTION_MAX_TOKENS,
+        lambda: client.chat.completions.create(
+            model=MODEL_DEPLOYMENT_NAME,
+            messages=messages,
+            max_tokens=DESCRIPTION_MAX_TOKENS,
+            temperature=0,
+        ),
     )
     description = (resp.choices[0].message.content or "").strip()
     print(f"  📥 LLM response: \"{description}\"")
     return description
 
+def parse_batch_descriptions(text: Optional[str], count: int) -> Dict[int, str]:
+    """{"images": [{"index": i, "description": ...}]} -> {i: description} for indexes 1..count (non-empty only)."""
+    if not text:
+        return {}
+    try:
+        answer = json.loads(text.strip().strip("`").removeprefix("json").strip())
+    except ValueError:
+        return {}
+    items = answer.get("images") if isinstance(answer, dict) else answer
+    if not isinstance(items, list):
+        return {}
+    descriptions: Dict[int, str] = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index, desc = item.get("index"), item.get("description")
+        if isinstance(index, int) and 1 <= index <= count and isinstance(desc, str) and desc.strip():
+            descriptions.setdefault(index, desc.strip())
+    return descriptions
+
+def describe_images(client, data_urls: List[str], contexts: List[str]) -> Dict[int, str]:
+    """
+    Several images in one request (the multi-image shape of images.py) ->
+    {1-based index: description}. Indexes the answer does not cover are absent.
+    """
+    print(f"  📤 Sending {len(data_urls)} images to LLM in one request...")
+    content = []
+    for i, (data_url, context) in enumerate(zip(data_urls, contexts), start=1):
+        content.append({"type": "text", "text": f"Image {i} — surrounding context: {context}"})
+        content.append({"type": "image_url", "image_url": {"url": data_url, "detail": "high"}})
+    messages = [
+        {"role": "system", "content": DESCRIBE_SYSTEM_PROMPT + DESCRIBE_BATCH_INSTRUCTIONS},
+        {"role": "user", "content": content},
+    ]
+    max_tokens = min(DESCRIPTION_MAX_TOKENS * len(data_urls), VISION_BATCH_MAX_TOKENS)
+
+    resp = get_scheduler().call(
+        MODEL_DEPLOYMENT_NAME, messages, max_tokens,
+        lambda: client.chat.completions.create(
+            model=MODEL_DEPLOYMENT_NAME,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0,
+            response_format={"type": "json_object"},
+        ),
+    )
+    descriptions = parse_batch_descriptions(resp.choices[0].message.content if resp.choices else None, len(data_urls))
+    print(f"  📥 LLM response: {len(descriptions)}/{len(data_urls)} description(s)")
+    return descriptions
+
+def batch_images(sections: List[int], sizes: List[int], max_images: int = VISION_BATCH_MAX_IMAGES,
+                 max_bytes: int = VISION_BATCH_MAX_BYTES) -> List[List[int]]:
+    """
+    Indexes of pending images (in document order) -> request groups. Consecutive
+    images of the same section share a group until it reaches max_images or max_bytes.
+    """
+    groups: List[List[int]] = []
+    group_bytes = 0
+    for i, (section, size) in enumerate(zip(sections, sizes)):
+        if (groups and sections[groups[-1][0]] == section
+                and len(groups[-1]) < max_images and group_bytes + size <= max_bytes):
+            groups[-1].append(i)
+            group_bytes += size
+        else:
+            groups.append([i])
+            group_bytes = size
+    return groups
+
 # ---------- Replace images with text ----------
 
-def replace_images_with_text(markdown: str, client=None) -> str:
+def _describe_or_empty(client, data_url: str, context: str) -> str:
+    try:
+        return describe_image(client, data_url, context)
+    except Exception as e:
+        print(f"  ⚠️  Error describing image: {e}")
+        return ""
+
+def replace_images_with_text(
+    markdown: str,
+    client=None,
+    max_workers: int = VISION_CONCURRENCY,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    images: Optional[List[bytes]] = None,
+    image_format: str = "png",
+) -> str:
     """
-    Find each base64 image, send it with nearby text, and replace it with a text line.
+    Find each image, send it with nearby text, and replace it with a text line.
+
+    Images are base64 data URIs in the Markdown, or, when `images` is given,
+    `![](ccimg:N)` placeholders for images[N] (encoded only when sent to the model).
+
+    Unique images (by bytes hash) not already cached are described concurrently,
+    at most `max_workers` at a time; replacements are stitched back in match order,
+    so the output is identical for any `max_workers` (1 = strictly sequential).
+
+    `on_progress(done, total)` is called as images resolve (total = all image
+    occurrences; repeats and cache hits count as done up front).
+
+    With VISION_BATCH_ENABLED, uncached images of the same section go to the model
+    together (batch_images); a request is the unit of concurrency either way.
+
+    With IMAGE_FILTER_ENABLED, decorative images (image_filter.classify_image) are
+    replaced by skip_replacement() and never reach the cache or the model.
 
     Replacement format:
       > Image: <description>
     """
-    parts = []
-    last = 0
-
     # Collect matches up front so the indexes remain valid while we build `parts`
-    all_matches = list(IMAGE_DATAURI_PATTERN.finditer(markdown))
+    if images is None:
+        all_matches = list(IMAGE_DATAURI_PATTERN.finditer(markdown))
+        keys = [image_cache_key(m.group(1)) for m in all_matches]
+        data_url_for = lambda m: m.group(1)
+        data_url_size = lambda m: len(m.group(1))
+        image_bytes_for = lambda m: base64.b64decode(m.group(1).split(",", 1)[1])
+    else:
+        all_matches = list(IMAGE_PLACEHOLDER_PATTERN.finditer(markdown))
+        keys = [image_bytes_cache_key(images[int(m.group(1))]) for m in all_matches]
+        data_url_for = lambda m: image_data_url(images[int(m.group(1))], image_format)
+        data_url_size = lambda m: image_data_url_size(images[int(m.group(1))], image_format)
+        image_bytes_for = lambda m: images[int(m.group(1))]
     total_images = len(all_matches)
 
     if total_images == 0:
@@ -160,50 +361,165 @@ def replace_images_with_text(markdown: str, client=None) -> str:
     print(f"🖼️  Found {total_images} image(s) to process")
     print("-" * 60)
 
-    for idx, match in enumerate(all_matches, 1):
-        parts.append(markdown[last:match.start()])
-        data_url = match.group(1)
-
-        print(f"\n📍 Processing image {idx}/{total_images}")
-
-        # Build surrounding context from the original markdown positions
-        context = build_surrounding_context(markdown, match.start(), match.end())
-
-        if client:
-            try:
-                desc = describe_image(client, data_url, context)
-            except Exception as e:
-                print(f"  ⚠️  Error describing image: {e}")
-                desc = ""
+    cache = get_description_cache()
+
+    occurrences: Dict[str, int] = {}
+    for key in keys:
+        occurrences[key] = occurrences.get(key, 0) + 1
+
+    # One description per unique image: decorative ones are skipped, cached ones resolve
+    # now, the rest go to the LLM. Context comes from the image's first occurrence
+    # (as in the sequential pass).
+    if not client:
+        print("  ⚠️  No client available, uncached images get placeholder text")
+    descriptions: Dict[str, str] = {}
+    pending: List[tuple] = []  # (key, match, context)
+    skipped = set()
+    filter_stats = FilterStats()
+    filter_started = time.perf_counter()
+    cached = 0
+    for key, match in zip(keys, all_matches):
+        if key in descriptions:
+            continue
+        if IMAGE_FILTER_ENABLED:
+            reason = classify_image(image_bytes_for(match), occurrences[key])
+            filter_stats.add(reason)
+            if reason:
+                descriptions[key] = ""
+                skipped.add(key)
+                continue
+        hit = cache.get(key) if cache else None
+        if hit is not None:
+            descriptions[key] = hit
+            cached += 1
+        elif client:
+            context = build_surrounding_context(markdown, match.start(), match.end())
+            pending.append((key, match, context))
+            descriptions[key] = ""  # filled in below
         else:
-            print("  ⚠️  No client available, skipping LLM description")
-            desc = ""
-
-        if desc:
-            replacement = f"> Image: {desc}\n\n"
-            print("  ✅ Image replaced with description")
+            descriptions[key] = ""
+
+    filter_ms = (time.perf_counter() - filter_started) * 1000
+
+    # Progress is counted per occurrence: an image resolves together with all its repeats
+    pending_keys = {key for key, _, _ in pending}
+    done = sum(n for key, n in occurrences.items() if key not in pending_keys)
+    lock = threading.Lock()
+    if on_progress:
+        on_progress(done, total_images)
+
+    requests = 0
+    batched = 0
+    fallbacks = 0
+
+    def _resolved(key: str):
+        nonlocal done
+        if on_progress:
+            with lock:
+                done += occurrences[key]
+                on_progress(done, total_images)
+
+    def _describe_one(item: tuple) -> str:
+        nonlocal requests
+        key, match, context = item
+        desc = _describe_or_empty(client, data_url_for(match), context)
+        with lock:
+            requests += 1
+        _resolved(key)
+        return desc
+
+    def _describe_group(group: List[int]) -> List[str]:
+        nonlocal requests, batched, fallbacks
+        items = [pending[i] for i in group]
+        if len(items) == 1:
+            return [_describe_one(items[0])]
+        try:
+            answer = describe_images(client, [data_url_for(m) for _, m, _ in items], [c for _, _, c in items])
+        except Exception as e:
+            print(f"  ⚠️  Error describing {len(items)} images in one request: {e}")
+            answer = {}
+        with lock:
+            requests += 1
+            batched += len(answer)
+            fallbacks += len(items) - len(answer)
+        results = []
+        for n, item in enumerate(items, start=1):
+            if n in answer:
+                results.append(answer[n])
+                _resolved(item[0])
+            else:
+                # Not cleanly split out of the batch answer: describe it on its own
+                results.append(_describe_one(item))
+        return results
+
+    started = time.perf_counter()
+    if pending:
+        if VISION_BATCH_ENABLED and batch_image_limit() > 1:
+            starts = [start for start, _ in section_spans(markdown)]
+            sections = [bisect.bisect_right(starts, m.start()) - 1 for _, m, _ in pending]
+            groups = batch_images(sections, [data_url_size(m) for _, m, _ in pending], max_images=batch_image_limit())
         else:
-            replacement = "> Image: [description unavailable]\n\n"
-            print("  ⚠️  Using placeholder text (no description available)")
-
-        parts.append(replacement)
+            groups = [[i] for i in range(len(pending))]
+        print(f"📤 Describing {len(pending)} unique image(s) in {len(groups)} request(s) "
+              f"with up to {max_workers} concurrent call(s)")
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="describe") as pool:
+                grouped = list(pool.map(_describe_group, groups))
+        else:
+            grouped = [_describe_group(g) for g in groups]
+        results = [""] * len(pending)
+        for group, descs in zip(groups, grouped):
+            for i, desc in zip(group, descs):
+                results[i] = desc
+        for (key, _, _), desc in zip(pending, results):
+            descriptions[key] = desc
+            if desc and cache:
+                cache.put(key, desc)
+    elapsed = time.perf_counter() - started
+
+    # Stitch replacements back into the original positions
+    parts = []
+    last = 0
+    for key, match in zip(keys, all_matches):
+        parts.append(markdown[last:match.start()])
+        desc = descriptions[key]
+        if key in skipped:
+            parts.append(skip_replacement())
+        elif desc:
+            parts.append(f"> Image: {desc}\n\n")
+        else:
+            parts.append("> Image: [description unavailable]\n\n")
         last = match.end()
-
     parts.append(markdown[last:])
+
+    described = len(pending)
+    unavailable = sum(1 for key in keys if not descriptions[key] and key not in skipped)
+    decorative = sum(1 for key in keys if key in skipped)
     print("-" * 60)
-    print(f"✅ All {total_images} image(s) processed and replaced")
+    print(f"✅ All {total_images} image(s) processed and replaced ({unavailable} with placeholder text, "
+          f"{decorative} decorative)")
+    if IMAGE_FILTER_ENABLED:
+        print(f"🧹 Pre-filter: {filter_stats.summary()} in {filter_ms:.1f} ms; "
+              f"{filter_stats.skipped} image(s) kept from the vision model")
+    print(f"🗃️  Description reuse: {total_images - len(descriptions)} in-document, {cached} from cache, {described} via LLM "
+          f"(hit rate {(total_images - described) / total_images:.0%})")
+    if described:
+        print(f"📨 {requests} LLM request(s) for {described} image(s): {batched} described in multi-image requests, "
+              f"{fallbacks} fell back to single-image calls")
+        print(f"⏱️  Described {described} image(s) in {elapsed:.2f}s ({described / elapsed:.2f} images/s)")
 
     return "".join(parts)
 
 # ---------- Full pipeline ----------
 
 def pdf_to_markdown_with_image_text(pdf_path: str) -> str:
-    """PDF -> Markdown w/ base64 images -> ALWAYS replace images with text (+ context)."""
+    """PDF -> Markdown w/ images -> ALWAYS replace images with text (+ context)."""
     print("=" * 60)
     print("🚀 Starting PDF to Markdown conversion pipeline")
     print("=" * 60)
 
-    md = convert_pdf_to_markdown(pdf_path)
+    converted = convert_pdf_to_markdown(pdf_path)
+    md = converted.markdown
     print(f"📏 Markdown size: {len(md):,} characters")
 
     try:
@@ -213,7 +529,7 @@ def pdf_to_markdown_with_image_text(pdf_path: str) -> str:
         print(f"[warn] Could not initialize OpenAI client; images will be removed with placeholders. ({e})", file=sys.stderr)
         client = None
 
-    result = replace_images_with_text(md, client)
+    result = replace_images_with_text(md, client, images=converted.images, image_format=converted.image_format)
 
     print("=" * 60)
     print("✅ Pipeline complete")
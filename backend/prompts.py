@@ -29,6 +29,75 @@ Reference Document Section:
 Please analyze the input document against this reference document section and provide your findings.
 """
 
+def get_input_part_note(part_number: int, part_count: int) -> str:
+    """Prefix for one part of an input document that was too large to send whole"""
+    return (f"[Part {part_number} of {part_count} of the input document. The other parts are reviewed separately; "
+            f"do not report a requirement as missing only because this part does not cover it.]\n\n")
+
+PACKED_SECTION_MARKER = "=== REFERENCE SECTION {number} ==="
+
+def get_packed_validation_user_prompt(instructions: str, input_document: str, reference_sections) -> str:
+    """User prompt for several small reference sections in one call; reference_sections is [(label, text), ...]"""
+    delimited = "\n\n".join(
+        f"<<<REFERENCE SECTION {i}: {label}>>>\n{text}\n<<<END REFERENCE SECTION {i}>>>"
+        for i, (label, text) in enumerate(reference_sections, 1)
+    )
+    markers = "\n".join(PACKED_SECTION_MARKER.format(number=i) for i in range(1, len(reference_sections) + 1))
+    return f"""
+Instructions: {instructions if instructions.strip() else "Perform a general compliance validation"}
+
+Input Document:
+{input_document}
+
+Reference Document Sections (each from a different reference document or part of one; analyze each one on its own):
+{delimited}
+
+Please analyze the input document against EACH reference document section separately and provide your findings.
+Answer with one part per section, in order. Start each part with its marker line, exactly as written and on a line of its own:
+{markers}
+Do not refer to the other sections inside a part.
+"""
+
+DIGEST_SYSTEM_PROMPT = """You are an expert compliance analyst. Condense documents into a complete, compact list of what they state, so that they can be checked against compliance guidelines without the full text.
+
+Guidelines for the digest:
+- Keep every claim, commitment, obligation, requirement, deliverable, date, amount, party, role, metric and exception
+- Keep numbers, names and defined terms exactly as written
+- Drop boilerplate, repetition and formatting
+- One item per line, as a Markdown bullet, grouped under the section heading it comes from
+- End every item with its section anchor in square brackets, e.g. [§ 4.2 Payment Terms]; use the nearest heading (number and title as written), or [§ start] before the first heading"""
+
+DIGEST_HEADER = "Digest of the input document (claims and requirements; [§ ...] anchors name the source sections):\n\n"
+
+def get_digest_user_prompt(document_part: str, part_number: int, part_count: int) -> str:
+    """Generate the user prompt for condensing (one part of) an input document"""
+    part = f" (part {part_number} of {part_count}; the other parts are condensed separately)" if part_count > 1 else ""
+    return f"""
+Document{part}:
+{document_part}
+
+Please condense this document into its claims and requirements, each with its section anchor.
+"""
+
+TRIAGE_SYSTEM_PROMPT = """You screen reference document sections before a full compliance review. Decide whether a section is relevant to checking the input document: it states requirements, rules, terms or topics that the input document covers, or should cover.
+
+Answer with a JSON object only: {"relevant": true or false, "reason": "<at most 15 words>"}
+When unsure, answer relevant: true."""
+
+def get_triage_user_prompt(instructions: str, input_document: str, reference_chunk: str) -> str:
+    """Generate the user prompt for the relevant / not relevant screen of one reference section"""
+    return f"""
+Instructions: {instructions if instructions.strip() else "Perform a general compliance validation"}
+
+Input Document:
+{input_document}
+
+Reference Document Section:
+{reference_chunk}
+
+Is this reference document section relevant to validating the input document? Answer with the JSON object only.
+"""
+
 # Additional prompts can be added here as the system grows
 SUMMARIZATION_SYSTEM_PROMPT = """You are an expert at summarizing technical documents. Provide clear, concise summaries that capture the key points."""
 
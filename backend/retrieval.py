@@ -0,0 +1,235 @@
+# retrieval.py — local BM25 index over reference passages, used to prune LLM calls
+"""
+Each reference twin gets a small lexical index, built when the reference is
+converted and stored next to it as a JSON sidecar:
+
+  <user>/reference_docs_md/foo.md        (twin)
+  <user>/reference_docs_md/foo.bm25.json (index)
+
+The index splits the Markdown into passages (paragraphs packed up to
+PASSAGE_WORDS words) and stores, per passage, its character span and term
+frequencies, plus the document frequencies BM25 needs. Everything runs offline:
+a regex tokenizer and a short stopword list, no models, no network.
+
+At validation time the input document is the query. A reference chunk scores
+as its best passage (passages overlapping the chunk's character span), and
+chunks scoring below RETRIEVAL_PRUNE_THRESHOLD x (best chunk in that reference)
+are not sent to the LLM. The best chunk of every reference is always kept.
+
+Inputs too large to send whole are split into parts (validation.py), and each
+(input part, reference chunk) pair is scored with the part as the query. Pairs
+below RETRIEVAL_PAIR_THRESHOLD x (best pair in that reference) are pruned.
+
+CLI (recall check: which chunks would be kept, and are the expected ones among them):
+  python retrieval.py recall ../sample_data/sow.txt ../sample_data/compliance_guidelines.txt \\
+      --chunk-tokens 300 --expect "Healthcare Projects,Financial Terms"
+The sample guidelines are on-topic throughout, so this keeps every chunk;
+tests/test_retrieval_recall.py adds unrelated sections and checks they are pruned.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".bm25.json"
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+PASSAGE_WORDS = int(os.getenv("RETRIEVAL_PASSAGE_WORDS", "120"))
+
+RETRIEVAL_PRUNE_ENABLED = os.getenv("RETRIEVAL_PRUNE_ENABLED", "true").lower() == "true"
+# Chunks scoring below this fraction of the reference's best chunk are skipped
+RETRIEVAL_PRUNE_THRESHOLD = float(os.getenv("RETRIEVAL_PRUNE_THRESHOLD", "0.15"))
+# Same, for (input part, reference chunk) pairs when the input is split
+RETRIEVAL_PAIR_THRESHOLD = float(os.getenv("RETRIEVAL_PAIR_THRESHOLD", "0.25"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between both but
+by can could did do does doing down during each few for from further had has have having he her here hers him his
+how i if in into is it its itself just may me more most must my no nor not now of off on once only or other our
+ours out over own same shall she should so some such than that the their theirs them then there these they this
+those through to too under until up upon very was we were what when where which while who whom why will with
+within would you your yours
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in _STOPWORDS]
+
+def index_path_for_twin(twin_path: str) -> str:
+    """<...>_md/foo.md -> <...>_md/foo.bm25.json"""
+    base, _ = os.path.splitext(twin_path)
+    return base + INDEX_SUFFIX
+
+# --------------------------------------------------------------------------
+# Index
+# --------------------------------------------------------------------------
+
+@dataclass
+class Passage:
+    start: int
+    end: int
+    length: int
+    tf: Dict[str, int]
+
+@dataclass
+class BM25Index:
+    passages: List[Passage] = field(default_factory=list)
+    df: Dict[str, int] = field(default_factory=dict)
+    avgdl: float = 0.0
+
+    def idf(self, term: str) -> float:
+        n = len(self.passages)
+        df = self.df.get(term, 0)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def passage_scores(self, query_terms: Sequence[str]) -> List[float]:
+        idf = {t: self.idf(t) for t in set(query_terms) if t in self.df}
+        avgdl = self.avgdl or 1.0
+        scores = []
+        for p in self.passages:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * p.length / avgdl)
+            score = 0.0
+            for term, weight in idf.items():
+                tf = p.tf.get(term)
+                if tf:
+                    score += weight * tf * (BM25_K1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+    def to_json(self) -> dict:
+        return {
+            "version": INDEX_VERSION,
+            "avgdl": self.avgdl,
+            "df": self.df,
+            "passages": [[p.start, p.end, p.length, p.tf] for p in self.passages],
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> Optional["BM25Index"]:
+        if data.get("version") != INDEX_VERSION:
+            return None
+        return cls(
+            passages=[Passage(start=s, end=e, length=n, tf=tf) for s, e, n, tf in data["passages"]],
+            df=data["df"],
+            avgdl=data["avgdl"],
+        )
+
+def _passage_spans(markdown: str, max_words: int) -> List[Tuple[int, int]]:
+    """Paragraph spans (split on blank lines), merged until each holds about max_words words."""
+    spans: List[Tuple[int, int]] = []
+    start, words = None, 0
+    for m in re.finditer(r"\S(?:.*?)(?=\n\s*\n|\Z)", markdown, flags=re.S):
+        if start is None:
+            start = m.start()
+        words += len(m.group(0).split())
+        if words >= max_words:
+            spans.append((start, m.end()))
+            start, words = None, 0
+    if start is not None:
+        spans.append((start, len(markdown)))
+    return spans
+
+def build_index(markdown: str, max_words: int = PASSAGE_WORDS) -> BM25Index:
+    passages = []
+    df: Counter = Counter()
+    for start, end in _passage_spans(markdown, max_words):
+        terms = tokenize(markdown[start:end])
+        tf = Counter(terms)
+        df.update(tf.keys())
+        passages.append(Passage(start=start, end=end, length=len(terms), tf=dict(tf)))
+    avgdl = sum(p.length for p in passages) / len(passages) if passages else 0.0
+    return BM25Index(passages=passages, df=dict(df), avgdl=avgdl)
+
+def serialize_index(index: BM25Index) -> bytes:
+    return json.dumps(index.to_json(), separators=(",", ":")).encode("utf-8")
+
+def load_index(data: bytes) -> Optional[BM25Index]:
+    try:
+        return BM25Index.from_json(json.loads(data))
+    except (ValueError, KeyError, TypeError):
+        return None
+
+# --------------------------------------------------------------------------
+# Chunk scoring / pruning
+# --------------------------------------------------------------------------
+
+def chunk_scores(index: BM25Index, spans: Sequence[Tuple[int, int]], query_terms: Sequence[str]) -> List[float]:
+    """Each chunk (character span in the reference) scores as the best passage overlapping it."""
+    passage_scores = index.passage_scores(query_terms)
+    scores = []
+    for start, end in spans:
+        overlapping = [s for p, s in zip(index.passages, passage_scores) if p.start < end and p.end > start]
+        scores.append(max(overlapping, default=0.0))
+    return scores
+
+def pair_scores(index: BM25Index, spans: Sequence[Tuple[int, int]], part_terms: Sequence[Sequence[str]]) -> List[List[float]]:
+    """scores[part][chunk]: chunk_scores() with each input part as the query."""
+    return [chunk_scores(index, spans, terms) for terms in part_terms]
+
+def select_chunks(scores: Sequence[float], threshold: float = RETRIEVAL_PRUNE_THRESHOLD) -> List[bool]:
+    """Keep-mask: chunks at or above threshold x best score. The best chunk is always kept."""
+    if not scores:
+        return []
+    best = max(scores)
+    if best <= 0:
+        return [True] * len(scores)  # no lexical signal at all; don't guess
+    return [s >= threshold * best for s in scores]
+
+# --------------------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------------------
+
+def _recall_cli(args):
+    from chunking import chunk_markdown
+
+    with open(args.input, encoding="utf-8") as f:
+        input_md = f.read()
+    with open(args.reference, encoding="utf-8") as f:
+        reference_md = f.read()
+
+    index = build_index(reference_md)
+    chunks, spans = chunk_markdown(reference_md, args.chunk_tokens)
+    scores = chunk_scores(index, spans, tokenize(input_md))
+    keep = select_chunks(scores, args.threshold)
+
+    for i, (chunk, score, kept) in enumerate(zip(chunks, scores, keep)):
+        headings = re.findall(r"^#+\s*(.+)$", chunk, flags=re.M)
+        label = headings[0] if headings else chunk.strip().splitlines()[0][:60] if chunk.strip() else ""
+        print(f"{'keep ' if kept else 'PRUNE'}  chunk {i + 1:>3}  score {score:7.2f}  {label}")
+    print(f"\n{sum(keep)}/{len(chunks)} chunk(s) kept, {len(chunks) - sum(keep)} pruned "
+          f"(threshold {args.threshold} x best, {len(index.passages)} passages)")
+
+    if args.expect:
+        missing = []
+        for expected in [e.strip() for e in args.expect.split(",") if e.strip()]:
+            holders = [i for i, c in enumerate(chunks) if expected.lower() in c.lower()]
+            if not holders or not any(keep[i] for i in holders):
+                missing.append(expected)
+        if missing:
+            print(f"❌ Recall check failed; pruned: {', '.join(missing)}")
+            sys.exit(1)
+        print("✅ Recall check passed: every expected section is kept")
+
+def main():
+    parser = argparse.ArgumentParser(description="Local BM25 index for reference chunk pruning")
+    sub = parser.add_subparsers(dest="command", required=True)
+    recall = sub.add_parser("recall", help="Score a reference's chunks against an input document")
+    recall.add_argument("input")
+    recall.add_argument("reference")
+    recall.add_argument("--chunk-tokens", type=int, default=300)
+    recall.add_argument("--threshold", type=float, default=RETRIEVAL_PRUNE_THRESHOLD)
+    recall.add_argument("--expect", default="", help="Comma-separated text that must stay in kept chunks")
+    args = parser.parse_args()
+    if args.command == "recall":
+        _recall_cli(args)
+
+if __name__ == "__main__":
+    main()
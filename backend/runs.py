@@ -0,0 +1,125 @@
+# runs.py — validation run records stored in ADLS, for incremental re-validation
+"""
+Every /validate run saves what it computed, keyed by what determines it:
+
+  <user_id>/validation_runs/<run_key>.json
+  {
+    "version": 1,
+    "input_hash", "instructions_hash", "engine_hash", "updated_at",
+    "references": {
+      "<reference content hash>": {"name", "chunk_size", "chunks": [analysis, ...], "validated_at"}
+    }
+  }
+
+run_key covers the input Markdown, the instructions and the engine (system
+prompt, user prompt template, deployment, token budget, chunker, BM25
+pruning, input-splitting and triage settings). The next run with the same key only validates references
+whose content hash is not in the record; the others are merged back in from
+storage and flagged as reused.
+
+Only complete, error-free reference results are recorded. Records are a cache:
+concurrent runs for the same key overwrite each other (last writer wins).
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.filedatalake.aio import FileSystemClient
+
+from cache import hash_key
+from prompts import TRIAGE_SYSTEM_PROMPT, VALIDATION_SYSTEM_PROMPT, get_validation_user_prompt
+from chunking import CHUNKS_VERSION, CHUNK_BLOCK_TOKENS, CHUNK_OVERLAP_TOKENS
+from retrieval import RETRIEVAL_PAIR_THRESHOLD, RETRIEVAL_PRUNE_ENABLED, RETRIEVAL_PRUNE_THRESHOLD, PASSAGE_WORDS
+from storage import upload_file_to_adls
+from triage import triage_deployment_for
+from validation import (
+    MAX_TOKENS, MODEL_DEPLOYMENT_NAME, VALIDATION_INPUT_PART_TOKENS, VALIDATION_MIN_REFERENCE_TOKENS,
+    VALIDATION_SPLIT_INPUT, PriorResults, ReferenceResult, is_reusable, text_hash,
+)
+
+RUN_RECORD_VERSION = 1
+RUNS_FOLDER = "validation_runs"
+VALIDATION_REUSE_RUNS = os.getenv("VALIDATION_REUSE_RUNS", "true").lower() == "true"
+# References kept per record, most recently validated first (also keeps removed references for a while)
+RUN_RECORD_MAX_REFERENCES = int(os.getenv("RUN_RECORD_MAX_REFERENCES", "200"))
+
+def engine_hash() -> str:
+    return hash_key(
+        VALIDATION_SYSTEM_PROMPT, get_validation_user_prompt("", "", ""),
+        MODEL_DEPLOYMENT_NAME or "", str(MAX_TOKENS),
+        f"chunks={CHUNKS_VERSION}:{CHUNK_BLOCK_TOKENS}:{CHUNK_OVERLAP_TOKENS}",
+        f"prune={RETRIEVAL_PRUNE_ENABLED}:{RETRIEVAL_PRUNE_THRESHOLD}:{RETRIEVAL_PAIR_THRESHOLD}:{PASSAGE_WORDS}",
+        f"split={VALIDATION_SPLIT_INPUT}:{VALIDATION_MIN_REFERENCE_TOKENS}:{VALIDATION_INPUT_PART_TOKENS}",
+        f"triage={triage_deployment_for(MODEL_DEPLOYMENT_NAME) or ''}", TRIAGE_SYSTEM_PROMPT,
+    )
+
+def run_key(input_markdown: str, instructions: str) -> str:
+    return hash_key(text_hash(input_markdown), text_hash(instructions), engine_hash())
+
+def run_record_path(user_id: str, key: str) -> str:
+    return f"{user_id}/{RUNS_FOLDER}/{key}.json"
+
+async def load_run_record(fs: FileSystemClient, user_id: str, key: str) -> Optional[dict]:
+    fc = fs.get_file_client(run_record_path(user_id, key))
+    try:
+        download = await fc.download_file()
+        record = json.loads(await download.readall())
+    except ResourceNotFoundError:
+        return None
+    except Exception as e:
+        # A broken record only costs a full re-run
+        print(f"ℹ️ Ignoring unreadable run record {key}: {e}")
+        return None
+    return record if record.get("version") == RUN_RECORD_VERSION else None
+
+async def load_prior_results(fs: FileSystemClient, user_id: str, input_markdown: str, instructions: str) -> Optional[PriorResults]:
+    """Stored per-reference results for this (input, instructions, engine), or None."""
+    if not VALIDATION_REUSE_RUNS:
+        return None
+    record = await load_run_record(fs, user_id, run_key(input_markdown, instructions))
+    return record["references"] if record else None
+
+async def save_run_record(
+    fs: FileSystemClient,
+    user_id: str,
+    input_markdown: str,
+    instructions: str,
+    results: List[ReferenceResult],
+    prior: Optional[PriorResults] = None,
+):
+    """Merge this run's reusable reference results into the record. Never fails the request."""
+    if not VALIDATION_REUSE_RUNS:
+        return
+    fresh = [r for r in results if not r.reused and is_reusable(r)]
+    if not fresh:
+        return
+
+    now = datetime.now(timezone.utc).isoformat()
+    references = dict(prior or {})
+    for r in fresh:
+        references[r.content_hash] = {
+            "name": r.name,
+            "chunk_size": r.chunk_size,
+            "chunks": r.chunk_results,
+            "validated_at": now,
+        }
+    if len(references) > RUN_RECORD_MAX_REFERENCES:
+        newest = sorted(references.items(), key=lambda kv: kv[1].get("validated_at") or "", reverse=True)
+        references = dict(newest[:RUN_RECORD_MAX_REFERENCES])
+
+    key = run_key(input_markdown, instructions)
+    record = {
+        "version": RUN_RECORD_VERSION,
+        "input_hash": text_hash(input_markdown),
+        "instructions_hash": text_hash(instructions),
+        "engine_hash": engine_hash(),
+        "updated_at": now,
+        "references": references,
+    }
+    try:
+        await upload_file_to_adls(fs, json.dumps(record).encode("utf-8"), run_record_path(user_id, key))
+    except Exception as e:
+        print(f"⚠️ Could not save run record {key}: {e}")
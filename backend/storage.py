@@ -0,0 +1,300 @@
+# storage.py — async ADLS Gen2 helpers for the FastAPI backend
+"""
+Non-blocking equivalents of the ADLS helpers used by app.py, built on
+azure.storage.filedatalake.aio so storage round trips never stall the event loop.
+
+One DataLakeServiceClient (and its HTTP session) is created lazily on first use
+and shared by every request in the process; call close_adls_client() on shutdown.
+It authenticates with the process-wide credential and pool settings from clients.py.
+"""
+
+import asyncio
+import hashlib
+import os
+import os.path as op
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from azure.storage.filedatalake.aio import DataLakeServiceClient, FileSystemClient
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+from clients import AsyncSharedCredential, get_shared_credential, build_adls_transport
+
+load_dotenv()
+
+# ADLS config
+STORAGE_ACCOUNT_NAME = os.getenv("STORAGE_ACCOUNT_NAME", "djg0storage0shared")
+CONTAINER_NAME = os.getenv("CONTAINER_NAME", "shared")
+
+# How long a bootstrapped user namespace is trusted before it is re-checked
+USER_NAMESPACE_TTL_SECONDS = int(os.getenv("USER_NAMESPACE_TTL_SECONDS", "900"))
+
+# Streaming uploads: fixed-size appends, several in flight at once
+UPLOAD_BLOCK_BYTES = int(os.getenv("UPLOAD_BLOCK_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_PARALLEL_BLOCKS = int(os.getenv("UPLOAD_PARALLEL_BLOCKS", "4"))
+
+_service_client: Optional[DataLakeServiceClient] = None
+
+# user_id -> time.monotonic() when its namespace was last verified/created
+_ready_namespaces: Dict[str, float] = {}
+
+# The container is shared by every user: once it is known to exist it is not probed again
+# (until a 404 suggests it was removed)
+_file_system_ready = False
+
+# --------------------------------------------------------------------------
+# Shared client
+# --------------------------------------------------------------------------
+
+def get_adls_client() -> DataLakeServiceClient:
+    """Return the process-wide async DataLakeServiceClient (created on first use)."""
+    global _service_client
+    if _service_client is not None:
+        return _service_client
+    try:
+        account_url = f"https://{STORAGE_ACCOUNT_NAME}.dfs.core.windows.net/"
+        _service_client = DataLakeServiceClient(
+            account_url=account_url,
+            credential=AsyncSharedCredential(get_shared_credential()),
+            transport=build_adls_transport(),
+        )
+        return _service_client
+    except Exception as e:
+        print(f"Failed to connect to ADLS: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to connect to storage: {str(e)}")
+
+def get_file_system_client() -> FileSystemClient:
+    return get_adls_client().get_file_system_client(CONTAINER_NAME)
+
+async def close_adls_client():
+    """Close the shared client and its HTTP session (call once on app shutdown)."""
+    global _service_client
+    if _service_client is not None:
+        await _service_client.close()
+        _service_client = None
+
+# --------------------------------------------------------------------------
+# User namespace
+# --------------------------------------------------------------------------
+
+def invalidate_user_namespace(user_id: str):
+    """Forget that a user's namespace is ready; the next request re-bootstraps it."""
+    _ready_namespaces.pop(user_id, None)
+
+def _invalidate_on_not_found(path: str, error: Exception):
+    # A 404 may mean the container or user folders were removed underneath us
+    global _file_system_ready
+    if isinstance(error, ResourceNotFoundError):
+        _file_system_ready = False
+        invalidate_user_namespace(path.split("/", 1)[0])
+
+async def _ensure_file_system(file_system_client: FileSystemClient):
+    """Create the container only if it is missing; a known-good container costs nothing."""
+    global _file_system_ready
+    if _file_system_ready:
+        return
+    if not await file_system_client.exists():
+        try:
+            await file_system_client.create_file_system()
+            print(f"✅ Created container: {CONTAINER_NAME}")
+        except ResourceExistsError:
+            pass  # created concurrently
+    _file_system_ready = True
+
+async def _create_directory_if_missing(file_system_client: FileSystemClient, folder_path: str):
+    try:
+        dc = file_system_client.get_directory_client(folder_path)
+        await dc.create_directory(match_condition=MatchConditions.IfMissing)
+        print(f"✅ Created directory: {folder_path}")
+    except ResourceExistsError:
+        pass
+
+async def ensure_user_folders_exist(user_id: str) -> FileSystemClient:
+    """
+    Ensure container and user folders exist, including Markdown mirrors:
+      <user_id>/
+      <user_id>/input_docs
+      <user_id>/reference_docs
+      <user_id>/input_docs_md
+      <user_id>/reference_docs_md
+
+    Ready namespaces are cached per user for USER_NAMESPACE_TTL_SECONDS, so warm
+    requests make no storage calls. A cold check creates the user folders
+    concurrently with create-if-missing requests (one round trip per path); the
+    container is probed once per process and created only when it is missing.
+    """
+    fs = get_file_system_client()
+    ready_at = _ready_namespaces.get(user_id)
+    if ready_at is not None and time.monotonic() - ready_at < USER_NAMESPACE_TTL_SECONDS:
+        return fs
+
+    try:
+        await _ensure_file_system(fs)
+
+        folders_to_create = [
+            f"{user_id}",
+            f"{user_id}/input_docs",
+            f"{user_id}/reference_docs",
+            f"{user_id}/input_docs_md",
+            f"{user_id}/reference_docs_md",
+        ]
+        await asyncio.gather(*(_create_directory_if_missing(fs, folder) for folder in folders_to_create))
+        _ready_namespaces[user_id] = time.monotonic()
+        return fs
+    except Exception as e:
+        print(f"❌ Error ensuring folders exist: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to create user folders: {str(e)}")
+
+# --------------------------------------------------------------------------
+# File helpers
+# --------------------------------------------------------------------------
+
+async def upload_file_to_adls(file_system_client: FileSystemClient, file_content: bytes, file_path: str) -> bool:
+    try:
+        fc = file_system_client.get_file_client(file_path)
+        await fc.create_file()
+        await fc.append_data(file_content, offset=0, length=len(file_content))
+        await fc.flush_data(len(file_content))
+        print(f"✅ Uploaded file to: {file_path}")
+        return True
+    except Exception as e:
+        _invalidate_on_not_found(file_path, e)
+        print(f"❌ Error uploading file to {file_path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
+
+def _read_block(local_path: str, offset: int, length: int) -> bytes:
+    with open(local_path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+async def upload_local_file_to_adls(file_system_client: FileSystemClient, local_path: str, file_path: str) -> int:
+    """
+    Stream a local file to ADLS in UPLOAD_BLOCK_BYTES appends, with up to
+    UPLOAD_PARALLEL_BLOCKS appends in flight. Peak memory is bounded by
+    block size x parallelism regardless of file size. Returns bytes written.
+    """
+    try:
+        size = os.path.getsize(local_path)
+        fc = file_system_client.get_file_client(file_path)
+        await fc.create_file()
+
+        sem = asyncio.Semaphore(UPLOAD_PARALLEL_BLOCKS)
+
+        async def _append(offset: int):
+            async with sem:
+                block = await asyncio.to_thread(_read_block, local_path, offset, UPLOAD_BLOCK_BYTES)
+                await fc.append_data(block, offset=offset, length=len(block))
+
+        await asyncio.gather(*(_append(offset) for offset in range(0, size, UPLOAD_BLOCK_BYTES)))
+        await fc.flush_data(size)
+        print(f"✅ Uploaded file to: {file_path} ({size:,} bytes)")
+        return size
+    except Exception as e:
+        _invalidate_on_not_found(file_path, e)
+        print(f"❌ Error uploading file to {file_path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
+
+async def download_file_from_adls(file_system_client: FileSystemClient, file_path: str) -> bytes:
+    try:
+        fc = file_system_client.get_file_client(file_path)
+        download = await fc.download_file()
+        return await download.readall()
+    except Exception as e:
+        _invalidate_on_not_found(file_path, e)
+        print(f"❌ Error downloading file from {file_path}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to download file: {str(e)}")
+
+async def download_optional_file_from_adls(file_system_client: FileSystemClient, file_path: str) -> Optional[bytes]:
+    """Download a file that may legitimately be absent (sidecars, records): None instead of an error."""
+    try:
+        fc = file_system_client.get_file_client(file_path)
+        download = await fc.download_file()
+        return await download.readall()
+    except ResourceNotFoundError:
+        return None
+
+async def sha256_of_adls_file(file_system_client: FileSystemClient, file_path: str) -> str:
+    """SHA-256 of a stored file, hashed chunk by chunk as it streams (never held whole in memory)."""
+    try:
+        digest = hashlib.sha256()
+        download = await file_system_client.get_file_client(file_path).download_file()
+        async for chunk in download.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+    except Exception as e:
+        _invalidate_on_not_found(file_path, e)
+        raise
+
+async def _file_details(file_system_client: FileSystemClient, path: str) -> Optional[dict]:
+    try:
+        props = await file_system_client.get_file_client(path).get_file_properties()
+        return {
+            "file_path": path,
+            "original_filename": os.path.basename(path),
+            "file_size": props.size,
+            "upload_date": props.last_modified.isoformat() if props.last_modified else None
+        }
+    except Exception as e:
+        print(f"Error getting properties for {path}: {e}")
+        return None
+
+async def list_files_in_directory_detailed(file_system_client: FileSystemClient, directory_path: str) -> List[dict]:
+    try:
+        names = [
+            p.name
+            async for p in file_system_client.get_paths(path=directory_path, recursive=False)
+            if not p.is_directory
+        ]
+        # Property lookups are independent; issue them concurrently instead of one by one
+        details = await asyncio.gather(*(_file_details(file_system_client, n) for n in names))
+        return [d for d in details if d is not None]
+    except Exception as e:
+        _invalidate_on_not_found(directory_path, e)
+        print(f"❌ Error listing files in {directory_path}: {e}")
+        return []
+
+async def adls_path_exists(file_system_client: FileSystemClient, file_path: str) -> bool:
+    try:
+        fc = file_system_client.get_file_client(file_path)
+        _ = await fc.get_file_properties()
+        return True
+    except Exception:
+        return False
+
+async def safe_delete(file_system_client: FileSystemClient, path: str) -> bool:
+    try:
+        fc = file_system_client.get_file_client(path)
+        await fc.delete_file()
+        print(f"✅ Deleted: {path}")
+        return True
+    except Exception as e:
+        print(f"ℹ️ Skipped delete (likely missing): {path} ({e})")
+        return False
+
+# --------------------------------------------------------------------------
+# Markdown twin paths (PDF-only)
+# --------------------------------------------------------------------------
+
+def to_md_folder(raw_path: str) -> str:
+    """
+    Map raw PDF path to its Markdown twin path:
+      <user>/input_docs/foo.pdf -> <user>/input_docs_md/foo.md
+      <user>/reference_docs/bar.pdf -> <user>/reference_docs_md/bar.md
+    """
+    parts = raw_path.split("/")
+    if len(parts) < 3:
+        raise ValueError(f"Unexpected path shape: {raw_path}")
+    folder = parts[-2]
+    if folder.endswith("_md"):
+        base, _ = op.splitext(parts[-1])
+        parts[-1] = base + ".md"
+        return "/".join(parts)
+    md_folder = folder + "_md"
+    base, _ = op.splitext(parts[-1])
+    parts[-2] = md_folder
+    parts[-1] = base + ".md"
+    return "/".join(parts)
@@ -0,0 +1,5 @@
+# conftest.py — backend modules import each other by bare name (as app.py and test.py do)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
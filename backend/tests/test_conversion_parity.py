@@ -0,0 +1,105 @@
+# test_conversion_parity.py — page-parallel conversion == single pymupdf4llm pass
+"""
+convert_pdf splits a document into page ranges, converts them on the process
+pool and stitches them in page order. The output must be identical to one
+pymupdf4llm pass over the whole document (conversion.compare), in both image
+modes and for range sizes that do and do not divide the page count.
+
+The PDF is generated with PyMuPDF: headings at three font sizes (so header
+levels must be ranked document-wide), body text, and a raster image on most
+pages, with one heading-free page inside a range.
+
+  cd backend && python -m pytest tests/test_conversion_parity.py -q
+"""
+
+import asyncio
+import io
+import random
+
+import pytest
+from PIL import Image
+
+import conversion
+
+PAGES = 11
+
+def _png(seed: int) -> bytes:
+    rng = random.Random(seed)
+    img = Image.new("RGB", (120, 80))
+    img.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(120 * 80)])
+    out = io.BytesIO()
+    img.save(out, "PNG")
+    return out.getvalue()
+
+@pytest.fixture(scope="module")
+def sample_pdf(tmp_path_factory):
+    import fitz
+
+    doc = fitz.open()
+    for n in range(PAGES):
+        page = doc.new_page()
+        y = 72
+        if n % 4 == 0:
+            page.insert_text((72, y), f"Part {n // 4 + 1}", fontsize=22)
+            y += 36
+        if n != 6:  # page 7 has no heading at all
+            page.insert_text((72, y), f"Section {n + 1}.1 Requirements", fontsize=16)
+            y += 28
+        for line in range(8):
+            page.insert_text((72, y), f"Clause {n + 1}.{line}: the supplier shall keep records for {line + 3} years.", fontsize=10)
+            y += 14
+        if n % 3 != 2:
+            page.insert_image(fitz.Rect(72, y + 20, 312, y + 180), stream=_png(n))
+    path = tmp_path_factory.mktemp("pdf") / "sample.pdf"
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+@pytest.fixture(scope="module", autouse=True)
+def _pool():
+    yield
+    conversion.shutdown_conversion_pool()
+
+@pytest.mark.parametrize("image_mode", [conversion.IMAGE_MODE_BYTES, conversion.IMAGE_MODE_EMBED])
+@pytest.mark.parametrize("pages_per_task", [1, 4, PAGES])
+def test_page_parallel_matches_single_pass(sample_pdf, image_mode, pages_per_task):
+    assert conversion.compare(sample_pdf, pages_per_task, image_mode)
+
+def test_placeholders_index_document_images(sample_pdf):
+    converted = conversion.convert_pdf_sync(sample_pdf, pages_per_task=3, image_mode=conversion.IMAGE_MODE_BYTES)
+    indexes = [int(i) for i in conversion._PLACEHOLDER_TARGET.findall(converted.markdown)]
+    assert indexes == list(range(len(converted.images)))
+    assert converted.page_count == PAGES
+
+def test_concurrent_conversions_survive_pool_recycling(sample_pdf, tmp_path, monkeypatch):
+    import fitz
+
+    doc = fitz.open()
+    for n in range(2):
+        doc.new_page().insert_text((72, 72), f"Short document page {n + 1}", fontsize=12)
+    short_pdf = str(tmp_path / "short.pdf")
+    doc.save(short_pdf)
+    doc.close()
+
+    # Recycle after every document: the short one finishes (and recycles the pool)
+    # while the long one still has ranges to submit to the pool it started on
+    conversion.shutdown_conversion_pool()
+    monkeypatch.setattr(conversion, "CONVERSION_PROCESSES", 2)
+    monkeypatch.setattr(conversion, "CONVERSION_MAX_TASKS_PER_CHILD", 1)
+
+    async def _both():
+        first_pool = conversion.get_conversion_pool()
+        results = await asyncio.gather(
+            conversion.convert_pdf(sample_pdf, pages_per_task=1),
+            conversion.convert_pdf(short_pdf, pages_per_task=1),
+        )
+        return results, conversion.get_conversion_pool() is not first_pool, dict(conversion._pool_users)
+
+    try:
+        (long_doc, short_doc), recycled, users = asyncio.run(_both())
+    finally:
+        conversion.shutdown_conversion_pool()
+    assert recycled
+    assert not users
+    assert long_doc.page_count == PAGES and short_doc.page_count == 2
+    assert "Short document page 2" in short_doc.markdown
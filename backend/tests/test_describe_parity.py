@@ -0,0 +1,111 @@
+# test_describe_parity.py — concurrent / batched image descriptions match the sequential path
+"""
+replace_images_with_text must produce the same Markdown for any max_workers
+and with or without multi-image batching: descriptions are stitched back into
+the original match positions. describe_image / describe_images are replaced by
+deterministic fakes (a description is a function of the image bytes), so the
+expected output can be built independently, one placeholder at a time.
+
+  cd backend && python -m pytest tests/test_describe_parity.py -q
+"""
+
+import hashlib
+import io
+import random
+import time
+
+import pytest
+from PIL import Image
+
+import pdf_to_markdown_with_image_descriptions as describe
+
+def _png(seed: int) -> bytes:
+    rng = random.Random(seed)
+    img = Image.new("RGB", (64, 64))
+    img.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(64 * 64)])
+    out = io.BytesIO()
+    img.save(out, "PNG")
+    return out.getvalue()
+
+def _fake_description(data_url: str) -> str:
+    return "figure " + hashlib.sha256(data_url.encode("ascii")).hexdigest()[:12]
+
+@pytest.fixture
+def document():
+    images = [_png(i) for i in range(12)]
+    parts = []
+    for page in range(4):
+        parts.append(f"# Page {page + 1}\n\nSome text about section {page + 1}.\n\n")
+        for j in range(3):
+            parts.append(f"![](ccimg:{page * 3 + j})\n\nCaption {page}.{j}\n\n")
+        parts.append("-----\n\n")
+    parts.append("Repeated logo: ![](ccimg:0)\n")  # repeat of an earlier image
+    return "".join(parts), images
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    calls = {"single": 0, "batch": 0}
+
+    def _describe_image(client, data_url, context):
+        calls["single"] += 1
+        time.sleep(0.01)
+        return _fake_description(data_url)
+
+    def _describe_images(client, data_urls, contexts):
+        calls["batch"] += 1
+        time.sleep(0.01)
+        return {i: _fake_description(url) for i, url in enumerate(data_urls, start=1)}
+
+    monkeypatch.setattr(describe, "IMAGE_CACHE_ENABLED", False)
+    monkeypatch.setattr(describe, "_description_cache", None)
+    monkeypatch.setattr(describe, "describe_image", _describe_image)
+    monkeypatch.setattr(describe, "describe_images", _describe_images)
+    return calls
+
+def _sequential_expected(markdown, images):
+    """Today's sequential path, one placeholder at a time."""
+    def _replace(m):
+        return f"> Image: {_fake_description(describe.image_data_url(images[int(m.group(1))]))}\n\n"
+    return describe.IMAGE_PLACEHOLDER_PATTERN.sub(_replace, markdown)
+
+@pytest.mark.parametrize("batch", [False, True])
+@pytest.mark.parametrize("max_workers", [1, 4, 8])
+def test_output_matches_sequential_path(document, fake_model, monkeypatch, batch, max_workers):
+    markdown, images = document
+    monkeypatch.setattr(describe, "VISION_BATCH_ENABLED", batch)
+    result = describe.replace_images_with_text(markdown, object(), max_workers=max_workers, images=images)
+    assert result == _sequential_expected(markdown, images)
+
+def test_batching_cuts_requests(document, fake_model, monkeypatch):
+    markdown, images = document
+    monkeypatch.setattr(describe, "VISION_BATCH_ENABLED", True)
+    monkeypatch.setattr(describe, "VISION_BATCH_MAX_IMAGES", 4)
+    describe.replace_images_with_text(markdown, object(), images=images)
+    # 4 sections with 3 new images each -> one request per section
+    assert fake_model == {"single": 0, "batch": 4}
+
+def test_progress_reaches_total(document, fake_model):
+    markdown, images = document
+    progress = []
+    describe.replace_images_with_text(markdown, object(), max_workers=4, images=images,
+                                      on_progress=lambda done, total: progress.append((done, total)))
+    assert progress[-1] == (13, 13)
+
+def test_batches_leave_full_output_budget_per_image(fake_model, monkeypatch):
+    images = [_png(100 + i) for i in range(6)]
+    markdown = "# One section\n\n" + "".join(f"![](ccimg:{i})\n\n" for i in range(6))
+    batch_sizes = []
+    fake_describe_images = describe.describe_images
+
+    def _describe_images(client, data_urls, contexts):
+        batch_sizes.append(len(data_urls))
+        return fake_describe_images(client, data_urls, contexts)
+
+    monkeypatch.setattr(describe, "describe_images", _describe_images)
+    monkeypatch.setattr(describe, "VISION_BATCH_ENABLED", True)
+    monkeypatch.setattr(describe, "VISION_BATCH_MAX_IMAGES", 6)
+    monkeypatch.setattr(describe, "VISION_BATCH_MAX_TOKENS", 8000)
+    describe.replace_images_with_text(markdown, object(), images=images)
+    # 8000 tokens hold four 2000-token descriptions: six images need two requests, not one truncated one
+    assert sorted(batch_sizes) == [2, 4]
+    assert max(batch_sizes) * describe.DESCRIPTION_MAX_TOKENS <= 8000
@@ -0,0 +1,63 @@
+# test_image_filter.py — the decorative-image pre-filter never swallows real content
+"""
+A scanned page with a few lines of black text shrinks to a thumbnail that is
+almost all white (3 colours, entropy ~0.4 bits), exactly like a solid box. The
+flat check must still let it through to the vision model, while genuinely
+trivial images (solid boxes, glyphs, rules) keep being skipped.
+
+  cd backend && python -m pytest tests/test_image_filter.py -q
+"""
+
+import io
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import image_filter
+import pdf_to_markdown_with_image_descriptions as describe
+
+def _png(img: Image.Image) -> bytes:
+    out = io.BytesIO()
+    img.save(out, "PNG")
+    return out.getvalue()
+
+def _scanned_text_page(lines: int = 6) -> bytes:
+    img = Image.new("RGB", (1700, 2200), "white")
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=28)
+    for i in range(lines):
+        draw.text((120, 160 + i * 56), f"{i + 1}. The Supplier shall retain all records relating to clause {i + 1} "
+                                       "for seven years.", fill="black", font=font)
+    return _png(img)
+
+@pytest.mark.parametrize("lines", [1, 6])
+def test_scanned_text_is_not_flat(lines):
+    data = _scanned_text_page(lines)
+    colors, entropy = image_filter.color_stats(Image.open(io.BytesIO(data)))
+    assert colors <= 3 and entropy < image_filter.IMAGE_FILTER_MIN_ENTROPY  # the thumbnail alone looks flat
+    assert image_filter.classify_image(data) is None
+
+def test_trivial_images_are_still_skipped():
+    bullet = Image.new("RGBA", (48, 48), (0, 0, 0, 0))
+    ImageDraw.Draw(bullet).ellipse((8, 8, 40, 40), fill="black")
+    assert image_filter.classify_image(_png(Image.new("RGB", (100, 100), (30, 60, 200)))) == "flat"
+    assert image_filter.classify_image(_png(Image.new("RGB", (800, 600), (230, 230, 230)))) == "flat"
+    assert image_filter.classify_image(_png(bullet)) == "flat"
+    assert image_filter.classify_image(_png(Image.new("RGB", (800, 40), "black"))) == "rule"
+
+def test_scanned_text_reaches_the_vision_model(monkeypatch):
+    described = []
+
+    def _describe_image(client, data_url, context):
+        described.append(data_url)
+        return "six numbered contract clauses"
+
+    monkeypatch.setattr(describe, "IMAGE_FILTER_ENABLED", True)
+    monkeypatch.setattr(describe, "IMAGE_CACHE_ENABLED", False)
+    monkeypatch.setattr(describe, "_description_cache", None)
+    monkeypatch.setattr(describe, "describe_image", _describe_image)
+    markdown = "# Annex\n\n![](ccimg:0)\n"
+    result = describe.replace_images_with_text(markdown, object(), images=[_scanned_text_page()])
+    assert len(described) == 1
+    assert "six numbered contract clauses" in result
+    assert "decorative image omitted" not in result
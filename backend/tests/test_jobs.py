@@ -0,0 +1,68 @@
+# test_jobs.py — JobQueue.stop() leaves no job half-done
+"""
+Cancelling the workers bypasses the handler's own failure path, so stop() must
+fail every unfinished job (running or still queued) and hand each one to
+on_abandon for cleanup. Startup recovery rolls back only pending uploads whose
+owning process has exited (owner_exited), never one another worker still runs.
+
+  cd backend && python -m pytest tests/test_jobs.py -q
+"""
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+
+from jobs import STAGE_DONE, STAGE_FAILED, ConversionJob, JobQueue, owner_exited, process_alive
+
+def _job(name: str) -> ConversionJob:
+    return ConversionJob(
+        user_id="u", original_name=name, target_subdir="input_docs",
+        raw_path=f"u/input_docs/{name}", twin_path=f"u/input_docs_md/{name}.md",
+        spool_path=f"/tmp/{name}", file_size=1, content_hash="0",
+    )
+
+def test_stop_abandons_running_and_queued_jobs():
+    abandoned = []
+
+    async def handler(job: ConversionJob):
+        if job.original_name == "quick.pdf":
+            job.set_stage(STAGE_DONE)
+            return
+        await asyncio.Event().wait()  # never finishes on its own
+
+    async def on_abandon(job: ConversionJob):
+        abandoned.append(job.original_name)
+
+    async def scenario():
+        queue = JobQueue(handler, workers=1, on_abandon=on_abandon)
+        queue.start()
+        jobs = [queue.submit(_job(name)) for name in ("quick.pdf", "running.pdf", "queued.pdf")]
+        for _ in range(10):
+            await asyncio.sleep(0)
+        await queue.stop()
+        return jobs
+
+    quick, running, queued = asyncio.run(scenario())
+    assert quick.stage == STAGE_DONE
+    assert running.stage == queued.stage == STAGE_FAILED
+    assert running.error and queued.error
+    assert sorted(abandoned) == ["queued.pdf", "running.pdf"]
+
+def test_owner_exited_only_for_processes_that_are_gone():
+    host = socket.gethostname()
+    finished = subprocess.Popen([sys.executable, "-c", "pass"])
+    finished.wait()
+    running = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        assert process_alive(running.pid)
+        assert not owner_exited(f"{host}:{running.pid}")
+        assert not process_alive(finished.pid)
+        assert owner_exited(f"{host}:{finished.pid}")
+    finally:
+        running.kill()
+        running.wait()
+    assert owner_exited(f"{host}:{os.getpid()}")  # a previous process whose PID we reused
+    assert owner_exited(None)                     # entry written before owners were recorded
+    assert not owner_exited(f"some-other-host:{finished.pid}")  # cannot probe another machine
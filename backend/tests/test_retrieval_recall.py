@@ -0,0 +1,47 @@
+# test_retrieval_recall.py — BM25 pruning keeps the relevant sections and drops the unrelated ones
+"""
+The sample guidelines are on-topic from start to finish, so against the sample
+SOW every chunk is kept and the recall check alone proves nothing. Here the
+guidelines get two appendices with nothing in common with a SOW (kitchen rules,
+plant watering): at the default threshold those must be pruned while the
+sections the SOW actually touches stay in.
+
+  cd backend && python -m pytest tests/test_retrieval_recall.py -q
+"""
+
+import os
+
+from chunking import chunk_markdown
+from retrieval import RETRIEVAL_PRUNE_THRESHOLD, build_index, chunk_scores, select_chunks, tokenize
+
+SAMPLE_DATA = os.path.join(os.path.dirname(__file__), "..", "..", "sample_data")
+
+OFF_TOPIC_APPENDICES = """
+## Appendix A. Office Kitchen Etiquette
+
+Please rinse mugs and plates before stacking them in the dishwasher. The dishwasher runs every evening at six; unload it early in the morning if you arrive before everyone else. Label food in the refrigerator with your initials and the day it was bought. On Fridays the refrigerator is emptied and anything unlabelled goes to compost. Coffee beans are restocked on Mondays and Thursdays. If the espresso machine shows a descaling light, tell reception rather than opening the water tank. Microwaves should be wiped after reheating soup or curry. Do not leave fish in the toaster oven. Tea towels are washed every Saturday; put dirty ones in the basket under the sink. Birthday cakes are welcome, but please leave the knife and the cake stand clean for the following celebration. The fruit bowl is refilled on Tuesdays with apples, bananas, pears and seasonal oranges. Oat milk and soy milk sit on the second shelf. Recycling bins are colour coded: blue for cardboard, yellow for cans and bottles, green for glass jars.
+
+## Appendix B. Indoor Plant Watering
+
+The ferns near the windows need misting twice a fortnight and should never sit in standing water. Succulents on the reception desk are watered sparingly; their soil must dry out completely between waterings. The large fiddle leaf fig in the lounge dislikes being moved, so please do not rotate its pot. Yellowing leaves usually mean too much water, while crispy brown tips suggest dry air or too much sun. Feed the orchids from spring to autumn with a diluted orchid fertiliser, and trim spent flower spikes just above a node. Snake plants and pothos tolerate the dim corridor, but they still prefer a bright spot for a while each day. Repot anything whose roots circle the bottom of the pot, preferably in early spring, with fresh compost and added perlite for drainage. The watering rota is pinned beside the kitchen door; tick the box after watering so the same plant is not drowned twice in one day. During holidays the gardener visits on Wednesdays.
+"""
+
+EXPECTED_KEPT = ["Healthcare Projects", "Financial Terms", "Prohibited Terms"]
+
+def _read(name: str) -> str:
+    with open(os.path.join(SAMPLE_DATA, name), encoding="utf-8") as f:
+        return f.read()
+
+def test_recall_keeps_expected_sections_and_prunes_off_topic_ones():
+    query = tokenize(_read("sow.txt"))
+    reference = _read("compliance_guidelines.txt") + OFF_TOPIC_APPENDICES
+
+    chunks, spans = chunk_markdown(reference, 300)
+    keep = select_chunks(chunk_scores(build_index(reference), spans, query), RETRIEVAL_PRUNE_THRESHOLD)
+
+    for expected in EXPECTED_KEPT:
+        holders = [i for i, chunk in enumerate(chunks) if expected in chunk]
+        assert holders and any(keep[i] for i in holders), f"{expected!r} was pruned"
+    assert not all(keep), "nothing was pruned"
+    plant_chunks = [i for i, chunk in enumerate(chunks) if "Indoor Plant Watering" in chunk]
+    assert plant_chunks and not any(keep[i] for i in plant_chunks)
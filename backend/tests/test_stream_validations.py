@@ -0,0 +1,87 @@
+# test_stream_validations.py — the SSE event stream always terminates
+"""
+stream_validations waits on a queue that each call task reports to. A call that
+raises must still be reported (as an "Error: ..." section), otherwise the
+stream never reaches "complete" and the SSE response hangs. A streamed call
+that fails after sending deltas is not retried, since the client appends deltas
+and would show the text twice.
+
+  cd backend && python -m pytest tests/test_stream_validations.py -q
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import validation
+from llm_scheduler import LLMScheduler
+
+REFERENCES = [(f"ref-{i}.md", f"# Reference {i}\n\nClause {i}: the supplier shall comply.\n") for i in range(3)]
+
+def _fake_llm(instructions: str, input_document: str, chunk: str, on_delta=None) -> str:
+    return f"Finding: {len(chunk)} chars"
+
+async def _collect():
+    events = []
+    async for kind, payload in validation.stream_validations("# Input\n\nWe comply.\n", REFERENCES, "", llm_call=_fake_llm):
+        events.append((kind, payload))
+    return events
+
+def test_failing_call_does_not_hang_the_stream(monkeypatch):
+    monkeypatch.setattr(validation, "VALIDATION_CACHE_ENABLED", False)
+    real_run_call = validation._run_call
+
+    async def _run_call(run, group, *args, **kwargs):
+        if run.work[group[0]][0] == 1:
+            raise RuntimeError("scheduler exploded")
+        return await real_run_call(run, group, *args, **kwargs)
+
+    monkeypatch.setattr(validation, "_run_call", _run_call)
+    events = asyncio.run(asyncio.wait_for(_collect(), timeout=10))
+
+    assert events[-1][0] == "complete"
+    chunks = {p["reference_index"]: p["analysis"] for kind, p in events if kind == "chunk"}
+    assert sorted(chunks) == [0, 1, 2]
+    assert chunks[1] == "Error: scheduler exploded"
+    assert chunks[0].startswith("Finding:") and chunks[2].startswith("Finding:")
+
+class APIConnectionError(Exception):
+    """Named like the openai error the scheduler retries."""
+
+def _chunk(text):
+    return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+class _FakeCompletions:
+    def __init__(self, fail_after=None):
+        self.calls = []
+        self.fail_after = fail_after
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+
+        def _stream():
+            for i, text in enumerate(["The supplier ", "complies."]):
+                if i == self.fail_after:
+                    raise APIConnectionError("connection reset")
+                yield _chunk(text)
+        return _stream()
+
+def _streamed_call(monkeypatch, completions):
+    monkeypatch.setattr(validation, "get_openai_client", lambda: SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(validation, "get_scheduler", lambda: LLMScheduler())
+    deltas = []
+    result = validation.validate_document_chunk("", "input", "reference", on_delta=deltas.append)
+    return result, deltas
+
+def test_streamed_call_sends_no_stream_options(monkeypatch):
+    completions = _FakeCompletions()
+    result, deltas = _streamed_call(monkeypatch, completions)
+    assert result == "The supplier complies."
+    assert deltas == ["The supplier ", "complies."]
+    assert "stream_options" not in completions.calls[0]
+
+def test_stream_failing_after_a_delta_is_not_retried(monkeypatch):
+    completions = _FakeCompletions(fail_after=1)
+    result, deltas = _streamed_call(monkeypatch, completions)
+    assert len(completions.calls) == 1
+    assert deltas == ["The supplier "]  # never re-sent
+    assert result.startswith("Error:")
@@ -0,0 +1,155 @@
+# tokens.py — token accounting: one encoder per process, memoized counts, batch encoding
+"""
+Every token count in the backend goes through here:
+
+- get_encoding(): tiktoken encoders are built once per process and reused.
+- count_tokens(): counts are memoized by SHA-256 of the text (bounded LRU), so
+  the same input document, system prompt or template is encoded once, however
+  many references, chunks or scheduler estimates ask for it.
+- count_tokens_batch() / encode_batch(): many texts at once via tiktoken's
+  threaded encode_batch (TOKEN_BATCH_THREADS), used for chunk blocks.
+
+Special-token text (e.g. "<|endoftext|>" inside a document) is counted as
+plain text instead of raising.
+
+CLI (validation setup time vs. number of references, per-reference counting
+vs. this module + precomputed blocks):
+  python tokens.py bench ../sample_data/sow.txt ../sample_data/compliance_guidelines.txt --references 1,10,30
+"""
+
+import argparse
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import tiktoken
+
+ENCODING_NAME = "cl100k_base"
+
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "8192"))
+TOKEN_BATCH_THREADS = int(os.getenv("TOKEN_BATCH_THREADS", "8"))
+# Shorter texts are cheaper to encode than to hash and look up
+MEMO_MIN_CHARS = 256
+
+_memo: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+_memo_lock = threading.Lock()
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "encoded_chars": 0}
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = ENCODING_NAME):
+    return tiktoken.get_encoding(encoding_name)
+
+def encode(text: str, encoding_name: str = ENCODING_NAME) -> List[int]:
+    return get_encoding(encoding_name).encode(text, disallowed_special=())
+
+def encode_batch(texts: Sequence[str], encoding_name: str = ENCODING_NAME) -> List[List[int]]:
+    return get_encoding(encoding_name).encode_batch(list(texts), num_threads=TOKEN_BATCH_THREADS, disallowed_special=())
+
+def _memo_key(text: str, encoding_name: str) -> Tuple[str, str]:
+    return encoding_name, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _memo_get(key: Tuple[str, str]) -> Optional[int]:
+    with _memo_lock:
+        count = _memo.get(key)
+        if count is None:
+            _stats["misses"] += 1
+            return None
+        _memo.move_to_end(key)
+        _stats["hits"] += 1
+        return count
+
+def _memo_put(key: Tuple[str, str], count: int):
+    with _memo_lock:
+        _memo[key] = count
+        _memo.move_to_end(key)
+        while len(_memo) > TOKEN_COUNT_CACHE_SIZE:
+            _memo.popitem(last=False)
+
+def count_tokens(text: str, encoding_name: str = ENCODING_NAME) -> int:
+    if len(text) < MEMO_MIN_CHARS:
+        return len(encode(text, encoding_name))
+    key = _memo_key(text, encoding_name)
+    count = _memo_get(key)
+    if count is None:
+        count = len(encode(text, encoding_name))
+        _stats["encoded_chars"] += len(text)
+        _memo_put(key, count)
+    return count
+
+def count_tokens_batch(texts: Sequence[str], encoding_name: str = ENCODING_NAME) -> List[int]:
+    """Counts for many texts: memo hits are free, the misses are encoded together on threads."""
+    counts: List[Optional[int]] = [None] * len(texts)
+    keys: Dict[int, Tuple[str, str]] = {}
+    for i, text in enumerate(texts):
+        if len(text) >= MEMO_MIN_CHARS:
+            keys[i] = _memo_key(text, encoding_name)
+            counts[i] = _memo_get(keys[i])
+    missing = [i for i, c in enumerate(counts) if c is None]
+    if missing:
+        encoded = encode_batch([texts[i] for i in missing], encoding_name)
+        for i, tokens in zip(missing, encoded):
+            counts[i] = len(tokens)
+            if i in keys:
+                _stats["encoded_chars"] += len(texts[i])
+                _memo_put(keys[i], len(tokens))
+    return counts  # type: ignore[return-value]
+
+def stats() -> Dict[str, int]:
+    with _memo_lock:
+        return {**_stats, "memoized": len(_memo)}
+
+# --------------------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------------------
+
+def _bench(args):
+    from chunking import split_blocks
+    from validation import ReferenceAids, _plan_all
+
+    with open(args.input, encoding="utf-8") as f:
+        input_md = f.read()
+    with open(args.reference, encoding="utf-8") as f:
+        reference_md = f.read()
+    blocks = split_blocks(reference_md)
+    input_tokens = count_tokens(input_md)
+
+    def _per_reference_counting(n: int):
+        # What every validation used to do: fresh encoder lookups, input and prompt re-counted per reference
+        for _ in range(n):
+            encoding = tiktoken.get_encoding(ENCODING_NAME)
+            len(encoding.encode(input_md, disallowed_special=()))
+            tokens = encoding.encode(reference_md, disallowed_special=())
+            [encoding.decode(tokens[i:i + 4000]) for i in range(0, len(tokens), 4000)]
+
+    def _setup(n: int):
+        refs = [(f"ref{i}", reference_md) for i in range(n)]
+        _plan_all(input_md, refs, "", None, [ReferenceAids(blocks=blocks) for _ in refs], input_tokens)
+
+    print(f"Input {len(input_md)} chars ({input_tokens} tokens), reference {len(reference_md)} chars")
+    print(f"{'refs':>5} {'per-reference counting':>24} {'memoized + blocks':>20}")
+    for n in [int(x) for x in args.references.split(",")]:
+        timings = []
+        for fn in (_per_reference_counting, _setup):
+            t = time.perf_counter()
+            fn(n)
+            timings.append((time.perf_counter() - t) * 1000)
+        print(f"{n:>5} {timings[0]:>21.1f} ms {timings[1]:>17.1f} ms")
+    print(f"memo: {stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Token accounting")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Validation setup time as references grow")
+    bench.add_argument("input")
+    bench.add_argument("reference")
+    bench.add_argument("--references", default="1,10,30")
+    args = parser.parse_args()
+    if args.command == "bench":
+        _bench(args)
+
+if __name__ == "__main__":
+    main()
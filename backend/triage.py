@@ -0,0 +1,97 @@
+# triage.py — cheap relevant / not-relevant screen before the full compliance analysis
+"""
+Two-tier validation: before a reference chunk gets the full analysis on the
+validation deployment, a smaller deployment answers one structured question,
+{"relevant": true/false, "reason": "..."}. Only chunks answered relevant go
+on to the full model; the others are reported as screened out.
+
+Routing is per deployment (env):
+  TRIAGE_ROUTES    full deployment -> triage deployment, e.g. "gpt-4.1=gpt-4.1-mini,gpt-4o=gpt-4o-mini"
+  TRIAGE_ENABLED   master switch (default true; no route for a deployment = no triage)
+
+The screen fails open: an error, an empty answer or anything that does not
+parse counts as relevant, so triage can only save calls, never drop a chunk
+by accident. Verdicts are cached with the chunk results (validation.py).
+
+The call is injectable (TriageCall), so the engine can be driven with a fake
+model: run_validations(..., triage_call=lambda instructions, input_document, chunk: ...).
+"""
+
+import json
+import os
+import re
+from typing import Callable, Dict, Optional
+
+from clients import get_openai_client
+from llm_scheduler import get_scheduler
+from prompts import TRIAGE_SYSTEM_PROMPT, get_triage_user_prompt
+
+TRIAGE_ENABLED = os.getenv("TRIAGE_ENABLED", "true").lower() == "true"
+TRIAGE_ROUTES = os.getenv("TRIAGE_ROUTES", "")
+TRIAGE_MAX_TOKENS = int(os.getenv("TRIAGE_MAX_TOKENS", "60"))
+# For cost reporting: USD per 1K prompt tokens on the triage deployment (gpt-4o-mini list price by default)
+TRIAGE_PROMPT_TOKEN_COST_PER_1K = float(os.getenv("TRIAGE_PROMPT_TOKEN_COST_PER_1K", "0.00015"))
+
+# (instructions, input_document, reference_chunk) -> relevant? (None = could not tell; treated as relevant)
+TriageCall = Callable[[str, str, str], Optional[bool]]
+
+def parse_routes(spec: str) -> Dict[str, str]:
+    """'full=triage,full2=triage2' -> {full: triage}"""
+    routes = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        full, _, triage = item.partition("=")
+        if full.strip() and triage.strip():
+            routes[full.strip()] = triage.strip()
+    return routes
+
+_routes = parse_routes(TRIAGE_ROUTES)
+
+def triage_deployment_for(deployment: Optional[str]) -> Optional[str]:
+    """The triage deployment routed for a full-analysis deployment, or None (no triage)."""
+    if not TRIAGE_ENABLED or not deployment:
+        return None
+    return _routes.get(deployment)
+
+def triage_cost_usd(prompt_tokens: int) -> float:
+    return prompt_tokens / 1000 * TRIAGE_PROMPT_TOKEN_COST_PER_1K
+
+_RELEVANT_RE = re.compile(r'"?relevant"?\s*:\s*(true|false)', re.I)
+
+def parse_triage_answer(text: Optional[str]) -> Optional[bool]:
+    """{"relevant": bool, ...} -> bool; tolerates code fences and prose around the object."""
+    if not text:
+        return None
+    try:
+        answer = json.loads(text.strip().strip("`").removeprefix("json").strip())
+        if isinstance(answer, dict) and isinstance(answer.get("relevant"), bool):
+            return answer["relevant"]
+    except ValueError:
+        pass
+    m = _RELEVANT_RE.search(text)
+    return m.group(1).lower() == "true" if m else None
+
+def make_triage_call(deployment: str) -> TriageCall:
+    """A TriageCall on `deployment`, through the shared scheduler."""
+    def _triage(instructions: str, input_document: str, reference_chunk: str) -> Optional[bool]:
+        messages = [
+            {"role": "system", "content": TRIAGE_SYSTEM_PROMPT},
+            {"role": "user", "content": get_triage_user_prompt(instructions, input_document, reference_chunk)},
+        ]
+        try:
+            response = get_scheduler().call(
+                deployment, messages, TRIAGE_MAX_TOKENS,
+                lambda: get_openai_client().chat.completions.create(
+                    model=deployment,
+                    messages=messages,
+                    temperature=0,
+                    max_tokens=TRIAGE_MAX_TOKENS,
+                    response_format={"type": "json_object"},
+                ),
+            )
+            if response.choices:
+                return parse_triage_answer(response.choices[0].message.content)
+            return None
+        except Exception as e:
+            print(f"Error during triage call ({deployment}): {e}")
+            return None
+    return _triage
@@ -0,0 +1,1037 @@
+# validation.py — validation engine for /validate
+"""
+Validates the input document's Markdown against every reference's Markdown:
+
+1) Plan: per reference, compute the token budget left after the input document
+   and prompt overhead, and pack the reference's heading-aware blocks
+   (chunking.py; precomputed at upload) into chunks that fit.
+2) Fan out: every (reference, chunk) LLM call runs concurrently, bounded by
+   VALIDATION_CONCURRENCY across the whole request.
+3) Format: results are reassembled in (reference, chunk) order into the same
+   per-reference Markdown sections as the sequential implementation.
+
+Chunk results are cached on disk (cache.py), keyed by everything that
+determines the answer at temperature 0: input Markdown, reference chunk,
+instructions, system prompt, deployment and chunk size. Repeat runs skip the
+LLM entirely.
+
+Per-reference upload-time artifacts come in as ReferenceAids. When a
+reference's BM25 index (retrieval.py) is supplied, chunks with little
+lexical overlap with the input document are pruned: never sent to the LLM and
+reported in RunStats.chunks_pruned.
+
+References whose results are already in a previous run record (runs.py) are
+not planned or called at all: `prior` maps a reference's content hash to its
+stored chunk analyses, which are merged back in and flagged as reused.
+
+The LLM call is injectable (`llm_call`) so the engine can be driven by a fake
+model with configurable latency.
+
+Chunks that are small next to the budget (typically whole short references)
+are bin-packed, several per LLM call (first-fit decreasing, up to
+VALIDATION_PACK_MAX_SECTIONS per call, same total context as a single call).
+Each section is delimited in the prompt, the model answers with one marked
+part per section, and the parts are split back into the ordinary per-chunk
+results; sections missing from the answer are re-run on their own.
+
+Inputs too large to send whole with every chunk (less than
+VALIDATION_MIN_REFERENCE_TOKENS left for the reference) are split into parts
+of up to VALIDATION_INPUT_PART_TOKENS. The work is then the cross product of
+(input part, reference chunk) pairs, pruned by BM25 with each part as the
+query. Each reference chunk's section merges its pairs' analyses in input order.
+
+With a triage route for the deployment (triage.py, TRIAGE_ROUTES), every chunk
+that missed the cache is first screened by a cheaper deployment with a
+structured relevant / not-relevant question; chunks answered "not relevant"
+are dropped like pruned ones and counted in RunStats.triage_skipped.
+
+stream_validations() runs the same plan but yields events as work completes
+(plan -> per-chunk results, optionally with streamed LLM deltas -> complete),
+for the SSE endpoint /validate/stream.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from cache import SQLiteLRUCache, hash_key
+from clients import get_openai_client
+from llm_scheduler import estimate_prompt_tokens, get_scheduler
+from prompts import (
+    VALIDATION_SYSTEM_PROMPT, get_input_part_note, get_packed_validation_user_prompt, get_validation_user_prompt,
+)
+from chunking import Block, pack_chunks, split_blocks
+from tokens import count_tokens
+from triage import TriageCall, make_triage_call, triage_deployment_for
+from retrieval import (
+    BM25Index, RETRIEVAL_PAIR_THRESHOLD, RETRIEVAL_PRUNE_ENABLED, chunk_scores, pair_scores, select_chunks, tokenize,
+)
+
+load_dotenv()
+
+MODEL_DEPLOYMENT_NAME = os.getenv("MODEL_DEPLOYMENT_NAME")
+
+# Tokenization constants
+MAX_TOKENS = 50000
+
+# Max in-flight validation LLM calls per request (also sizes the worker pool)
+VALIDATION_CONCURRENCY = int(os.getenv("VALIDATION_CONCURRENCY", "8"))
+
+# The OpenAI SDK call is blocking; run it on a dedicated pool instead of the event loop
+_llm_executor = ThreadPoolExecutor(max_workers=VALIDATION_CONCURRENCY, thread_name_prefix="validate")
+
+# Inputs leaving less than this for the reference are split into parts of VALIDATION_INPUT_PART_TOKENS
+VALIDATION_SPLIT_INPUT = os.getenv("VALIDATION_SPLIT_INPUT", "true").lower() == "true"
+VALIDATION_MIN_REFERENCE_TOKENS = int(os.getenv("VALIDATION_MIN_REFERENCE_TOKENS", "8000"))
+VALIDATION_INPUT_PART_TOKENS = int(os.getenv("VALIDATION_INPUT_PART_TOKENS", "20000"))
+
+# For cost reporting: USD per 1K prompt tokens (gpt-4o list price by default)
+PROMPT_TOKEN_COST_PER_1K = float(os.getenv("PROMPT_TOKEN_COST_PER_1K", "0.0025"))
+
+# Persistent chunk-result cache
+VALIDATION_CACHE_ENABLED = os.getenv("VALIDATION_CACHE_ENABLED", "true").lower() == "true"
+VALIDATION_CACHE_PATH = os.getenv("VALIDATION_CACHE_PATH", ".cache/validation_results.sqlite")
+VALIDATION_CACHE_MAX_MB = int(os.getenv("VALIDATION_CACHE_MAX_MB", "256"))
+
+_result_cache: Optional[SQLiteLRUCache] = None
+
+# Several small reference sections per LLM call (1 disables packing)
+VALIDATION_PACK_ENABLED = os.getenv("VALIDATION_PACK_ENABLED", "true").lower() == "true"
+VALIDATION_PACK_MAX_SECTIONS = int(os.getenv("VALIDATION_PACK_MAX_SECTIONS", "4"))
+# Completion tokens per analysis (a packed call asks for this much per section)
+COMPLETION_TOKENS = 1000
+# Section delimiters and answer marker, per packed section (label counted separately)
+PACK_SECTION_OVERHEAD_TOKENS = 40
+
+# (instructions, input_document, reference_chunk) -> Markdown analysis.
+# Streaming runs also pass on_delta=<callable(str)>, called with each text fragment as it arrives.
+LLMCall = Callable[..., str]
+# (instructions, input_document, [(label, reference_chunk), ...]) -> answer with one marked part per section
+PackedLLMCall = Callable[[str, str, List[Tuple[str, str]]], str]
+
+# --------------------------------------------------------------------------
+# Token budget
+# --------------------------------------------------------------------------
+
+@lru_cache(maxsize=None)
+def static_prompt_tokens() -> int:
+    """System prompt + empty user template + safety buffer: the same for every reference and run."""
+    return count_tokens(VALIDATION_SYSTEM_PROMPT) + count_tokens(get_validation_user_prompt("", "", "")) + 50
+
+def prompt_overhead_tokens(input_markdown: str, instructions: str, input_tokens: Optional[int] = None) -> int:
+    """
+    Tokens every chunk call spends before the reference chunk. `input_tokens` is
+    the twin's token count from the manifest when known; counts are memoized otherwise.
+    """
+    if input_tokens is None:
+        input_tokens = count_tokens(input_markdown)
+    return (static_prompt_tokens()
+            + count_tokens(f"Instructions: {instructions}")
+            + count_tokens("Input Document:\n")
+            + input_tokens)
+
+@lru_cache(maxsize=None)
+def packed_prompt_extra_tokens() -> int:
+    """What the packed template adds over the single-section one (instructions to split the answer)."""
+    return max(0, count_tokens(get_packed_validation_user_prompt("", "", []))
+               - count_tokens(get_validation_user_prompt("", "", "")))
+
+def prompt_cost_usd(prompt_tokens: int) -> float:
+    return prompt_tokens / 1000 * PROMPT_TOKEN_COST_PER_1K
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# --------------------------------------------------------------------------
+# LLM call
+# --------------------------------------------------------------------------
+
+@dataclass
+class StreamedCompletion:
+    """A consumed streaming response: the joined text plus its usage (for the scheduler)."""
+    content: str
+    usage: Any = None
+
+class StreamInterrupted(Exception):
+    """A stream failed after deltas were sent on. Not retried: the client would receive them twice."""
+
+def _stream_completion(messages: List[dict], on_delta: Callable[[str], None]) -> StreamedCompletion:
+    # No stream_options={"include_usage": True}: the default AZURE_OPENAI_API_VERSION
+    # rejects it, so the scheduler is settled from a local count of the answer instead
+    stream = get_openai_client().chat.completions.create(
+        model=MODEL_DEPLOYMENT_NAME,
+        messages=messages,
+        temperature=0,
+        max_tokens=COMPLETION_TOKENS,
+        stream=True,
+    )
+    parts: List[str] = []
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                on_delta(chunk.choices[0].delta.content)
+    except Exception as e:
+        if parts:
+            raise StreamInterrupted(f"stream interrupted after {len(parts)} fragment(s): {e}") from e
+        raise
+    content = "".join(parts)
+    usage = SimpleNamespace(total_tokens=estimate_prompt_tokens(messages) + count_tokens(content))
+    return StreamedCompletion(content=content, usage=usage)
+
+def validate_document_chunk(
+    instructions: str,
+    input_document: str,
+    reference_chunk: str,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    user_prompt = get_validation_user_prompt(instructions, input_document, reference_chunk)
+    messages = [
+        {"role": "system", "content": VALIDATION_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+    try:
+        if on_delta is not None:
+            streamed = get_scheduler().call(
+                MODEL_DEPLOYMENT_NAME, messages, COMPLETION_TOKENS, lambda: _stream_completion(messages, on_delta),
+            )
+            return streamed.content or "No response from model"
+        response = get_scheduler().call(
+            MODEL_DEPLOYMENT_NAME, messages, COMPLETION_TOKENS,
+            lambda: get_openai_client().chat.completions.create(
+                model=MODEL_DEPLOYMENT_NAME,
+                messages=messages,
+                temperature=0,
+                max_tokens=COMPLETION_TOKENS
+            ),
+        )
+        if response.choices:
+            return response.choices[0].message.content
+        else:
+            return "No response from model"
+    except Exception as e:
+        print(f"Error during LLM call: {e}")
+        return f"Error: {str(e)}"
+
+def validate_document_sections(
+    instructions: str,
+    input_document: str,
+    reference_sections: List[Tuple[str, str]],
+) -> str:
+    """One call for several (label, reference_chunk) sections; split the answer with split_packed_response()."""
+    user_prompt = get_packed_validation_user_prompt(instructions, input_document, reference_sections)
+    messages = [
+        {"role": "system", "content": VALIDATION_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+    max_tokens = COMPLETION_TOKENS * len(reference_sections)
+    try:
+        response = get_scheduler().call(
+            MODEL_DEPLOYMENT_NAME, messages, max_tokens,
+            lambda: get_openai_client().chat.completions.create(
+                model=MODEL_DEPLOYMENT_NAME,
+                messages=messages,
+                temperature=0,
+                max_tokens=max_tokens
+            ),
+        )
+        if response.choices:
+            return response.choices[0].message.content or ""
+        return "No response from model"
+    except Exception as e:
+        print(f"Error during packed LLM call: {e}")
+        return f"Error: {str(e)}"
+
+_PACKED_MARKER_RE = re.compile(r"^[ \t>#*]*=+[ \t]*REFERENCE SECTION[ \t]+(\d+)[ \t]*=+[ \t*]*$", re.M | re.I)
+
+def split_packed_response(text: str, count: int) -> List[Optional[str]]:
+    """Per-section analyses from a packed answer, in section order; None where a part is missing or empty."""
+    parts: List[Optional[str]] = [None] * count
+    markers = list(_PACKED_MARKER_RE.finditer(text or ""))
+    for m, following in zip(markers, markers[1:] + [None]):
+        index = int(m.group(1)) - 1
+        body = text[m.end():following.start() if following else len(text)].strip()
+        if 0 <= index < count and parts[index] is None and body:
+            parts[index] = body
+    return parts
+
+# --------------------------------------------------------------------------
+# Result cache
+# --------------------------------------------------------------------------
+
+def get_result_cache() -> Optional[SQLiteLRUCache]:
+    global _result_cache
+    if VALIDATION_CACHE_ENABLED and _result_cache is None:
+        _result_cache = SQLiteLRUCache(VALIDATION_CACHE_PATH, VALIDATION_CACHE_MAX_MB * 1024 * 1024)
+    return _result_cache
+
+def result_cache_key(input_markdown: str, reference_chunk: str, instructions: str, chunk_size: int) -> str:
+    return hash_key(
+        input_markdown, reference_chunk, instructions,
+        VALIDATION_SYSTEM_PROMPT, MODEL_DEPLOYMENT_NAME or "", str(chunk_size),
+    )
+
+def _is_cacheable(result: str) -> bool:
+    return bool(result) and not result.startswith("Error:") and result != "No response from model"
+
+# --------------------------------------------------------------------------
+# Plan / format
+# --------------------------------------------------------------------------
+
+@dataclass
+class ReferencePlan:
+    name: str
+    chunks: List[str] = field(default_factory=list)
+    spans: List[Tuple[int, int]] = field(default_factory=list)  # character span of each chunk in the reference
+    chunk_size: int = 0
+    error: Optional[str] = None
+    content_hash: str = ""
+    reused: Optional[List[str]] = None  # chunk analyses taken from a previous run; nothing to call
+    pruned: List[bool] = field(default_factory=list)  # per chunk: skipped by the BM25 pre-filter
+    chunk_tokens: List[int] = field(default_factory=list)
+    pairs: Optional[List[List[int]]] = None  # split input only: per chunk, the input parts to validate it against
+    screened: List[bool] = field(default_factory=list)  # per chunk: answered "not relevant" by triage
+
+@dataclass
+class InputPart:
+    """One part of an input document too large to send whole (text starts with a part note)."""
+    text: str
+    tokens: int
+
+@dataclass
+class ReferenceAids:
+    """Artifacts precomputed for one reference at upload (sidecars next to its twin)."""
+    blocks: Optional[List[Block]] = None   # chunking.py; split in memory when missing
+    index: Optional[BM25Index] = None      # retrieval.py; no pruning when missing
+
+@dataclass
+class RunStats:
+    llm_calls: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    references_reused: int = 0
+    sections_reused: int = 0
+    chunks_pruned: int = 0
+    packed_calls: int = 0   # LLM calls that carried more than one section
+    calls_saved: int = 0    # sections analyzed minus LLM calls made for them
+    pack_fallbacks: int = 0  # sections missing from a packed answer, re-run alone
+    input_parts: int = 0    # 0 unless the input was split
+    pairs_pruned: int = 0   # (input part, reference chunk) pairs skipped by the BM25 pre-filter
+    prompt_tokens: int = 0  # estimated, over the LLM calls made (cache hits and reused sections are free)
+    digest_prompt_tokens: int = 0  # spent condensing the input this run (digest.py); 0 when it was stored
+    triage_calls: int = 0          # relevance screens sent to the triage deployment (cached verdicts are free)
+    triage_skipped: int = 0        # chunks (pairs, for a split input) screened out before the full analysis
+    triage_prompt_tokens: int = 0  # estimated, on the triage deployment
+
+    def as_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+@dataclass
+class ReferenceResult:
+    name: str
+    success: bool
+    message: str
+    raw_output: Optional[str] = None
+    sections: int = 0
+    content_hash: str = ""
+    chunk_size: int = 0
+    chunk_results: List[str] = field(default_factory=list)
+    reused: bool = False
+
+def plan_reference(
+    name: str,
+    input_markdown: str,
+    reference_markdown: str,
+    instructions: str,
+    blocks: Optional[List[Block]] = None,
+    overhead_tokens: Optional[int] = None,
+) -> ReferencePlan:
+    """Split ONE reference into chunks that fit next to the input document and prompt."""
+    try:
+        total_overhead = overhead_tokens
+        if total_overhead is None:
+            total_overhead = prompt_overhead_tokens(input_markdown, instructions)
+        available_tokens = MAX_TOKENS - total_overhead
+
+        if available_tokens <= 1000:
+            return ReferencePlan(
+                name=name,
+                error=f"Input document + overhead ({total_overhead} tokens) is too large. "
+                      f"Available tokens for reference: {available_tokens}"
+            )
+
+        if blocks is None:
+            blocks = split_blocks(reference_markdown)
+        chunks = pack_chunks(blocks, available_tokens)
+        return ReferencePlan(
+            name=name,
+            chunks=[reference_markdown[c.start:c.end] for c in chunks],
+            spans=[(c.start, c.end) for c in chunks],
+            chunk_size=available_tokens,
+            chunk_tokens=[c.tokens for c in chunks],
+        )
+    except Exception as e:
+        return ReferencePlan(name=name, error=f"Error during validation: {str(e)}")
+
+def split_input(input_markdown: str, instructions: str, input_tokens: Optional[int] = None) -> Optional[List[InputPart]]:
+    """Parts of the input when sending it whole would leave too little room for the reference; else None."""
+    if not VALIDATION_SPLIT_INPUT:
+        return None
+    if MAX_TOKENS - prompt_overhead_tokens(input_markdown, instructions, input_tokens) >= VALIDATION_MIN_REFERENCE_TOKENS:
+        return None
+    chunks = pack_chunks(split_blocks(input_markdown), VALIDATION_INPUT_PART_TOKENS)
+    if len(chunks) < 2:
+        return None
+    parts = []
+    for i, c in enumerate(chunks):
+        note = get_input_part_note(i + 1, len(chunks))
+        parts.append(InputPart(text=note + input_markdown[c.start:c.end], tokens=c.tokens + count_tokens(note)))
+    return parts
+
+def section_heading(chunk_index: int) -> str:
+    return f"### Analysis of Reference Section {chunk_index + 1}"
+
+def section_label(plan: ReferencePlan, chunk_index: int) -> str:
+    """How a section is named inside a packed prompt."""
+    return f"{plan.name}, section {chunk_index + 1} of {len(plan.chunks)}"
+
+def packed_section_tokens(plan: ReferencePlan, chunk_index: int) -> int:
+    """Prompt tokens one section adds to a packed call: the chunk, its label and delimiters."""
+    return (plan.chunk_tokens[chunk_index] + PACK_SECTION_OVERHEAD_TOKENS
+            + count_tokens(section_label(plan, chunk_index)))
+
+def format_reference_result(plan: ReferencePlan, chunk_results: List[str]) -> ReferenceResult:
+    """Assemble chunk analyses (in chunk order) into one reference's Markdown."""
+    if plan.error:
+        return ReferenceResult(name=plan.name, success=False, message=plan.error, content_hash=plan.content_hash)
+
+    run_fields = dict(
+        content_hash=plan.content_hash,
+        chunk_size=plan.chunk_size,
+        chunk_results=list(chunk_results),
+        reused=plan.reused is not None,
+    )
+    pruned = sum(plan.pruned)
+    screened = sum(plan.screened)
+    analyzed = f"{len(chunk_results) - pruned - screened} reference document sections"
+    skipped = []
+    if pruned:
+        skipped.append(f"{pruned} skipped as unrelated to the input")
+    if screened:
+        skipped.append(f"{screened} screened out by triage")
+    if skipped:
+        analyzed += f" ({', '.join(skipped)})"
+    sections = []
+    for i, result in enumerate(chunk_results):
+        if result and result.strip():
+            sections.append(f"{section_heading(i)}\n\n{result}")
+
+    if sections:
+        return ReferenceResult(
+            name=plan.name,
+            success=True,
+            message=f"Validation complete. Analyzed {analyzed}.",
+            raw_output="\n\n---\n\n".join(sections),
+            sections=len(sections),
+            **run_fields,
+        )
+    return ReferenceResult(
+        name=plan.name,
+        success=True,
+        message=f"Validation complete. Analyzed {analyzed} with no significant findings.",
+        raw_output="No significant findings or issues identified in the validation.",
+        **run_fields,
+    )
+
+def merge_pair_results(pair_results: List[Tuple[int, str]], part_count: int) -> str:
+    """One reference chunk's analyses against several input parts, as one section (in input order)."""
+    body = "\n\n".join(
+        f"#### Against input document part {part + 1} of {part_count}\n\n{result}"
+        for part, result in sorted(pair_results)
+        if result and result.strip()
+    )
+    failed = sum(1 for _, result in pair_results if not _is_cacheable(result))
+    if failed:
+        # Keeps the section out of caches and run records, like a single failed call
+        return f"Error: {failed} of {len(pair_results)} input part(s) failed for this section.\n\n{body}"
+    return body
+
+def is_reusable(result: ReferenceResult) -> bool:
+    """Only complete, error-free reference results go into a run record (pruned and screened chunks are empty)."""
+    return result.success and bool(result.chunk_results) and all(
+        r == "" or _is_cacheable(r) for r in result.chunk_results
+    )
+
+# --------------------------------------------------------------------------
+# Concurrent fan-out
+# --------------------------------------------------------------------------
+
+@dataclass
+class _RunPlan:
+    plans: List[ReferencePlan]
+    work: List[Tuple[int, int, str, Optional[int]]]  # (reference index, chunk index, chunk, input part or None)
+    keys: List[str]
+    cached: List[Optional[str]]
+    stats: RunStats
+    calls: List[List[int]] = field(default_factory=list)  # work indices per LLM call (cache misses only)
+    input_parts: Optional[List[InputPart]] = None
+    prompt_tokens: List[int] = field(default_factory=list)  # per work item, as a call of its own
+
+    def input_document(self, part: Optional[int]) -> Optional[str]:
+        """The input text a work item is validated against; None means the whole input."""
+        return self.input_parts[part].text if part is not None else None
+
+# Stored results for one reference, as kept in a run record: {"chunk_size", "chunks": [analysis, ...]}
+PriorResults = Dict[str, dict]
+
+def _plan_or_reuse(name: str, input_markdown: str, reference_markdown: str, instructions: str,
+                   prior: Optional[PriorResults], aids: ReferenceAids, overhead_tokens: int) -> ReferencePlan:
+    content_hash = text_hash(reference_markdown)
+    stored = prior.get(content_hash) if prior else None
+    if stored is not None:
+        return ReferencePlan(name=name, chunk_size=stored.get("chunk_size", 0),
+                             content_hash=content_hash, reused=list(stored["chunks"]))
+    plan = plan_reference(name, input_markdown, reference_markdown, instructions, aids.blocks, overhead_tokens)
+    plan.content_hash = content_hash
+    return plan
+
+def _prune_chunks(plans: List[ReferencePlan], aids: List[ReferenceAids], input_markdown: str):
+    """Mark chunks with too little lexical overlap with the input (per-reference relative threshold)."""
+    query_terms = None
+    for plan, aid in zip(plans, aids):
+        if aid.index is None or not plan.chunks:
+            continue
+        if query_terms is None:
+            query_terms = tokenize(input_markdown)
+        keep = select_chunks(chunk_scores(aid.index, plan.spans, query_terms))
+        plan.pruned = [not k for k in keep]
+
+def _pair_chunks(plans: List[ReferencePlan], aids: List[ReferenceAids], input_parts: List[InputPart]):
+    """Split input: pair every chunk with the input parts it overlaps lexically (all parts without an index)."""
+    part_terms = None
+    for plan, aid in zip(plans, aids):
+        if not plan.chunks:
+            continue
+        every_part = list(range(len(input_parts)))
+        if aid.index is None or not RETRIEVAL_PRUNE_ENABLED:
+            plan.pairs = [list(every_part) for _ in plan.chunks]
+            continue
+        if part_terms is None:
+            part_terms = [tokenize(p.text) for p in input_parts]
+        scores = pair_scores(aid.index, plan.spans, part_terms)
+        keep = select_chunks([s for row in scores for s in row], RETRIEVAL_PAIR_THRESHOLD)
+        n = len(plan.chunks)
+        plan.pairs = [[part for part in every_part if keep[part * n + ci]] for ci in range(n)]
+        plan.pruned = [not parts for parts in plan.pairs]
+
+def _plan_all(
+    input_markdown: str,
+    references: List[Tuple[str, str]],
+    instructions: str,
+    prior: Optional[PriorResults],
+    aids: Optional[List[ReferenceAids]],
+    input_tokens: Optional[int] = None,
+    input_parts: Optional[List[InputPart]] = None,
+) -> List[ReferencePlan]:
+    aids = aids or [ReferenceAids() for _ in references]
+    # Identical for every reference: count once per run, not once per reference
+    if input_parts:
+        overhead_tokens = prompt_overhead_tokens("", instructions, max(p.tokens for p in input_parts))
+    else:
+        overhead_tokens = prompt_overhead_tokens(input_markdown, instructions, input_tokens)
+    plans = [
+        _plan_or_reuse(name, input_markdown, md, instructions, prior, aid, overhead_tokens)
+        for (name, md), aid in zip(references, aids)
+    ]
+    if input_parts:
+        _pair_chunks(plans, aids, input_parts)
+    elif RETRIEVAL_PRUNE_ENABLED:
+        _prune_chunks(plans, aids, input_markdown)
+    return plans
+
+def _pack_calls(plans: List[ReferencePlan], work: List[Tuple[int, int, str, Optional[int]]], pending: List[int],
+                max_sections: int = VALIDATION_PACK_MAX_SECTIONS) -> List[List[int]]:
+    """
+    Group pending work items into LLM calls, first-fit decreasing. A packed call
+    must fit the context of a single call: its sections, their delimiters and
+    the extra completion tokens (one analysis per section) share the chunk
+    budget. Chunks that fill the budget on their own stay alone. Only items
+    validated against the same input (part) share a call.
+    """
+    if max_sections < 2:
+        return [[i] for i in pending]
+    extra = packed_prompt_extra_tokens()
+    sizes = {i: packed_section_tokens(plans[work[i][0]], work[i][1]) for i in pending}
+
+    groups: List[List[int]] = []
+    used: List[int] = []
+    capacity: List[int] = []
+    for i in sorted(pending, key=lambda i: -sizes[i]):
+        budget = plans[work[i][0]].chunk_size - extra
+        for g, members in enumerate(groups):
+            fits_in = min(capacity[g], budget)
+            same_input = work[members[0]][3] == work[i][3]
+            if same_input and len(members) < max_sections and used[g] + sizes[i] + COMPLETION_TOKENS <= fits_in:
+                members.append(i)
+                used[g] += sizes[i] + COMPLETION_TOKENS
+                capacity[g] = fits_in
+                break
+        else:
+            groups.append([i])
+            used.append(sizes[i])
+            capacity.append(budget)
+    return sorted((sorted(members) for members in groups), key=lambda members: members[0])
+
+def triage_cache_key(result_key: str, triage_deployment: Optional[str]) -> str:
+    return hash_key("triage", result_key, triage_deployment or "")
+
+async def _screen(
+    work: List[Tuple[int, int, str, Optional[int]]],
+    keys: List[str],
+    pending: List[int],
+    input_documents: List[str],
+    instructions: str,
+    triage_call: TriageCall,
+    concurrency: int,
+) -> Tuple[Dict[int, Optional[bool]], List[int]]:
+    """Triage verdict per pending work item (cached verdicts first), and the items actually sent to triage."""
+    cache = get_result_cache()
+    triage_deployment = triage_deployment_for(MODEL_DEPLOYMENT_NAME)
+    verdict_keys = {i: triage_cache_key(keys[i], triage_deployment) for i in pending}
+    verdicts: Dict[int, Optional[bool]] = {}
+    if cache:
+        stored = await asyncio.to_thread(lambda: {i: cache.get(k) for i, k in verdict_keys.items()})
+        verdicts = {i: v == "1" for i, v in stored.items() if v is not None}
+
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(concurrency)
+
+    def _ask(i: int) -> Optional[bool]:
+        verdict = triage_call(instructions, input_documents[i], work[i][2])
+        if cache and verdict is not None:
+            cache.put(verdict_keys[i], "1" if verdict else "0")
+        return verdict
+
+    async def _one(i: int):
+        async with sem:
+            try:
+                verdicts[i] = await loop.run_in_executor(_llm_executor, _ask, i)
+            except Exception as e:
+                print(f"Error during triage call: {e}")
+                verdicts[i] = None  # fail open
+
+    asked = [i for i in pending if i not in verdicts]
+    await asyncio.gather(*(_one(i) for i in asked))
+    return verdicts, asked
+
+async def _prepare_run(
+    input_markdown: str,
+    references: List[Tuple[str, str]],
+    instructions: str,
+    prior: Optional[PriorResults] = None,
+    aids: Optional[List[ReferenceAids]] = None,
+    input_tokens: Optional[int] = None,
+    pack: bool = False,
+    triage_call: Optional[TriageCall] = None,
+    concurrency: int = VALIDATION_CONCURRENCY,
+) -> _RunPlan:
+    # Tokenizing/chunking/scoring is CPU work; keep it off the event loop
+    input_parts = await asyncio.to_thread(split_input, input_markdown, instructions, input_tokens)
+    plans = await asyncio.to_thread(
+        _plan_all, input_markdown, references, instructions, prior, aids, input_tokens, input_parts,
+    )
+
+    stats = RunStats()
+    stats.references_reused = sum(1 for p in plans if p.reused is not None)
+    stats.sections_reused = sum(1 for p in plans if p.reused for r in p.reused if r and r.strip())
+    stats.chunks_pruned = sum(sum(p.pruned) for p in plans)
+    if input_parts:
+        stats.input_parts = len(input_parts)
+        stats.pairs_pruned = sum(len(input_parts) * len(p.chunks) - sum(map(len, p.pairs)) for p in plans if p.pairs)
+
+    work = [
+        (pi, ci, chunk, part)
+        for pi, plan in enumerate(plans)
+        for ci, chunk in enumerate(plan.chunks)
+        if not (plan.pruned and plan.pruned[ci])
+        for part in (plan.pairs[ci] if plan.pairs is not None else [None])
+    ]
+    input_documents = [input_parts[part].text if part is not None else input_markdown for _, _, _, part in work]
+    cache = get_result_cache()
+    keys = [
+        result_cache_key(document, chunk, instructions, plans[pi].chunk_size)
+        for (pi, _, chunk, _), document in zip(work, input_documents)
+    ]
+    cached = await asyncio.to_thread(lambda: [cache.get(k) for k in keys]) if cache else [None] * len(work)
+
+    # Estimated prompt tokens: the overhead of the input (part) the item is validated against, plus its chunk
+    overheads = {None: prompt_overhead_tokens(input_markdown, instructions, input_tokens)}
+    for k, part in enumerate(input_parts or []):
+        overheads[k] = prompt_overhead_tokens("", instructions, part.tokens)
+    prompt_tokens = [overheads[part] + plans[pi].chunk_tokens[ci] for pi, ci, _, part in work]
+
+    if triage_call is not None:
+        pending = [i for i, hit in enumerate(cached) if hit is None]
+        verdicts, asked = await _screen(work, keys, pending, input_documents, instructions, triage_call, concurrency)
+        stats.triage_calls = len(asked)
+        stats.triage_prompt_tokens = sum(prompt_tokens[i] for i in asked)  # same prompt shape, about the same size
+        kept = [i for i in range(len(work)) if verdicts.get(i) is not False]
+        stats.triage_skipped = len(work) - len(kept)
+        if stats.triage_skipped:
+            remaining: Dict[Tuple[int, int], List[Optional[int]]] = {}
+            for i in kept:
+                remaining.setdefault(work[i][:2], []).append(work[i][3])
+            for i in set(range(len(work))) - set(kept):
+                pi, ci, _, _ = work[i]
+                plan = plans[pi]
+                if not plan.screened:
+                    plan.screened = [False] * len(plan.chunks)
+                if (pi, ci) not in remaining:
+                    plan.screened[ci] = True
+                if plan.pairs is not None:
+                    plan.pairs[ci] = remaining.get((pi, ci), [])
+            work, keys, cached, prompt_tokens = (
+                [seq[i] for i in kept] for seq in (work, keys, cached, prompt_tokens)
+            )
+
+    pending = [i for i, hit in enumerate(cached) if hit is None]
+    if pack and len(pending) > 1:
+        calls = await asyncio.to_thread(_pack_calls, plans, work, pending)
+    else:
+        calls = [[i] for i in pending]
+
+    for call in calls:
+        if len(call) == 1:
+            stats.prompt_tokens += prompt_tokens[call[0]]
+        else:
+            stats.prompt_tokens += (overheads[work[call[0]][3]] + packed_prompt_extra_tokens()
+                                    + sum(packed_section_tokens(plans[work[i][0]], work[i][1]) for i in call))
+    stats.cache_hits = sum(1 for c in cached if c is not None)
+    stats.cache_misses = len(work) - stats.cache_hits if cache else 0
+    stats.llm_calls = len(calls)
+    stats.packed_calls = sum(1 for c in calls if len(c) > 1)
+    stats.calls_saved = len(pending) - len(calls)
+    return _RunPlan(plans=plans, work=work, keys=keys, cached=cached, stats=stats, calls=calls,
+                    input_parts=input_parts, prompt_tokens=prompt_tokens)
+
+def _triage_call_for(llm_call: LLMCall, triage_call: Optional[TriageCall]) -> Optional[TriageCall]:
+    """Triage runs when given, or for the real model when its deployment has a route (an injected llm_call brings its own)."""
+    if triage_call is not None:
+        return triage_call
+    triage_deployment = triage_deployment_for(MODEL_DEPLOYMENT_NAME)
+    if llm_call is validate_document_chunk and triage_deployment:
+        return make_triage_call(triage_deployment)
+    return None
+
+def _packed_call_for(llm_call: LLMCall, packed_llm_call: Optional[PackedLLMCall]) -> Optional[PackedLLMCall]:
+    """Packing needs a multi-section call: the real model has one; an injected llm_call must bring its own."""
+    if not VALIDATION_PACK_ENABLED:
+        return None
+    if packed_llm_call is None and llm_call is validate_document_chunk:
+        return validate_document_sections
+    return packed_llm_call
+
+# (label, reference_chunk, cache key, prompt tokens as a call of its own) for one section of a packed call
+PackedSection = Tuple[str, str, str, int]
+
+def _chunk_runner(
+    input_markdown: str,
+    instructions: str,
+    llm_call: LLMCall,
+    concurrency: int,
+    packed_llm_call: Optional[PackedLLMCall] = None,
+    stats: Optional[RunStats] = None,
+) -> Tuple[Callable[..., Awaitable[str]], Callable[[List[PackedSection]], Awaitable[List[str]]]]:
+    """
+    Returns (run, run_packed):
+      run(chunk, key, cached_hit, on_delta, input_document) -> analysis: cache hit, or a bounded, cached LLM call.
+      run_packed(sections, input_document) -> analyses: one bounded call for several sections, split and
+      cached per section; sections the answer does not cover are re-run alone (stats.pack_fallbacks).
+    input_document defaults to the whole input (a part of it when the input is split).
+    """
+    cache = get_result_cache()
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(concurrency)
+
+    def _call_and_cache(chunk: str, key: str, on_delta: Optional[Callable[[str], None]], input_document: str) -> str:
+        if on_delta is not None:
+            result = llm_call(instructions, input_document, chunk, on_delta=on_delta)
+        else:
+            result = llm_call(instructions, input_document, chunk)
+        if cache and _is_cacheable(result):
+            cache.put(key, result)
+        return result
+
+    async def _run(chunk: str, key: str, hit: Optional[str], on_delta: Optional[Callable[[str], None]] = None,
+                   input_document: Optional[str] = None) -> str:
+        if hit is not None:
+            return hit
+        async with sem:
+            try:
+                return await loop.run_in_executor(
+                    _llm_executor, _call_and_cache, chunk, key, on_delta, input_document or input_markdown,
+                )
+            except Exception as e:
+                print(f"Error during LLM call: {e}")
+                return f"Error: {str(e)}"
+
+    def _packed_call_and_cache(sections: List[PackedSection], input_document: str) -> List[Optional[str]]:
+        answer = packed_llm_call(instructions, input_document, [(label, chunk) for label, chunk, _, _ in sections])
+        parts = split_packed_response(answer, len(sections))
+        for (_, _, key, _), part in zip(sections, parts):
+            if cache and part is not None and _is_cacheable(part):
+                cache.put(key, part)
+        return parts
+
+    async def _run_packed(sections: List[PackedSection], input_document: Optional[str] = None) -> List[str]:
+        async with sem:
+            try:
+                parts = await loop.run_in_executor(
+                    _llm_executor, _packed_call_and_cache, sections, input_document or input_markdown,
+                )
+            except Exception as e:
+                print(f"Error during packed LLM call: {e}")
+                parts = [None] * len(sections)
+        missing = [i for i, part in enumerate(parts) if part is None]
+        if missing:
+            print(f"ℹ️ Packed answer not split for {len(missing)} of {len(sections)} section(s); re-running them alone")
+            if stats is not None:
+                stats.pack_fallbacks += len(missing)
+                stats.llm_calls += len(missing)
+                stats.calls_saved -= len(missing)
+                stats.prompt_tokens += sum(sections[i][3] for i in missing)
+            redone = await asyncio.gather(*(
+                _run(sections[i][1], sections[i][2], None, None, input_document) for i in missing
+            ))
+            for i, output in zip(missing, redone):
+                parts[i] = output
+        return parts  # type: ignore[return-value]
+
+    return _run, _run_packed
+
+async def _run_call(run: _RunPlan, group: List[int], run_chunk, run_packed,
+                    on_delta: Optional[Callable[[str], None]] = None) -> List[str]:
+    """Analyses for one planned call (work indices in `group`); deltas are only streamed for single sections."""
+    input_document = run.input_document(run.work[group[0]][3])
+    if len(group) == 1:
+        index = group[0]
+        return [await run_chunk(run.work[index][2], run.keys[index], None, on_delta, input_document)]
+    return await run_packed([
+        (section_label(run.plans[run.work[i][0]], run.work[i][1]), run.work[i][2], run.keys[i], run.prompt_tokens[i])
+        for i in group
+    ], input_document)
+
+def _section_result(run: _RunPlan, indices: List[int], outputs: List[Optional[str]]) -> str:
+    """One reference chunk's analysis from its work items (one, or one per paired input part)."""
+    if run.input_parts is None:
+        return outputs[indices[0]]
+    return merge_pair_results([(run.work[i][3], outputs[i]) for i in indices], len(run.input_parts))
+
+def _sections(run: _RunPlan) -> Dict[Tuple[int, int], List[int]]:
+    """(reference index, chunk index) -> work indices, in work order."""
+    sections: Dict[Tuple[int, int], List[int]] = {}
+    for index, (pi, ci, _, _) in enumerate(run.work):
+        sections.setdefault((pi, ci), []).append(index)
+    return sections
+
+def _format_run(run: _RunPlan, outputs: List[Optional[str]]) -> List[ReferenceResult]:
+    chunk_results: List[List[str]] = [
+        list(plan.reused) if plan.reused is not None else [""] * len(plan.chunks) for plan in run.plans
+    ]
+    for (pi, ci), indices in _sections(run).items():
+        chunk_results[pi][ci] = _section_result(run, indices, outputs)
+    return [format_reference_result(plan, results) for plan, results in zip(run.plans, chunk_results)]
+
+def _log_plan(run: _RunPlan, references: List[Tuple[str, str]], concurrency: int):
+    details = (f"input split into {run.stats.input_parts} part(s), {run.stats.pairs_pruned} pair(s) pruned, "
+               if run.input_parts else "")
+    if run.stats.triage_calls or run.stats.triage_skipped:
+        details += f"{run.stats.triage_skipped} screened out by triage ({run.stats.triage_calls} screen(s)), "
+    print(f"🧮 Validation plan: {len(references)} reference(s) ({run.stats.references_reused} reused), {details}"
+          f"{len(run.work)} {'pair' if run.input_parts else 'chunk'}(s) after pruning {run.stats.chunks_pruned} chunk(s), "
+          f"{run.stats.cache_hits} cached, "
+          f"{run.stats.llm_calls} LLM call(s) ({run.stats.packed_calls} packed, {run.stats.calls_saved} saved), "
+          f"concurrency {concurrency}")
+
+async def run_validations(
+    input_markdown: str,
+    references: List[Tuple[str, str]],
+    instructions: str,
+    llm_call: LLMCall = validate_document_chunk,
+    concurrency: int = VALIDATION_CONCURRENCY,
+    prior: Optional[PriorResults] = None,
+    aids: Optional[List[ReferenceAids]] = None,
+    input_tokens: Optional[int] = None,
+    packed_llm_call: Optional[PackedLLMCall] = None,
+    triage_call: Optional[TriageCall] = None,
+) -> Tuple[List[ReferenceResult], RunStats]:
+    """
+    Validate the input against every (name, markdown) reference. All chunk calls
+    across all references run concurrently (at most `concurrency` at a time);
+    results come back in reference order with sections in chunk order.
+    Cached chunk results are reused without calling the LLM, and references
+    found in `prior` (by content hash) are not re-validated at all. `aids`
+    (aligned with `references`) supplies precomputed blocks and BM25 indexes;
+    `input_tokens` is the input twin's count from the manifest, if known.
+    Small sections are packed several per call through `packed_llm_call`
+    (the real model's by default; a fake llm_call packs only if given one).
+    `triage_call` screens chunks first (the routed triage deployment by default).
+    """
+    packed_llm_call = _packed_call_for(llm_call, packed_llm_call)
+    run = await _prepare_run(input_markdown, references, instructions, prior, aids, input_tokens,
+                             pack=packed_llm_call is not None, triage_call=_triage_call_for(llm_call, triage_call),
+                             concurrency=concurrency)
+    run_chunk, run_packed = _chunk_runner(input_markdown, instructions, llm_call, concurrency, packed_llm_call, run.stats)
+
+    _log_plan(run, references, concurrency)
+    outputs = list(run.cached)
+    call_outputs = await asyncio.gather(*(_run_call(run, group, run_chunk, run_packed) for group in run.calls))
+    for group, group_outputs in zip(run.calls, call_outputs):
+        for index, output in zip(group, group_outputs):
+            outputs[index] = output
+    return _format_run(run, outputs), run.stats
+
+async def stream_validations(
+    input_markdown: str,
+    references: List[Tuple[str, str]],
+    instructions: str,
+    llm_call: LLMCall = validate_document_chunk,
+    concurrency: int = VALIDATION_CONCURRENCY,
+    stream_deltas: bool = False,
+    prior: Optional[PriorResults] = None,
+    aids: Optional[List[ReferenceAids]] = None,
+    input_tokens: Optional[int] = None,
+    packed_llm_call: Optional[PackedLLMCall] = None,
+    triage_call: Optional[TriageCall] = None,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Same work as run_validations, yielded as (event, payload) while it happens:
+
+      ("plan",     {"references": [{"name", "chunks", "error", "reused", "pruned", "screened"}], "total_chunks",
+                    "cached", "llm_calls", "packed_calls", "reused", "pruned", "input_parts", "screened"})
+      ("delta",    {"reference_index", "chunk_index", "text"})            only with stream_deltas
+      ("chunk",    {"reference", "reference_index", "chunk_index", "heading", "analysis",
+                    "cached", "reused", "completed", "total_chunks"})     in completion order
+      ("complete", {"results": List[ReferenceResult], "stats": RunStats})
+
+    Reused sections and cache hits are emitted first, right after the plan.
+    Sections of a packed call arrive together when the call completes (no deltas).
+    With a split input, a chunk event is sent once all of that reference chunk's
+    pairs are done, with the merged analysis (no deltas for pairs).
+    """
+    packed_llm_call = _packed_call_for(llm_call, packed_llm_call)
+    run = await _prepare_run(input_markdown, references, instructions, prior, aids, input_tokens,
+                             pack=packed_llm_call is not None, triage_call=_triage_call_for(llm_call, triage_call),
+                             concurrency=concurrency)
+    run_chunk, run_packed = _chunk_runner(input_markdown, instructions, llm_call, concurrency, packed_llm_call, run.stats)
+    _log_plan(run, references, concurrency)
+
+    reused = [(pi, ci, analysis) for pi, p in enumerate(run.plans) if p.reused for ci, analysis in enumerate(p.reused)]
+    sections = _sections(run)
+    remaining = {section: len(indices) for section, indices in sections.items()}
+    total_chunks = len(sections) + len(reused)
+    yield "plan", {
+        "references": [
+            {"name": p.name, "chunks": len(p.reused if p.reused is not None else p.chunks),
+             "error": p.error, "reused": p.reused is not None, "pruned": sum(p.pruned),
+             "screened": sum(p.screened)}
+            for p in run.plans
+        ],
+        "total_chunks": total_chunks,
+        "cached": run.stats.cache_hits,
+        "llm_calls": run.stats.llm_calls,
+        "packed_calls": run.stats.packed_calls,
+        "reused": len(reused),
+        "pruned": run.stats.chunks_pruned,
+        "input_parts": run.stats.input_parts,
+        "screened": run.stats.triage_skipped,
+    }
+
+    completed = 0
+
+    def _chunk_event(pi: int, ci: int, analysis: str, cached: bool, reused: bool) -> dict:
+        return {
+            "reference": run.plans[pi].name,
+            "reference_index": pi,
+            "chunk_index": ci,
+            "heading": section_heading(ci),
+            "analysis": analysis,
+            "cached": cached,
+            "reused": reused,
+            "completed": completed,
+            "total_chunks": total_chunks,
+        }
+
+    for pi, ci, analysis in reused:
+        completed += 1
+        yield "chunk", _chunk_event(pi, ci, analysis, cached=True, reused=True)
+
+    def _finish(index: int) -> Optional[Tuple[int, int]]:
+        """Count one work item done; returns its (reference, chunk) once all of that section's items are."""
+        pi, ci, _, _ = run.work[index]
+        remaining[(pi, ci)] -= 1
+        return (pi, ci) if remaining[(pi, ci)] == 0 else None
+
+    # Cache hits need no call; send them before anything is awaited
+    outputs = list(run.cached)
+    for index, hit in enumerate(run.cached):
+        done = _finish(index) if hit is not None else None
+        if done:
+            completed += 1
+            cached = all(run.cached[i] is not None for i in sections[done])
+            yield "chunk", _chunk_event(*done, _section_result(run, sections[done], outputs), cached=cached, reused=False)
+
+    loop = asyncio.get_running_loop()
+    events: "asyncio.Queue[Tuple[str, Any]]" = asyncio.Queue()
+
+    def _delta_sink(pi: int, ci: int) -> Optional[Callable[[str], None]]:
+        if not stream_deltas:
+            return None
+        # Called on the LLM worker thread; hand the fragment to the event loop
+        def _on_delta(text: str):
+            loop.call_soon_threadsafe(
+                events.put_nowait, ("delta", {"reference_index": pi, "chunk_index": ci, "text": text})
+            )
+        return _on_delta
+
+    async def _run_one(call_index: int) -> List[str]:
+        group = run.calls[call_index]
+        pi, ci, _, part = run.work[group[0]]
+        on_delta = _delta_sink(pi, ci) if len(group) == 1 and part is None else None
+        try:
+            return await _run_call(run, group, run_chunk, run_packed, on_delta)
+        except Exception as e:
+            print(f"Error during LLM call: {e}")
+            return [f"Error: {str(e)}"] * len(group)
+        finally:
+            # Always report the call, or the consumer below would wait for its sections forever
+            events.put_nowait(("call", call_index))
+
+    tasks = [asyncio.create_task(_run_one(c)) for c in range(len(run.calls))]
+    try:
+        while completed < total_chunks:
+            kind, payload = await events.get()
+            if kind == "delta":
+                yield kind, payload
+                continue
+            for index, output in zip(run.calls[payload], tasks[payload].result()):
+                outputs[index] = output
+                done = _finish(index)
+                if done:
+                    completed += 1
+                    yield "chunk", _chunk_event(*done, _section_result(run, sections[done], outputs),
+                                                cached=False, reused=False)
+    finally:
+        # Client went away mid-run: stop waiting on (and paying for) queued calls
+        for task in tasks:
+            task.cancel()
+
+    yield "complete", {"results": _format_run(run, outputs), "stats": run.stats}
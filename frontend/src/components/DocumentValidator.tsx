@@ -11,6 +11,22 @@ interface ValidationResult {
   raw_output?: string;
 }
 
+// Events from POST /validate/stream (Server-Sent Events)
+interface ValidationPlan {
+  input: string;
+  references: { name: string; chunks: number; error?: string | null }[];
+  total_chunks: number;
+  cached: number;
+  llm_calls: number;
+}
+
+interface ChunkEvent {
+  reference_index: number;
+  chunk_index: number;
+  analysis?: string;
+  text?: string;
+}
+
 interface UploadResponse {
   success: boolean;
   message: string;
@@ -228,6 +244,18 @@ const DocumentValidator: React.FC = () => {
     }
   };
 
+  // Same layout the backend uses for the final report, built from the sections received so far
+  const renderPartialResults = (plan: ValidationPlan, sections: Record<string, string>): string =>
+    plan.references.map((ref, ri) => {
+      const body = ref.error
+        ? `> Validation error: ${ref.error}`
+        : Array.from({ length: ref.chunks }, (_, ci) => sections[`${ri}:${ci}`])
+            .map((text, ci) => (text && text.trim() ? `### Analysis of Reference Section ${ci + 1}\n\n${text}` : null))
+            .filter(Boolean)
+            .join('\n\n');
+      return `## Analysis of input document against **${ref.name}**\n\n${body || '_Waiting for results..._'}`;
+    }).join('\n\n---\n\n');
+
   const runValidation = async (): Promise<void> => {
     setIsRunning(true);
     setError(null);
@@ -237,19 +265,69 @@ const DocumentValidator: React.FC = () => {
       // Backend auto-discovers latest input + all references; we only pass optional instructions
       const formData = new FormData();
       formData.append('instructions', instructions);
+      formData.append('stream_deltas', 'true');
 
-      const response = await fetch(`${API_BASE_URL}/validate`, {
+      const response = await fetch(`${API_BASE_URL}/validate/stream`, {
         method: 'POST',
         body: formData,
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         const errorData = await response.json().catch(() => ({ detail: 'Validation failed' }));
         throw new Error(errorData.detail?.message || errorData.detail || `HTTP error! status: ${response.status}`);
       }
 
-      const data: ValidationResult = await response.json();
-      setResults(data);
+      // Show findings as each section finishes instead of waiting for the whole run
+      let plan: ValidationPlan | null = null;
+      const sections: Record<string, string> = {};
+      let completed = 0;
+
+      const handleEvent = (event: string, data: any) => {
+        if (event === 'plan') {
+          plan = data as ValidationPlan;
+        } else if (event === 'delta') {
+          const delta = data as ChunkEvent;
+          const key = `${delta.reference_index}:${delta.chunk_index}`;
+          sections[key] = (sections[key] || '') + (delta.text || '');
+        } else if (event === 'chunk') {
+          const chunk = data as ChunkEvent;
+          sections[`${chunk.reference_index}:${chunk.chunk_index}`] = chunk.analysis || '';
+          completed = data.completed;
+        } else if (event === 'summary') {
+          setResults(data as ValidationResult);
+          return;
+        } else if (event === 'error') {
+          throw new Error(data.message);
+        }
+        if (plan) {
+          setResults({
+            success: true,
+            message: `Validating ${plan.input}... ${completed}/${plan.total_chunks} section(s) done (${plan.cached} cached)`,
+            raw_output: renderPartialResults(plan, sections),
+          });
+        }
+      };
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const frame = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          let event = 'message';
+          let data = '';
+          for (const line of frame.split('\n')) {
+            if (line.startsWith('event: ')) event = line.slice(7);
+            else if (line.startsWith('data: ')) data += line.slice(6);
+          }
+          if (data) handleEvent(event, JSON.parse(data));
+        }
+      }
     } catch (err) {
       const errorMessage = err instanceof Error ? err.message : 'An unknown error occurred';
       setError(errorMessage);
@@ -0,0 +1,145 @@
+# bench_storage.py — storage latency under mixed load: blocking sync SDK vs. backend/storage.py
+"""
+Runs the same random mix of list / exists / download / upload operations from
+concurrent simulated requests twice: once with the sync SDK called straight
+from the coroutines (the pre-aio code path, which blocks the event loop) and
+once through the async helpers in storage.py. Prints op latency percentiles
+per kind and the event-loop lag seen by a 10 ms timer.
+Needs a real storage account; files go to <user_id>/.storage-bench/ and are removed.
+
+  python scripts/bench_storage.py <user_id> --clients 16 --ops 400
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List
+
+# Backend modules import each other by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.filedatalake.aio import FileSystemClient
+from clients import get_shared_credential
+from storage import (
+    CONTAINER_NAME,
+    STORAGE_ACCOUNT_NAME,
+    adls_path_exists,
+    close_adls_client,
+    download_file_from_adls,
+    ensure_user_folders_exist,
+    list_files_in_directory_detailed,
+    upload_file_to_adls,
+)
+
+BENCH_FILES = 8
+BENCH_FILE_BYTES = 64 * 1024
+OP_KINDS = ("list", "exists", "download", "upload")
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+def _sync_ops(bench_dir: str) -> Dict[str, Callable[[str, bytes], None]]:
+    """The pre-aio code path: the sync SDK called straight from the coroutine (blocks the loop)."""
+    from azure.storage.filedatalake import DataLakeServiceClient as SyncDataLakeServiceClient
+
+    service = SyncDataLakeServiceClient(
+        account_url=f"https://{STORAGE_ACCOUNT_NAME}.dfs.core.windows.net/",
+        credential=get_shared_credential(),
+    )
+    fs = service.get_file_system_client(CONTAINER_NAME)
+
+    def _list(path: str, data: bytes):
+        for p in fs.get_paths(path=bench_dir, recursive=False):
+            fs.get_file_client(p.name).get_file_properties()
+
+    return {
+        "list": _list,
+        "exists": lambda path, data: fs.get_file_client(path).exists(),
+        "download": lambda path, data: fs.get_file_client(path).download_file().readall(),
+        "upload": lambda path, data: fs.get_file_client(path).upload_data(data, overwrite=True),
+    }
+
+def _async_ops(fs: FileSystemClient, bench_dir: str) -> Dict[str, Callable[[str, bytes], Awaitable]]:
+    return {
+        "list": lambda path, data: list_files_in_directory_detailed(fs, bench_dir),
+        "exists": lambda path, data: adls_path_exists(fs, path),
+        "download": lambda path, data: download_file_from_adls(fs, path),
+        "upload": lambda path, data: upload_file_to_adls(fs, data, path),
+    }
+
+async def _run_mixed_load(ops: Dict[str, Callable], blocking: bool, paths: List[str], clients: int, total_ops: int):
+    """-> (op latencies by kind, event-loop lag samples, wall seconds)"""
+    rng = random.Random(0)
+    plan = [(rng.choice(OP_KINDS), rng.choice(paths)) for _ in range(total_ops)]
+    payload = os.urandom(BENCH_FILE_BYTES)
+    latencies: Dict[str, List[float]] = {kind: [] for kind in OP_KINDS}
+    lag: List[float] = []
+    running = True
+
+    async def _probe():
+        # How late a 10 ms timer fires = how long other requests would wait for the loop
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag.append(time.perf_counter() - started - 0.01)
+
+    async def _client(mine: List[tuple]):
+        for kind, path in mine:
+            started = time.perf_counter()
+            if blocking:
+                ops[kind](path, payload)
+                await asyncio.sleep(0)  # the old routes yielded only between awaits
+            else:
+                await ops[kind](path, payload)
+            latencies[kind].append(time.perf_counter() - started)
+
+    probe = asyncio.create_task(_probe())
+    started = time.perf_counter()
+    await asyncio.gather(*(_client(plan[i::clients]) for i in range(clients)))
+    wall = time.perf_counter() - started
+    running = False
+    await probe
+    return latencies, lag, wall
+
+async def _bench(user_id: str, clients: int, total_ops: int):
+    fs = await ensure_user_folders_exist(user_id)
+    bench_dir = f"{user_id}/.storage-bench"
+    paths = [f"{bench_dir}/file-{i}.bin" for i in range(BENCH_FILES)]
+    try:
+        await asyncio.gather(*(upload_file_to_adls(fs, os.urandom(BENCH_FILE_BYTES), p) for p in paths))
+        modes = (("sync SDK on the loop", _sync_ops(bench_dir), True), ("aio (storage.py)", _async_ops(fs, bench_dir), False))
+        print(f"📦 {total_ops} mixed op(s) ({', '.join(OP_KINDS)}) from {clients} concurrent client(s), "
+              f"{BENCH_FILES} file(s) of {BENCH_FILE_BYTES // 1024} KB")
+        for label, ops, blocking in modes:
+            latencies, lag, wall = await _run_mixed_load(ops, blocking, paths, clients, total_ops)
+            every = [v for values in latencies.values() for v in values]
+            print(f"\n{label}: {wall:.2f}s wall, {len(every) / wall:.1f} ops/s")
+            print(f"  all ops   p50={_percentile(every, 0.5) * 1000:7.1f}ms p99={_percentile(every, 0.99) * 1000:7.1f}ms")
+            for kind in OP_KINDS:
+                if latencies[kind]:
+                    print(f"  {kind:<9} p50={_percentile(latencies[kind], 0.5) * 1000:7.1f}ms "
+                          f"p99={_percentile(latencies[kind], 0.99) * 1000:7.1f}ms (n={len(latencies[kind])})")
+            if lag:
+                print(f"  loop lag  p50={_percentile(lag, 0.5) * 1000:7.1f}ms p99={_percentile(lag, 0.99) * 1000:7.1f}ms "
+                      f"max={max(lag) * 1000:.1f}ms")
+    finally:
+        try:
+            await fs.get_directory_client(bench_dir).delete_directory()
+        except ResourceNotFoundError:
+            pass
+        await close_adls_client()
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed-load latency: blocking sync SDK on the event loop vs. aio helpers")
+    parser.add_argument("user_id", help="User namespace to run in (files go to <user_id>/.storage-bench/ and are removed)")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent simulated requests")
+    parser.add_argument("--ops", type=int, default=400, help="Total storage operations per mode")
+    args = parser.parse_args()
+    asyncio.run(_bench(args.user_id, args.clients, args.ops))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# bench_upload_memory.py — peak RSS of one large upload: whole file in memory vs. streamed blocks
+"""
+Uploads one generated file twice through backend/storage.py:
+
+  whole     read into memory + a single append (the pre-streaming upload path)
+  streamed  upload_local_file_to_adls: UPLOAD_BLOCK_BYTES appends,
+            UPLOAD_PARALLEL_BLOCKS in flight
+
+Each mode runs in a fresh interpreter (ru_maxrss is a high-water mark and never
+goes down) and reports its peak RSS and the growth over its baseline. Streamed
+growth should stay near block size x parallelism whatever the file size.
+Needs a real storage account; files go to <user_id>/.storage-bench/ and are removed.
+Peak RSS comes from getrusage, so this runs on Linux/macOS only.
+
+  python scripts/bench_upload_memory.py <user_id> --mb 200
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Backend modules import each other by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+from azure.core.exceptions import ResourceNotFoundError
+from storage import (
+    UPLOAD_BLOCK_BYTES,
+    UPLOAD_PARALLEL_BLOCKS,
+    close_adls_client,
+    ensure_user_folders_exist,
+    upload_file_to_adls,
+    upload_local_file_to_adls,
+)
+
+UPLOAD_MODES = ("whole", "streamed")
+
+def _peak_rss_mb() -> float:
+    import resource  # Unix only
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB elsewhere
+
+async def _upload_once(user_id: str, mode: str, local_path: str):
+    """One upload in this process; prints 'rss <baseline MB> <peak MB> <seconds>' for the parent."""
+    fs = await ensure_user_folders_exist(user_id)
+    path = f"{user_id}/.storage-bench/upload-{mode}.bin"
+    baseline = _peak_rss_mb()
+    started = time.perf_counter()
+    try:
+        if mode == "whole":
+            with open(local_path, "rb") as f:
+                data = f.read()
+            await upload_file_to_adls(fs, data, path)
+            del data
+        else:
+            await upload_local_file_to_adls(fs, local_path, path)
+        elapsed = time.perf_counter() - started
+    finally:
+        try:
+            await fs.get_directory_client(f"{user_id}/.storage-bench").delete_directory()
+        except ResourceNotFoundError:
+            pass
+        await close_adls_client()
+    print(f"rss {baseline:.1f} {_peak_rss_mb():.1f} {elapsed:.2f}")
+
+def _bench(user_id: str, size_mb: int):
+    with tempfile.NamedTemporaryFile(prefix="upload-bench-", suffix=".bin", delete=False) as tmp:
+        for _ in range(size_mb):
+            tmp.write(os.urandom(1024 * 1024))
+    try:
+        print(f"📦 {size_mb} MB upload, block {UPLOAD_BLOCK_BYTES // (1024 * 1024)} MB x {UPLOAD_PARALLEL_BLOCKS} in flight")
+        for mode in UPLOAD_MODES:
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), user_id, "--mode", mode, "--file", tmp.name],
+                capture_output=True, text=True,
+            )
+            line = next((l for l in proc.stdout.splitlines() if l.startswith("rss ")), None)
+            if proc.returncode != 0 or line is None:
+                print(f"❌ {mode}: upload failed\n{proc.stderr.strip()}")
+                continue
+            _, baseline, peak, elapsed = line.split()
+            growth = float(peak) - float(baseline)
+            print(f"  {mode:<9} peak RSS {float(peak):8.1f} MB (+{growth:7.1f} MB over baseline)  {float(elapsed):6.2f}s")
+    finally:
+        os.remove(tmp.name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS of one large upload: whole-file vs. streamed")
+    parser.add_argument("user_id", help="User namespace to run in (files go to <user_id>/.storage-bench/ and are removed)")
+    parser.add_argument("--mb", type=int, default=200, help="Upload size in MB")
+    parser.add_argument("--mode", choices=UPLOAD_MODES, help=argparse.SUPPRESS)  # child process
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        asyncio.run(_upload_once(args.user_id, args.mode, args.file))
+    else:
+        _bench(args.user_id, args.mb)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# bench_validation.py — validation wall time vs. concurrency, against a fake model
+"""
+Runs the same reference set through validation.run_validations at several
+concurrency levels with a fake LLM that sleeps a fixed latency per call. The
+result cache is off so every call is made; wall time and speedup are printed
+per level and the run fails if the output differs from the one-at-a-time run.
+Levels above VALIDATION_CONCURRENCY are capped (size of the LLM worker pool).
+
+  python scripts/bench_validation.py sample_data/sow.txt sample_data/compliance_guidelines.txt \\
+      --instructions sample_data/instructions.txt --references 12 --latency 0.5 --concurrency 1 4 8
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Backend modules import each other by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+import validation
+from validation import VALIDATION_CONCURRENCY, run_validations, text_hash
+
+def _bench(args):
+    validation.VALIDATION_CACHE_ENABLED = False  # every chunk must reach the (fake) model
+
+    with open(args.input, encoding="utf-8") as f:
+        input_md = f.read()
+    texts = []
+    for path in args.references:
+        with open(path, encoding="utf-8") as f:
+            texts.append((os.path.basename(path), f.read()))
+    references = [(f"{name} #{i // len(texts) + 1}", text) for i, (name, text) in
+                  ((i, texts[i % len(texts)]) for i in range(max(args.references_count, len(texts))))]
+    instructions = ""
+    if args.instructions:
+        with open(args.instructions, encoding="utf-8") as f:
+            instructions = f.read()
+
+    def _fake_llm(instructions: str, input_document: str, chunk: str, on_delta=None) -> str:
+        time.sleep(args.latency)
+        return f"Finding for chunk {text_hash(chunk)[:12]} ({len(chunk)} chars)"
+
+    levels = [min(level, VALIDATION_CONCURRENCY) for level in args.concurrency]
+    if levels != args.concurrency:
+        print(f"ℹ️ Levels capped at VALIDATION_CONCURRENCY={VALIDATION_CONCURRENCY} (size of the LLM worker pool)")
+
+    print(f"{len(references)} reference(s), fake model latency {args.latency:.2f}s per call")
+    print(f"{'concurrency':>11} {'calls':>6} {'wall':>8} {'speedup':>8}  output")
+    baseline_outputs, baseline_s = None, None
+    for level in levels:
+        started = time.perf_counter()
+        results, stats = asyncio.run(run_validations(input_md, references, instructions, llm_call=_fake_llm, concurrency=level))
+        elapsed = time.perf_counter() - started
+        outputs = [r.raw_output for r in results]
+        if baseline_outputs is None:
+            baseline_outputs, baseline_s = outputs, elapsed
+        same = "identical" if outputs == baseline_outputs else "DIFFERS"
+        print(f"{level:>11} {stats.llm_calls:>6} {elapsed:>7.2f}s {baseline_s / elapsed:>7.1f}x  {same}")
+        if outputs != baseline_outputs:
+            raise SystemExit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Validation wall time vs. concurrency with a fake model of fixed latency")
+    parser.add_argument("input")
+    parser.add_argument("references", nargs="+")
+    parser.add_argument("--instructions", default="")
+    parser.add_argument("--references", dest="references_count", type=int, default=12,
+                        help="Reference set size (the given files are repeated to reach it)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per fake LLM call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    _bench(parser.parse_args())
+
+if __name__ == "__main__":
+    main()
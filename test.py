@@ -3,7 +3,7 @@
 # Implementation of policy analysis workflow using Azure AI Inference SDK
 
 import os
-import tiktoken
+import sys
 from dotenv import load_dotenv
 from azure.ai.inference import ChatCompletionsClient
 from azure.ai.inference.models import (
@@ -12,6 +12,12 @@ from azure.ai.inference.models import (
 )
 from azure.core.credentials import AzureKeyCredential
 
+# Backend modules import each other by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from llm_scheduler import get_scheduler
+from chunking import chunk_markdown
+from tokens import count_tokens
+
 load_dotenv()
 
 # Set up client using environment-based values
@@ -26,12 +32,6 @@ client = ChatCompletionsClient(
 
 # Constants
 MAX_TOKENS = 50000  # Maximum context window size
-ENCODING_NAME = "cl100k_base"  # Encoding for token counting (appropriate for GPT-4)
-
-def count_tokens(text, encoding_name=ENCODING_NAME):
-    """Count the number of tokens in a text string"""
-    encoding = tiktoken.get_encoding(encoding_name)
-    return len(encoding.encode(text))
 
 def load_document(file_path):
     """Load document content from a file"""
@@ -42,16 +42,9 @@ def load_document(file_path):
         print(f"Error loading {file_path}: {e}")
         return ""
 
-def chunk_document(document, max_chunk_size, encoding_name=ENCODING_NAME):
-    """Split document into chunks of approximately max_chunk_size tokens"""
-    encoding = tiktoken.get_encoding(encoding_name)
-    tokens = encoding.encode(document)
-    chunks = []
-    
-    for i in range(0, len(tokens), max_chunk_size):
-        chunk_tokens = tokens[i:i+max_chunk_size]
-        chunks.append(encoding.decode(chunk_tokens))
-    
+def chunk_document(document, max_chunk_size):
+    """Split document into chunks of at most max_chunk_size tokens, on headings/paragraphs where possible"""
+    chunks, _ = chunk_markdown(document, max_chunk_size)
     return chunks
 
 def analyze_policy(sow_content, policy_chunk):
@@ -75,9 +68,12 @@ def analyze_policy(sow_content, policy_chunk):
     ]
     
     try:
-        response = client.complete(
-            messages=messages,
-            model=model_name
+        response = get_scheduler().call(
+            model_name, messages, None,
+            lambda: client.complete(
+                messages=messages,
+                model=model_name
+            ),
         )
         
         if response.choices: